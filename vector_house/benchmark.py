@@ -1,11 +1,28 @@
 from vector_house.database import WikiDatabase
-from vector_house.indexer import recreate_index
-from vector_house.search_engine import search, find_vectors
-from typing import Callable
+from vector_house.indexer import recreate_index, INDEX_STAGES
+from vector_house.search_engine import find_pages, TOP_K
+from vector_house.query_eval import max_score_search
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.embedding import AnnIndex
+from vector_house.profiling import StageTimer, summarize, PERCENTILES
+from vector_house.synthetic import synthetic_pages
+from vector_house.defaults import (
+    LATENCY_RUNS,
+    REGRESSION_THRESHOLD,
+    ENGINE_DB,
+    ENGINE_MATRIX,
+    ENGINE_MAXSCORE,
+)
+from typing import Callable, List, Dict, Tuple
 import numpy as np
 import os
 import os.path
+import sys
+import csv
+import json
 import time
+import resource
+import subprocess
 
 BETTER_FIND_PREFIX = "BR" # benchmark result
 BENCHMARK_DIR = "benchmark"
@@ -14,6 +31,15 @@ sizes = [1000, 2000, 4000, 8000, 16000]
 limits = [0, 200, 800]
 top_docs = [0, 200, 400]
 
+# Stages of a query timed by the latency suite
+QUERY_STAGES = ["fetch", "assembly", "scoring", "top_k", "titles"]
+# Slowdowns smaller than this many ms are considered noise
+REGRESSION_MIN_MS = 0.1
+# Columns of the latency results
+RESULT_FIELDS = (
+    ["db", "engine", "mode", "stage"] + [f"p{x}" for x in PERCENTILES] + ["qps"]
+)
+
 
 def iterate(fun: Callable[[str, int, int, int, bool], None]):
     """size, limit, top_docs, sequential"""
@@ -26,7 +52,7 @@ def iterate(fun: Callable[[str, int, int, int, bool], None]):
                 fun(db_name, size, limit, top_doc, True)
 
 
-def create_indexes():
+def create_indexes(synthetic: bool = False):
     if not os.path.isdir(BENCHMARK_DIR):
         os.mkdir(BENCHMARK_DIR)
 
@@ -41,15 +67,125 @@ def create_indexes():
             return
 
         print(f"Creating name {db_name}")
-        wiki_db = WikiDatabase(db_name)
-        wiki_db.connect_database()
-        wiki_db.create_if_needed()
-        recreate_index(size, limit, top_docs, wiki_db)
+        print_build(measure_build(db_name, size, limit, top_docs, synthetic=synthetic))
 
     iterate(create_index)
     print("Done")
 
 
+def build_and_measure(
+    db_name: str,
+    size: int,
+    limit: int,
+    top_docs: int,
+    workers: int = 1,
+    synthetic: bool = False,
+) -> Dict:
+    """
+    Builds the index in this process
+    Returns the pages indexed, the time of the build and each of it's stages
+    in seconds and the peak memory of this process and of the worker processes
+    synthetic - index generated pages instead of the dump
+    """
+
+    timer = StageTimer()
+    wiki_db = WikiDatabase(db_name)
+    pages = synthetic_pages(size) if synthetic else None
+    start_time = time.perf_counter()
+    recreate_index(
+        size, limit, top_docs, wiki_db, workers=workers, timer=timer, pages=pages
+    )
+    seconds = time.perf_counter() - start_time
+    pages = wiki_db.get_stats()[1]
+    wiki_db.close()
+
+    # in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    workers_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    result = {
+        "db": db_name,
+        "size": size,
+        "limit": limit,
+        "top_docs": top_docs,
+        "pages": pages,
+        "seconds": seconds,
+        "pages_per_sec": pages / seconds if seconds > 0 else 0.0,
+        "peak_rss_mib": peak / 1024,
+        "workers_rss_mib": workers_peak / 1024,
+    }
+    result.update({stage: timer.times.get(stage, 0.0) for stage in INDEX_STAGES})
+    result["other"] = seconds - timer.total()
+    return result
+
+
+def measure_build(
+    db_name: str,
+    size: int,
+    limit: int,
+    top_docs: int,
+    workers: int = 1,
+    synthetic: bool = False,
+) -> Dict:
+    """
+    Runs build_and_measure in a new process,
+    so the peak memory is of this build only
+    """
+
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.pathsep.join(filter(None, [package_dir, os.environ.get("PYTHONPATH")]))
+    args = [db_name, size, limit, top_docs, workers, int(synthetic)]
+
+    process = subprocess.run(
+        [sys.executable, "-m", "vector_house.benchmark", *map(str, args)],
+        stdout=subprocess.PIPE,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=path),
+    )
+    process.check_returncode()
+    # the build prints each page, the result is the last line
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def print_build(result: Dict) -> None:
+    print(
+        f"Indexed {result['pages']} pages in {result['seconds']:.1f}s,",
+        f"{result['pages_per_sec']:.1f} pages/s,",
+        f"peak RSS {result['peak_rss_mib']:.0f} MiB",
+        f"(workers {result['workers_rss_mib']:.0f} MiB)",
+    )
+    for stage in INDEX_STAGES + ["other"]:
+        share = result[stage] / result["seconds"] if result["seconds"] > 0 else 0
+        print(f"    {stage:20}{result[stage]:10.2f}s {share:6.1%}")
+
+
+def index_benchmark(
+    limit: int = 0, workers: int = 1, synthetic: bool = False
+) -> List[Dict]:
+    """
+    Builds an index of each of the sizes benchmarked, prints and returns
+    the throughput, peak memory and time spent in each stage of the builds
+    synthetic - index generated pages instead of the dump
+    """
+
+    if not os.path.isdir(BENCHMARK_DIR):
+        os.mkdir(BENCHMARK_DIR)
+    db_name = f"{BENCHMARK_DIR}/index-benchmark.db"
+
+    results = []
+    for size in sizes:
+        print(f"Building index of {size} pages")
+        result = measure_build(db_name, size, limit, 0, workers, synthetic)
+        print_build(result)
+        results.append(result)
+
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.isfile(db_name + suffix):
+                os.remove(db_name + suffix)
+
+    return results
+
+
 search_queries = [
     x.split()
     for x in [
@@ -63,7 +199,174 @@ search_queries = [
 ]
 
 
-def benchmark():
+def timed_find_pages(
+    wiki_db: WikiDatabase,
+    terms: List[str],
+    wanted: np.array = None,
+    k: int = TOP_K,
+    engine: str = ENGINE_DB,
+    matrix: MatrixEngine | None = None,
+) -> Tuple[List[Tuple[float, int, str]], StageTimer]:
+    """
+    Runs the query by the engine given and reads titles of the pages found
+    matrix - the index loaded for the matrix engine
+    Returns the pages with their titles and the time spent in each stage
+    """
+
+    timer = StageTimer()
+    if engine == ENGINE_MATRIX:
+        pages = matrix.search(terms, wanted, k, timer)
+    elif engine == ENGINE_MAXSCORE:
+        pages = max_score_search(wiki_db, terms, wanted, k, timer)
+    else:
+        pages = find_pages(wiki_db, terms, wanted, k, timer=timer)
+
+    with timer.stage("titles"):
+        titled = [
+            (sim, doc_id, wiki_db.get_doc_by_id(doc_id)[0]) for sim, doc_id in pages
+        ]
+
+    return titled, timer
+
+
+def latency_queries(wiki_db: WikiDatabase) -> List[Tuple[List[str], np.ndarray]]:
+    """
+    The search queries and the similar documents query
+    of the top page found by each of them
+    """
+
+    queries = []
+    for terms in search_queries:
+        queries.append((terms, None))
+        pages = find_pages(wiki_db, terms, k=1)
+        if len(pages) != 0:
+            dict_term_val = wiki_db.get_terms_for_doc(pages[0][1])
+            sim_to = np.array(list(dict_term_val.values()))
+            queries.append((list(dict_term_val.keys()), sim_to))
+    return queries
+
+
+def latency_suite(
+    db_path: str, runs: int = LATENCY_RUNS, name: str = None, engine: str = ENGINE_DB
+):
+    """
+    Times each query runs times on a warm and on a cold DB
+    Warm runs share a connection with the caches filled by a run before,
+    each cold run opens the DB again with empty SQLite and posting caches,
+    the OS page cache is kept though.
+    The matrix engine loads the index once, so it's timed warm only.
+    Returns a row for each mode and stage with the percentiles in ms
+    and queries per second of a single client, see RESULT_FIELDS
+    """
+
+    wiki_db = WikiDatabase(db_path)
+    matrix = None
+    if engine == ENGINE_MATRIX:
+        matrix = MatrixEngine.from_database(wiki_db)
+    queries = latency_queries(wiki_db)
+    for terms, wanted in queries:
+        timed_find_pages(wiki_db, terms, wanted, engine=engine, matrix=matrix)
+
+    rows = []
+    for mode in ["warm"] if engine == ENGINE_MATRIX else ["warm", "cold"]:
+        samples = {x: [] for x in QUERY_STAGES + ["total"]}
+        for _ in range(runs):
+            for terms, wanted in queries:
+                db = wiki_db if mode == "warm" else WikiDatabase(db_path)
+                _, timer = timed_find_pages(
+                    db, terms, wanted, engine=engine, matrix=matrix
+                )
+                if db is not wiki_db:
+                    db.close()
+
+                for stage in QUERY_STAGES:
+                    samples[stage].append(timer.times.get(stage, 0.0))
+                samples["total"].append(timer.total())
+
+        elapsed = sum(samples["total"])
+        qps = len(samples["total"]) / elapsed if elapsed > 0 else 0.0
+        for stage, times in samples.items():
+            row = {
+                "db": name or db_path,
+                "engine": engine,
+                "mode": mode,
+                "stage": stage,
+            }
+            row.update(summarize(times))
+            row["qps"] = qps
+            rows.append(row)
+
+    wiki_db.close()
+    return rows
+
+
+def print_latency(rows: List[Dict]) -> None:
+    delim = "\t"
+    print("Mode", "Stage", *[f"P{x}" for x in PERCENTILES], "QPS", sep=delim)
+    for row in rows:
+        percentiles = [f"{row[f'p{x}']:.3f}ms" for x in PERCENTILES]
+        print(row["mode"], row["stage"], *percentiles, round(row["qps"], 1), sep=delim)
+
+
+def write_results(
+    rows: List[Dict], json_path: str | None = None, csv_path: str | None = None
+) -> None:
+    """Stores the benchmark results to be compared later"""
+
+    if json_path is not None:
+        with open(json_path, "w") as file:
+            json.dump({"results": rows}, file, indent=2)
+    if csv_path is not None:
+        with open(csv_path, "w", newline="") as file:
+            fields = list(rows[0].keys()) if rows else RESULT_FIELDS
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def load_results(json_path: str) -> List[Dict]:
+    with open(json_path) as file:
+        return json.load(file)["results"]
+
+
+def compare_results(
+    rows: List[Dict], baseline: List[Dict], threshold: float = REGRESSION_THRESHOLD
+) -> List[str]:
+    """
+    Compares the percentiles to the baseline results
+    Returns a description of each percentile slower by more than the threshold
+    """
+
+    def key(row: Dict) -> Tuple[str, str, str, str]:
+        # results stored before the engines were benchmarked are of the db one
+        return row["db"], row.get("engine", ENGINE_DB), row["mode"], row["stage"]
+
+    base = {key(x): x for x in baseline}
+    regressions = []
+    for row in rows:
+        old = base.get(key(row))
+        if old is None:
+            continue
+
+        for percentile in [f"p{x}" for x in PERCENTILES]:
+            new_ms, old_ms = row[percentile], old[percentile]
+            if (
+                new_ms > old_ms * (1 + threshold)
+                and new_ms - old_ms > REGRESSION_MIN_MS
+            ):
+                regressions.append(
+                    f"{row['db']} {row['mode']} {row['stage']} {percentile}: "
+                    + f"{old_ms:.3f}ms -> {new_ms:.3f}ms"
+                )
+    return regressions
+
+
+def benchmark(runs: int = LATENCY_RUNS, engine: str = ENGINE_DB) -> List[Dict]:
+    """
+    Runs the latency suite of the engine on all the benchmark DBs,
+    prints the total time of warm queries and returns all the results
+    """
+
     delim = "\t"
     print(
         BETTER_FIND_PREFIX,
@@ -74,13 +377,19 @@ def benchmark():
         "Terms",
         "Documents",
         "Values",
-        "Time",
+        "QPS",
+        *[f"P{x}" for x in PERCENTILES],
         sep=delim,
     )
+    results = []
 
     def benchmark_db(
         db_name: str, size: int, limit: int, top_docs: int, sequential: bool
     ):
+        if not os.path.isfile(db_name):
+            print(f"Skipping {db_name}, run benchmark --create-index first")
+            return
+
         wiki_db = WikiDatabase(db_name)
         wiki_db.connect_database()
 
@@ -89,23 +398,13 @@ def benchmark():
         else:
             wiki_db.create_index()
 
-        start_time = time.time()
-
-        for query in search_queries:
-            vectors = find_vectors(wiki_db, query)
-            pages = [x[1] for x in search(vectors)]
-            for i in range(3):
-                page_id = pages[2]
-                dict_term_val = wiki_db.get_terms_for_doc(page_id)
-                keywords = list(dict_term_val.keys())
-                sim_to = np.array(list(dict_term_val.values()))
-                vectors = find_vectors(wiki_db, keywords)
-                pages = [x[1] for x in search(vectors, sim_to)]
-
-        end_time = time.time()
-
         terms, documents, values = wiki_db.get_stats()
-        duration = end_time - start_time
+        wiki_db.close()
+
+        name = f"{size}-{limit}-{top_docs}-{int(sequential)}"
+        rows = latency_suite(db_name, runs, name, engine)
+        results.extend(rows)
+        total = next(x for x in rows if x["mode"] == "warm" and x["stage"] == "total")
         print(
             BETTER_FIND_PREFIX,
             size,
@@ -115,8 +414,61 @@ def benchmark():
             terms,
             documents,
             values,
-            round(duration, 1),
+            round(total["qps"], 1),
+            *[round(total[f"p{x}"], 2) for x in PERCENTILES],
             sep=delim,
         )
 
     iterate(benchmark_db)
+    return results
+
+
+def ann_recall(
+    wiki_db: WikiDatabase,
+    samples: int = 100,
+    k: int = TOP_K,
+    probes: List[int] = [1, 2, 4, 8, 16, 32],
+):
+    """
+    Compares similar documents found by the embeddings to the exact ones
+    Recall is the share of the exact top k found by the approximate search
+    """
+
+    if not wiki_db.has_embeddings():
+        print("No embeddings stored, run embed first")
+        return
+
+    engine = MatrixEngine.from_database(wiki_db)
+    if len(engine.doc_ids) == 0:
+        print("The index is empty")
+        return
+    ann = AnnIndex.from_database(wiki_db)
+    rng = np.random.default_rng(0)
+    doc_ids = rng.choice(engine.doc_ids, min(samples, len(engine.doc_ids)), False)
+
+    start_time = time.time()
+    exact = [set(x[1] for x in engine.similar(int(doc_id), k)) for doc_id in doc_ids]
+    exact_time = (time.time() - start_time) / len(doc_ids)
+
+    delim = "\t"
+    print("Probes", "Recall", "Time", sep=delim)
+    print("exact", 1.0, f"{exact_time * 1000:.2f}ms", sep=delim)
+    for probe in probes:
+        start_time = time.time()
+        found = [
+            set(x[1] for x in ann.similar(int(doc_id), k, probe)) for doc_id in doc_ids
+        ]
+        ann_time = (time.time() - start_time) / len(doc_ids)
+
+        hits = sum(len(x & y) for x, y in zip(exact, found))
+        recall = hits / max(1, sum(len(x) for x in exact))
+        print(probe, round(recall, 3), f"{ann_time * 1000:.2f}ms", sep=delim)
+
+
+if __name__ == "__main__":
+    # a single build run by measure_build
+    db_name, size, limit, top_docs, workers, synthetic = sys.argv[1:]
+    result = build_and_measure(
+        db_name, int(size), int(limit), int(top_docs), int(workers), synthetic == "1"
+    )
+    print(json.dumps(result))
@@ -0,0 +1,57 @@
+import numpy as np
+from vector_house.database import WikiDatabase
+from vector_house.database_test import run_with_db
+from vector_house.query_eval_test import fill_db, assert_same_pages
+from vector_house.search_engine import find_pages
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.defaults import ENGINE_DB, ENGINE_MATRIX, ENGINE_MAXSCORE
+from vector_house.benchmark import timed_find_pages, compare_results, QUERY_STAGES
+
+
+@run_with_db
+def test_timed_find_pages(db: WikiDatabase) -> None:
+    """Tests each engine timed returns the same pages as find_pages"""
+
+    fill_db(db)
+    matrix = MatrixEngine.from_database(db)
+
+    wanted = np.array([0.5, 1, 2])
+    for engine in [ENGINE_DB, ENGINE_MATRIX, ENGINE_MAXSCORE]:
+        for terms, weights in [(["t1", "t2", "t3"], wanted), (["t4"], None)]:
+            pages, timer = timed_find_pages(
+                db, terms, weights, engine=engine, matrix=matrix
+            )
+            assert_same_pages([x[:2] for x in pages], find_pages(db, terms, weights))
+            assert [x[2] for x in pages] == [db.get_doc_by_id(x[1])[0] for x in pages]
+            stages = set(QUERY_STAGES)
+            if engine == ENGINE_MATRIX:
+                stages.remove("fetch")
+            assert set(timer.times.keys()) == stages
+
+    pages, timer = timed_find_pages(db, ["x"])
+    assert pages == []
+    assert set(timer.times.keys()) == {"fetch", "assembly", "titles"}
+
+
+def test_compare_results() -> None:
+    def row(db, stage, p50, p95, p99):
+        return {
+            "db": db,
+            "mode": "warm",
+            "stage": stage,
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+        }
+
+    baseline = [row("a", "fetch", 1.0, 2.0, 3.0), row("a", "titles", 0.01, 0.01, 0.01)]
+    current = [
+        row("a", "fetch", 1.1, 3.0, 3.0),
+        row("a", "titles", 0.05, 0.05, 0.05),
+        row("b", "fetch", 9.0, 9.0, 9.0),
+    ]
+
+    # only the p95 of fetch is slower by more than the threshold and the noise
+    regressions = compare_results(current, baseline, threshold=0.2)
+    assert regressions == ["a warm fetch p95: 2.000ms -> 3.000ms"]
+    assert compare_results(current, baseline, threshold=1) == []
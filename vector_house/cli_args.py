@@ -1,24 +1,81 @@
 import click
-from typing import List
+import json
+from typing import List, TYPE_CHECKING
 import numpy as np
 
-import vector_house.indexer as ind
+# Modules importing NLTK, SciPy or aiohttp are imported by the commands using them,
+# so the commands not needing them start fast
 import vector_house.search_engine as sr
-from vector_house.database import WikiDatabase, DB_DEFAULT_FILENAME
-import vector_house.benchmark as bk
+from vector_house.query_eval import max_score_search
+import vector_house.result_cache as rc
+from vector_house.shards import ShardedIndex, split_index, is_shards_only
+from vector_house.database import (
+    WikiDatabase,
+    DB_DEFAULT_FILENAME,
+    BULK_BATCH_SIZE,
+    POSTING_FLOAT16,
+    POSTING_UINT8,
+)
+from vector_house.defaults import (
+    INDEX_SIZE,
+    MEMORY_BUDGET,
+    REFRESH_DRIFT,
+    EMBED_DIM,
+    IVF_PROBES,
+    MMAP_DEFAULT_DIR,
+    BATCH_SIZE,
+    BATCH_WAIT,
+    LATENCY_RUNS,
+    ENGINE_DB,
+    ENGINE_MATRIX,
+    ENGINE_MAXSCORE,
+    ENGINE_ANN,
+    REGRESSION_THRESHOLD,
+)
+import vector_house.synthetic as syn
+import vector_house.profiling as prof
+import vector_house.metrics as metrics
+
+if TYPE_CHECKING:
+    from vector_house.matrix_engine import MatrixEngine
+    from vector_house.mmap_index import MmapIndex
 
 
 @click.group(
     help="Vector house command line interface\nManage indexes and more.",
 )
-def app():
+@click.option(
+    "--metrics",
+    "collect_metrics",
+    is_flag=True,
+    default=False,
+    help=f"Collect metrics of the command and add them to {metrics.METRICS_FILE}",
+)
+@click.pass_context
+def app(ctx: click.Context, collect_metrics: bool):
     """Root, idk"""
-    pass
+    if collect_metrics:
+        metrics.enable()
+    if metrics.enabled:
+        ctx.call_on_close(metrics.save)
 
 
 @click.command("info", help="Show info about an index (DB)")
 @click.option("--db", default=DB_DEFAULT_FILENAME)
-def info(db: str):
+@click.option(
+    "--plans",
+    is_flag=True,
+    default=False,
+    help="Show which indexes the main queries use",
+)
+@click.option(
+    "--metrics",
+    "metrics_format",
+    type=click.Choice(["prometheus", "json"]),
+    default=None,
+    help=f"Show the metrics collected in {metrics.METRICS_FILE}",
+)
+def info(db: str, plans: bool, metrics_format: str | None):
     # Start normal
     wiki_db = WikiDatabase(db)
     wiki_db.connect_database()
@@ -27,6 +84,31 @@ def info(db: str):
     wiki_db.print_stats()
     has_index = wiki_db.has_index()
     print(f"Indexes created: {has_index}")
+    print(f"Document norms stored: {wiki_db.has_doc_norms()}")
+    print(f"Term max weights stored: {wiki_db.has_term_bounds()}")
+    print(f"Similar documents precomputed: {wiki_db.has_similar()}")
+    print(f"Document embeddings stored: {wiki_db.has_embeddings()}")
+    hits, misses = rc.get_stats(wiki_db.path)
+    print(f"Result cache hits of the web page: {hits}, misses: {misses}")
+    print(f"Compact posting lists stored: {wiki_db.has_postings()}")
+    print(f"Values clustered by term: {wiki_db.is_clustered()}")
+    print(f"Appendable: {wiki_db.has_frequencies()}")
+    sizes = wiki_db.get_table_sizes()
+    if sizes:
+        print("Size of tables and indexes:")
+        for name, size in sizes.items():
+            print(f"    {name:24}{size / 1024 / 1024:10.1f} MiB")
+
+    if plans:
+        for name, steps in wiki_db.explain_queries().items():
+            print(f"Query plan of {name}:")
+            for step in steps:
+                print(f"    {step}")
+
+    if metrics_format == "json":
+        print(json.dumps(metrics.load().to_json(), indent=2))
+    elif metrics_format == "prometheus":
+        print(metrics.load().to_prometheus(), end="")
 
 
 @click.command("index", help="Creates index (DB)")
@@ -49,12 +131,267 @@ def info(db: str):
     default=0,
     help="Number of documents to index",
 )
-def index(size: int, limit: int, top_docs: int, db: str):
+@click.option(
+    "--batch-size",
+    is_flag=False,
+    default=BULK_BATCH_SIZE,
+    help="Number of rows written to the DB at once",
+)
+@click.option(
+    "--workers",
+    is_flag=False,
+    default=1,
+    help="Number of processes cleaning and lemmatizing the pages",
+)
+@click.option(
+    "--external",
+    is_flag=True,
+    default=False,
+    help="Stage frequencies in the DB instead of memory, for huge indexes",
+)
+@click.option(
+    "--memory-budget",
+    is_flag=False,
+    default=MEMORY_BUDGET,
+    help="Memory in MiB used by the external build",
+)
+@click.option(
+    "--append",
+    is_flag=True,
+    default=False,
+    help="Add new and changed pages to the existing index",
+)
+@click.option(
+    "--appendable",
+    is_flag=True,
+    default=False,
+    help="Keep the term frequencies, so pages can be added by --append later",
+)
+@click.option(
+    "--refresh-drift",
+    default=REFRESH_DRIFT,
+    help="Count all the weights again once --append changes the document count"
+    + " by this share since they were counted, 0 to count them every time",
+)
+@click.option(
+    "--precompute-sim",
+    is_flag=False,
+    default=0,
+    help="Store this many similar documents of each document for sim",
+)
+@click.option(
+    "--shards",
+    is_flag=False,
+    default=0,
+    help="Split the index into this many shard DBs by doc id ranges",
+)
+@click.option(
+    "--drop-split",
+    is_flag=True,
+    default=False,
+    help="Drop the documents split into --shards from the main DB",
+)
+@click.option(
+    "--clustered",
+    is_flag=True,
+    default=False,
+    help="Store values ordered by term in a WITHOUT ROWID table",
+)
+@click.option(
+    "--dump",
+    default=None,
+    help="Wiki dump to index instead of the first one found in wiki-data",
+)
+@click.option(
+    "--synthetic",
+    is_flag=True,
+    default=False,
+    help="Index --size generated pages instead of a dump",
+)
+def index(
+    size: int,
+    limit: int,
+    top_docs: int,
+    db: str,
+    batch_size: int,
+    workers: int,
+    external: bool,
+    memory_budget: int,
+    append: bool,
+    appendable: bool,
+    refresh_drift: float,
+    precompute_sim: int,
+    shards: int,
+    drop_split: bool,
+    clustered: bool,
+    dump: str | None,
+    synthetic: bool,
+):
     """Handles the list command"""
+    import vector_house.indexer as ind
+
+    if append and (limit != 0 or top_docs != 0):
+        raise click.UsageError(
+            "--append uses the --limit and --top-docs the index was created with"
+        )
+    if drop_split and shards == 0:
+        raise click.UsageError("--drop-split needs --shards")
 
     # Started with a parameter
     print("Creating index")
-    ind.recreate_index(size, limit, top_docs, WikiDatabase(db))
+    wiki_db = WikiDatabase(db)
+    pages = None
+    if synthetic:
+        print("Using synthetic pages")
+        pages = syn.synthetic_pages(size or INDEX_SIZE)
+    ind.recreate_index(
+        size,
+        limit,
+        top_docs,
+        wiki_db,
+        batch_size,
+        workers,
+        external,
+        memory_budget,
+        append,
+        precompute_sim,
+        clustered,
+        file_name=dump,
+        pages=pages,
+        appendable=appendable,
+        refresh_drift=refresh_drift,
+    )
+    if shards > 0:
+        split_index(wiki_db, shards, drop_split)
+
+
+@click.command("synth", help="Generates a synthetic wiki dump")
+@click.option("--out", default=syn.SYNTH_DUMP, help="Dump file to write")
+@click.option("--docs", default=INDEX_SIZE, help="Number of pages")
+@click.option("--length", default=syn.SYNTH_LENGTH, help="Mean words per page")
+@click.option(
+    "--vocabulary", default=syn.SYNTH_VOCABULARY, help="Number of distinct words"
+)
+@click.option(
+    "--exponent", default=syn.ZIPF_EXPONENT, help="Exponent of the Zipf's law"
+)
+@click.option("--seed", default=syn.SYNTH_SEED)
+def synth(
+    out: str, docs: int, length: int, vocabulary: int, exponent: float, seed: int
+):
+    pages = syn.synthetic_pages(docs, length, vocabulary, exponent, seed)
+    written = syn.write_dump(out, pages)
+    print(f"Done, {written} pages written to {out}")
+
+
+@click.command("shard", help="Splits an existing index (DB) into shard DBs")
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+@click.option("--count", default=4, help="Number of shards")
+@click.option(
+    "--drop-split",
+    is_flag=True,
+    default=False,
+    help="Drop the split documents from the main DB, it's then queried by --sharded",
+)
+def shard(db: str, count: int, drop_split: bool):
+    wiki_db = WikiDatabase(db)
+    if is_shards_only(wiki_db):
+        print("The documents were moved to the shards, create the index again")
+        return
+    paths = split_index(wiki_db, count, drop_split)
+    print(f"Done, index split into {len(paths)} shards")
+
+
+@click.command(
+    "norms", help="Stores document norms and term max weights into an existing index"
+)
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+def norms(db: str):
+    wiki_db = WikiDatabase(db)
+    wiki_db.update_doc_norms()
+    wiki_db.update_term_bounds()
+    wiki_db.bump_generation()
+    wiki_db.commit()
+    print("Done, norms stored")
+
+
+@click.command(
+    "refresh", help="Counts weights of all the terms of an appendable index again"
+)
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+def refresh(db: str):
+    import vector_house.indexer as ind
+
+    wiki_db = WikiDatabase(db)
+    if not wiki_db.has_frequencies():
+        print("The index is not appendable, create it again with --appendable")
+        return
+    ind.refresh_index(wiki_db)
+    ind.drop_outdated(wiki_db)
+    print("Done, weights counted again")
+
+
+@click.command("postings", help="Stores compact posting lists used by queries")
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+@click.option(
+    "--encoding",
+    type=click.Choice([POSTING_FLOAT16, POSTING_UINT8]),
+    default=POSTING_FLOAT16,
+    help="How the weights are stored",
+)
+@click.option(
+    "--drop",
+    is_flag=True,
+    default=False,
+    help="Drop the posting lists, read the value table again",
+)
+def postings(db: str, encoding: str, drop: bool):
+    wiki_db = WikiDatabase(db)
+    if drop:
+        wiki_db.drop_posting_table()
+    else:
+        wiki_db.build_postings(encoding)
+    # the bounds have to match the weights queries read
+    if wiki_db.has_term_bounds():
+        wiki_db.update_term_bounds()
+    wiki_db.bump_generation()
+    wiki_db.commit()
+    print("Done, posting lists " + ("dropped" if drop else "stored"))
+
+    # the value table is kept, it's read by everything but the posting queries
+    sizes = wiki_db.get_table_sizes()
+    if not drop and len(sizes) > 0:
+        values = sum(y for x, y in sizes.items() if x.split("_")[0] == "value")
+        print(f"Posting lists: {sizes.get('posting', 0) / 1024 / 1024:.1f} MiB,")
+        print(f"values with their indexes: {values / 1024 / 1024:.1f} MiB")
+
+
+@click.command("embed", help="Stores document embeddings used by sim --engine ann")
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+@click.option("--dim", default=EMBED_DIM, help="Number of embedding dimensions")
+@click.option(
+    "--lists",
+    type=int,
+    default=None,
+    help="Number of clusters, square root of the document count by default",
+)
+def embed(db: str, dim: int, lists: int | None):
+    from vector_house.embedding import build_ann_index
+
+    wiki_db = WikiDatabase(db)
+    build_ann_index(wiki_db, dim, lists)
+    print("Done, embeddings stored")
+
+
+@click.command("export-mmap", help="Exports the index as memory mappable arrays")
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+@click.option("--out", default=MMAP_DEFAULT_DIR, help="Directory to export to")
+def export_mmap_command(db: str, out: str):
+    from vector_house.mmap_index import export_mmap
+
+    wiki_db = WikiDatabase(db)
+    export_mmap(wiki_db, out)
+    print(f"Done, index exported to {out}")
 
 
 @click.command("create", help="Crete database column indexes")
@@ -89,19 +426,177 @@ def db_index():
 @click.option(
     "--create-index", is_flag=True, default=False, help="Recreates benchmark indexes"
 )
-def benchmark(create_index: bool):
+@click.option(
+    "--recall",
+    is_flag=True,
+    default=False,
+    help="Compare similar documents found by embeddings of --db to the exact ones",
+)
+@click.option(
+    "--latency",
+    is_flag=True,
+    default=False,
+    help="Time the query stages on --db only instead of all the benchmark DBs",
+)
+@click.option(
+    "--indexing",
+    is_flag=True,
+    default=False,
+    help="Measure pages/s, peak memory and stages of builds of each size",
+)
+@click.option(
+    "--workers",
+    default=1,
+    help="Number of processes cleaning and lemmatizing pages of --indexing builds",
+)
+@click.option(
+    "--synthetic",
+    is_flag=True,
+    default=False,
+    help="Build --create-index and --indexing indexes of generated pages",
+)
+@click.option("--runs", default=LATENCY_RUNS, help="Timed runs of each query")
+@click.option(
+    "--engine",
+    type=click.Choice([ENGINE_DB, ENGINE_MATRIX, ENGINE_MAXSCORE]),
+    default=ENGINE_DB,
+    help="Search engine answering the queries timed",
+)
+@click.option("--json", "json_path", default=None, help="Write results to JSON")
+@click.option("--csv", "csv_path", default=None, help="Write results to CSV")
+@click.option(
+    "--baseline",
+    default=None,
+    help="JSON results written before, slower percentiles fail the benchmark",
+)
+@click.option(
+    "--threshold",
+    default=REGRESSION_THRESHOLD,
+    help="Relative slowdown of a percentile considered a regression",
+)
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+def benchmark(
+    create_index: bool,
+    recall: bool,
+    latency: bool,
+    indexing: bool,
+    workers: int,
+    synthetic: bool,
+    runs: int,
+    engine: str,
+    json_path: str | None,
+    csv_path: str | None,
+    baseline: str | None,
+    threshold: float,
+    db: str,
+):
     """Handles the info command"""
+    import vector_house.benchmark as bk
 
     if create_index:
-        bk.create_indexes()
+        bk.create_indexes(synthetic)
+        return
+    if recall:
+        bk.ann_recall(WikiDatabase(db))
+        return
+
+    if indexing:
+        results = bk.index_benchmark(workers=workers, synthetic=synthetic)
+        bk.write_results(results, json_path, csv_path)
+        return
+
+    if latency:
+        results = bk.latency_suite(db, runs, engine=engine)
+        bk.print_latency(results)
     else:
-        bk.benchmark()
+        results = bk.benchmark(runs, engine)
+    bk.write_results(results, json_path, csv_path)
+
+    if baseline is not None:
+        regressions = bk.compare_results(results, bk.load_results(baseline), threshold)
+        for regression in regressions:
+            print("Regression", regression)
+        if regressions:
+            raise click.exceptions.Exit(1)
+        print("No regressions")
+
+
+engine_option = click.option(
+    "--engine",
+    type=click.Choice([ENGINE_DB, ENGINE_MATRIX, ENGINE_MAXSCORE]),
+    default=ENGINE_DB,
+    help="Query the DB directly, load the index into a sparse matrix first"
+    + " or skip documents that can not get into the top using MaxScore",
+)
+sim_engine_option = click.option(
+    "--engine",
+    type=click.Choice([ENGINE_DB, ENGINE_MATRIX, ENGINE_MAXSCORE, ENGINE_ANN]),
+    default=ENGINE_DB,
+    help="As for search, ann compares approximate embeddings stored by embed."
+    + " The similar documents precomputed by index are used by the db engine only",
+)
+top_option = click.option(
+    "--top",
+    type=int,
+    default=sr.TOP_K,
+    help="Number of documents to show",
+)
+sharded_option = click.option(
+    "--sharded",
+    is_flag=True,
+    default=False,
+    help="Query the shards of the DB created by index --shards in parallel",
+)
+profile_option = click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Print the slowest functions and the biggest allocations of the query",
+)
+mmap_option = click.option(
+    "--mmap",
+    default=None,
+    help="Use the index exported by export-mmap to this directory instead of the DB",
+)
+
+
+def open_index(db: str, mmap: str | None) -> "WikiDatabase | MmapIndex":
+    """Opens the exported index if the directory is given, the DB otherwise"""
+    if mmap is not None:
+        from vector_house.mmap_index import MmapIndex
+
+        return MmapIndex(mmap)
+    wiki_db = WikiDatabase(db)
+    if is_shards_only(wiki_db):
+        raise click.UsageError("The index is stored only in it's shards, use --sharded")
+    return wiki_db
+
+
+def load_engine(wiki_db: "WikiDatabase | MmapIndex") -> "MatrixEngine":
+    from vector_house.matrix_engine import MatrixEngine
+
+    if not isinstance(wiki_db, WikiDatabase):
+        return MatrixEngine.from_mmap(wiki_db)
+    return MatrixEngine.from_database(wiki_db)
 
 
 @click.command("search", help="Searches for the query given")
 @click.option("--db", default=DB_DEFAULT_FILENAME)
+@engine_option
+@top_option
+@mmap_option
+@sharded_option
+@profile_option
 @click.argument("query", nargs = -1)
-def search(query: List[str], db: str):
+def search(
+    query: List[str],
+    db: str,
+    engine: str,
+    top: int,
+    mmap: str | None,
+    sharded: bool,
+    profile: bool,
+):
     """Searches for the query given"""
     if len(query) == 0:
         print("Empty query, exiting")
@@ -109,9 +604,28 @@ def search(query: List[str], db: str):
 
     print("Searching for:", " ".join(query))
 
-    wiki_db = WikiDatabase(db)
-    vectors = sr.find_vectors(wiki_db, query)
-    pages = sr.search(vectors)
+    if sharded:
+        wiki_db = ShardedIndex(db)
+        max_score = engine == ENGINE_MAXSCORE
+        pages = wiki_db.find_pages(list(query), k=top, max_score=max_score)
+        print_pages(wiki_db, pages)
+        wiki_db.close()
+        return
+
+    wiki_db = open_index(db, mmap)
+
+    def find_pages():
+        if engine == ENGINE_MATRIX:
+            return load_engine(wiki_db).search(list(query), k=top)
+        if engine == ENGINE_MAXSCORE:
+            return max_score_search(wiki_db, list(query), k=top)
+        return sr.find_pages(wiki_db, list(query), k=top)
+
+    pages = prof.profile_call(find_pages) if profile else find_pages()
+    print_pages(wiki_db, pages)
+
+
+def print_pages(wiki_db: "WikiDatabase | MmapIndex | ShardedIndex", pages) -> None:
     titles = [(x[0], x[1], wiki_db.get_doc_by_id(x[1])[0]) for x in pages]
     for sim, doc_id, title in titles:
         print(f"{sim:.2f} {doc_id:6d}:", title)
@@ -119,37 +633,163 @@ def search(query: List[str], db: str):
 
 @click.command("sim", help="Show similar docs to the doc id given")
 @click.option("--db", default=DB_DEFAULT_FILENAME)
+@sim_engine_option
+@top_option
+@mmap_option
+@sharded_option
+@click.option(
+    "--max-terms",
+    type=int,
+    default=None,
+    help="Query only this many terms of the document with the highest weight,"
+    + f" all by default, the approximate page uses {sr.SIM_MAX_TERMS}",
+)
+@click.option(
+    "--mass",
+    type=float,
+    default=None,
+    help="Query only the terms covering this share (0-1) of the document vector",
+)
+@click.option(
+    "--posting-limit",
+    type=int,
+    default=None,
+    help="Read only this many documents with the highest weight of each term,"
+    + f" all by default, the approximate page uses {sr.SIM_POSTING_LIMIT}",
+)
+@click.option(
+    "--live",
+    is_flag=True,
+    default=False,
+    help="Ignore the similar documents precomputed by index --precompute-sim",
+)
+@click.option(
+    "--probes",
+    default=IVF_PROBES,
+    help="Number of the nearest clusters searched by the ann engine",
+)
+@profile_option
 @click.argument("doc_id", type=int)
-def sim(doc_id: int, db: str):
+def sim(
+    doc_id: int,
+    db: str,
+    engine: str,
+    top: int,
+    mmap: str | None,
+    max_terms: int | None,
+    mass: float | None,
+    posting_limit: int | None,
+    sharded: bool,
+    live: bool,
+    probes: int,
+    profile: bool,
+):
     """Searches for the query given"""
 
-    wiki_db = WikiDatabase(db)
+    if sharded and engine in [ENGINE_MATRIX, ENGINE_ANN]:
+        print(f"The {engine} engine can not query shards")
+        return
+    if engine == ENGINE_ANN and [max_terms, mass, posting_limit] != [None] * 3:
+        raise click.UsageError("The ann engine does not query the document terms")
+    if engine != ENGINE_DB and posting_limit not in [None, 0]:
+        raise click.UsageError(f"The {engine} engine reads whole posting lists")
+
+    wiki_db = ShardedIndex(db) if sharded else open_index(db, mmap)
 
     src_title, _ = wiki_db.get_doc_by_id(doc_id)
     print(f"Searching similar pages to: {doc_id} - {src_title}")
 
-    dict_term_val = wiki_db.get_terms_for_doc(doc_id)
-    keywords = list(dict_term_val.keys())
-    sim_to = np.array(list(dict_term_val.values()))
-    vectors = sr.find_vectors(wiki_db, keywords)
-    pages = sr.search(vectors, sim_to)
-    titles = [(x[0], x[1], wiki_db.get_doc_by_id(x[1])[0]) for x in pages]
-    for sim, doc_id, title in titles:
-        print(f"{sim:.2f} {doc_id:6d}:", title)
+    def find_similar():
+        if not live and engine == ENGINE_DB and isinstance(wiki_db, WikiDatabase):
+            pages = wiki_db.get_similar(doc_id, top)
+            if pages is not None:
+                print("Using precomputed similar documents")
+                return pages
+
+        if engine == ENGINE_ANN:
+            if not isinstance(wiki_db, WikiDatabase) or not wiki_db.has_embeddings():
+                print("No embeddings stored, run embed first")
+                return None
+            from vector_house.embedding import AnnIndex
+
+            return AnnIndex.from_database(wiki_db).similar(doc_id, top, probes)
+
+        dict_term_val = wiki_db.get_terms_for_doc(doc_id)
+        keywords, sim_to = sr.prune_query(
+            list(dict_term_val.keys()),
+            np.array(list(dict_term_val.values())),
+            max_terms or None,
+            mass,
+        )
+        if engine == ENGINE_MATRIX:
+            return load_engine(wiki_db).search(keywords, sim_to, k=top)
+        if sharded:
+            max_score = engine == ENGINE_MAXSCORE
+            return wiki_db.find_pages(
+                keywords, sim_to, top, max_score, posting_limit or None
+            )
+        if engine == ENGINE_MAXSCORE:
+            return max_score_search(wiki_db, keywords, sim_to, k=top)
+        return sr.find_pages(wiki_db, keywords, sim_to, top, posting_limit or None)
+
+    pages = prof.profile_call(find_similar) if profile else find_similar()
+    if pages is not None:
+        print_pages(wiki_db, pages)
+    if sharded:
+        wiki_db.close()
 
 
 @click.command("show", help="Show document by it's id")
 @click.option("--db", default=DB_DEFAULT_FILENAME)
+@mmap_option
+@sharded_option
 @click.argument("doc_id", type=int)
-def show(doc_id: int, db: str):
+def show(doc_id: int, db: str, mmap: str | None, sharded: bool):
     """Searches for the query given"""
 
     print("Searching for doc with id:", doc_id)
 
-    wiki_db = WikiDatabase(db)
+    wiki_db = ShardedIndex(db) if sharded else open_index(db, mmap)
     title, text = wiki_db.get_doc_by_id(doc_id)
     print(title)
     print(text)
+    if sharded:
+        wiki_db.close()
+
+
+@click.command("serve", help="Runs the HTTP/JSON query API")
+@click.option("--db", default=DB_DEFAULT_FILENAME)
+@mmap_option
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8080)
+@click.option(
+    "--batch-size",
+    default=BATCH_SIZE,
+    help="Max number of concurrent queries scored by a single matrix product",
+)
+@click.option(
+    "--batch-wait",
+    default=BATCH_WAIT * 1000,
+    help="Milliseconds a query waits for others to join it's batch",
+)
+def serve(
+    db: str, mmap: str | None, host: str, port: int, batch_size: int, batch_wait: float
+):
+    """Runs the HTTP/JSON query API"""
+    from vector_house.server import QueryServer, run_server
+
+    if mmap is not None:
+        wiki_db = open_index(db, mmap)
+        engine = load_engine(wiki_db)
+    else:
+        wiki_db = WikiDatabase(db, read_only=True)
+        with wiki_db.session():
+            engine = load_engine(wiki_db)
+
+    documents, terms = engine.get_shape()
+    print(f"Loaded {documents} documents and {terms} terms")
+    server = QueryServer(wiki_db, engine, batch_size, batch_wait / 1000)
+    run_server(server, host, port)
 
 
 db_index.add_command(db_index_create)
@@ -157,8 +797,16 @@ db_index.add_command(db_index_drop)
 
 app.add_command(info)
 app.add_command(index)
+app.add_command(synth)
 app.add_command(db_index)
+app.add_command(norms)
+app.add_command(refresh)
+app.add_command(postings)
+app.add_command(shard)
+app.add_command(embed)
+app.add_command(export_mmap_command)
 app.add_command(benchmark)
 app.add_command(search)
 app.add_command(sim)
 app.add_command(show)
+app.add_command(serve)
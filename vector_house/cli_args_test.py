@@ -0,0 +1,25 @@
+import sys
+import subprocess
+
+HEAVY_MODULES = [
+    "nltk",
+    "mwxml",
+    "wiki_dump_reader",
+    "scipy",
+    "aiohttp",
+    "vector_house.indexer",
+    "vector_house.benchmark",
+]
+
+
+def test_lazy_imports() -> None:
+    """Tests the CLI starts without importing the heavy dependencies"""
+
+    code = (
+        "import sys, vector_house.cli_args\n"
+        + f"print(*[x for x in {HEAVY_MODULES} if x in sys.modules])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
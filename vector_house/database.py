@@ -1,19 +1,170 @@
 import time
+import math
+import queue
+import pathlib
+import itertools
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from sqlite3 import Connection
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Callable, Iterator
 import numpy as np
+import vector_house.metrics as metrics
 
 DB_DEFAULT_FILENAME = "wiki-index.db"
+# Max number of parameters passed to a single query
+MAX_SQL_PARAMS = 900
+# Number of rows written at once by the bulk loader
+BULK_BATCH_SIZE = 10000
+# Estimated memory taken by a buffered row, without strings
+ROW_BYTES = 100
+# Encodings of weights in compact posting lists
+POSTING_FLOAT16 = "float16"
+POSTING_UINT8 = "uint8"
+META_POSTING_ENCODING = "posting_encoding"
+# Changes each time query results of the index may change
+META_GENERATION = "generation"
+# Number of similar documents stored for each document
+META_SIMILAR_K = "similar_k"
+# Memory taken by decoded posting lists of the frequent terms
+POSTING_CACHE_BYTES = 64 * 1024 * 1024
+# Number of read-only connections used by the serving mode
+POOL_SIZE = 4
+# Page cache of each pooled connection, in KiB
+POOL_CACHE_KIB = 64 * 1024
+# Size of the DB file part memory mapped by each pooled connection
+POOL_MMAP_BYTES = 1024 * 1024 * 1024
+# Indexes created by create_index, each covers all the columns
+# the queries using it read, so the value table itself is not read
+VALUE_INDEXES = {
+    # terms of a document, document norms
+    "value_doc": "value (doc_id, term_id, value)",
+    # postings of a term, in the impact order for get_top_postings,
+    # whole posting lists are sorted by doc id once read
+    "value_term_impact": "value (term_id, value DESC, doc_id)",
+    # doc id lookup by title
+    "document_title": "document (title)",
+}
+# Indexes created by older versions, replaced by the ones above
+LEGACY_INDEXES = [
+    "value_term_id",
+    "value_doc_id",
+    "term_term_id",
+    "document_doc_id",
+    "value_impact",
+    # a copy of the values the planner preferred value_term_impact to
+    "value_term",
+]
+
+# Queries of the methods below shown by explain_queries,
+# {params} stands for the question marks of an IN list
+POSTINGS_QUERY = """
+SELECT term.name, doc_id, value FROM term
+JOIN value USING(term_id)
+WHERE term.name IN ({params});
+"""
+TOP_POSTINGS_QUERY = """
+SELECT doc_id, value FROM value
+WHERE term_id = (SELECT term_id FROM term WHERE name = ?)
+ORDER BY value DESC
+LIMIT ?;
+"""
+TERMS_OF_DOC_QUERY = """
+SELECT term.name, value FROM term
+JOIN value USING(term_id)
+JOIN document USING(doc_id)
+WHERE doc_id = ?
+ORDER BY term_id;
+"""
+COUNT_DOC_NORMS_QUERY = """
+SELECT doc_id, sum(value * value) FROM value GROUP BY doc_id;
+"""
+DOC_NORMS_QUERY = """
+SELECT doc_id, norm FROM doc_norm WHERE doc_id IN ({params});
+"""
+DOC_BY_TITLE_QUERY = """
+SELECT doc_id FROM document WHERE title = ?;
+"""
+DOC_BY_ID_QUERY = """
+SELECT title, text FROM document WHERE doc_id = ?;
+"""
 
 
 class WikiDatabase:
-    def __init__(self, path: str = DB_DEFAULT_FILENAME, autoConnect: bool = True):
+    def __init__(
+        self,
+        path: str = DB_DEFAULT_FILENAME,
+        autoConnect: bool = True,
+        posting_cache_bytes: int = POSTING_CACHE_BYTES,
+        read_only: bool = False,
+        pool_size: int = POOL_SIZE,
+    ):
+        """
+        read_only - serving mode, queries use a pool of read-only connections,
+                    each thread has to check one out by session()
+        """
         self.path = path
         self.con: Connection | None = None
-        if autoConnect:
+        self.posting_cache = PostingCache(posting_cache_bytes)
+        self.read_only = read_only
+        self.pool: ConnectionPool | None = None
+        self.local = threading.local()
+
+        if read_only:
+            self.pool = ConnectionPool(path, pool_size)
+        elif autoConnect:
             self.connect_database()
 
+    @property
+    def con(self) -> Connection | None:
+        """
+        The connection checked out by the current thread in the serving mode,
+        the only connection otherwise
+        """
+        session = getattr(self.local, "con", None)
+        if session is not None:
+            return session
+        if self.pool is not None:
+            raise RuntimeError("use session() on a read-only WikiDatabase")
+        return self.own_con
+
+    @con.setter
+    def con(self, con: Connection | None) -> None:
+        self.own_con = con
+
+    @contextmanager
+    def session(self) -> Iterator["WikiDatabase"]:
+        """
+        Checks out a pooled connection for the current thread in the serving mode
+        Nested sessions share the connection, does nothing in the normal mode.
+        The generation of the index is read once for the session, cached
+        posting lists are dropped if another process changed the index.
+        """
+        if getattr(self.local, "con", None) is not None:
+            yield self
+            return
+        if self.pool is None:
+            self.posting_cache.check_generation(self.get_generation())
+            yield self
+            return
+
+        con = self.pool.acquire()
+        self.local.con = con
+        try:
+            self.posting_cache.check_generation(self.get_generation())
+            yield self
+        finally:
+            self.local.con = None
+            self.pool.release(con)
+
+    def enable_wal(self) -> None:
+        """
+        Switches the DB file to the write-ahead log journal,
+        readers then keep working while the index is being written
+        """
+        self.con.execute(""" PRAGMA journal_mode = WAL; """)
+
     def connect_database(self) -> None:
         """
         Creates the database file if needed
@@ -24,9 +175,9 @@ class WikiDatabase:
         self.con = sqlite3.connect(self.path, check_same_thread=False)
         self.create_if_needed()
 
-    def create_if_needed(self) -> None:
+    def create_if_needed(self, clustered: bool = False) -> None:
         if not self.has_schema():
-            self.create_database()
+            self.create_database(clustered)
 
     def drop_if_exists(self) -> None:
         if self.has_schema():
@@ -45,8 +196,13 @@ SELECT count(name) FROM sqlite_master WHERE type='table';
 
         return cur.fetchone()[0] > 2
 
-    def create_database(self) -> None:
-        """Creates a database scheme"""
+    def create_database(self, clustered: bool = False) -> None:
+        """
+        Creates a database scheme
+        clustered - store the value table as a WITHOUT ROWID table ordered
+                    by term id and doc id, so postings of a term are stored
+                    next to each other and need no separate index
+        """
 
         cur = self.con.cursor()
         cur.execute(
@@ -68,8 +224,22 @@ CREATE TABLE document (
         """
         )
 
-        cur.execute(
+        if clustered:
+            cur.execute(
+                """
+CREATE TABLE value (
+    doc_id INTEGER NOT NULL,
+    term_id INTEGER NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY(term_id, doc_id),
+    FOREIGN KEY(term_id) REFERENCES document(term_id),
+    FOREIGN KEY(doc_id) REFERENCES document(doc_id)
+) WITHOUT ROWID;
             """
+            )
+        else:
+            cur.execute(
+                """
 CREATE TABLE value (
     doc_id INTEGER NOT NULL,
     term_id INTEGER NOT NULL,
@@ -77,11 +247,29 @@ CREATE TABLE value (
     FOREIGN KEY(term_id) REFERENCES document(term_id),
     FOREIGN KEY(doc_id) REFERENCES document(doc_id)
 );
-        """
-        )
+            """
+            )
 
+        self.create_doc_norm_table()
         self.commit()
 
+    def create_doc_norm_table(self) -> None:
+        """
+        Creates table for L2 norms of whole document weight vectors
+        Indexes created before the norms were introduced don't have it
+        """
+
+        cur = self.con.cursor()
+        cur.execute(
+            """
+CREATE TABLE IF NOT EXISTS doc_norm (
+    doc_id INTEGER NOT NULL PRIMARY KEY,
+    norm DOUBLE PRECISION NOT NULL,
+    FOREIGN KEY(doc_id) REFERENCES document(doc_id)
+);
+        """
+        )
+
     def drop_database(self) -> None:
         """
         Drops database schema
@@ -104,20 +292,70 @@ DROP TABLE document;
 DROP TABLE value;
         """
         )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS doc_norm;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS frequency;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS term_stats;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS meta;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS posting;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS term_bound;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS similar;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS embedding;
+        """
+        )
+        cur.execute(
+            """
+DROP TABLE IF EXISTS centroid;
+        """
+        )
 
         self.commit()
 
     def commit(self) -> None:
         """
         Commits staged changes
+        Cached posting lists may be outdated then, so they are dropped
         """
         self.con.commit()
+        self.posting_cache.clear()
 
     def close(self) -> None:
         """
-        Commits staged changes
+        Closes the connection, all the pooled connections in the serving mode
         """
-        self.con.close()
+        if self.pool is not None:
+            self.pool.close()
+        if self.own_con is not None:
+            self.own_con.close()
 
     def insert_document(self, title: str, text: str) -> int:
         """
@@ -168,238 +406,1231 @@ INSERT INTO value(term_id, doc_id, value) VALUES(?, ?, ?);
             [term_id, doc_id, value],
         )
 
-    def has_term(self, name: str) -> bool:
+    def insert_terms(self, rows: List[Tuple[int, str]]) -> None:
         """
-        Checks if the term is already presented
+        Inserts terms with their ids already assigned
+        Commit has to be called later!
         """
         cur = self.con.cursor()
 
-        res = cur.execute(
+        cur.executemany(
             """
-SELECT name FROM term WHERE name = ?
+INSERT INTO term(term_id, name) VALUES(?, ?);
                     """,
-            [name],
+            rows,
         )
 
-        return len(res.fetchall()) > 0
-
-    def get_term_id(self, name: str) -> int:
+    def insert_documents(self, rows: List[Tuple[int, str, str]]) -> None:
         """
-        Checks if the term is already presented
+        Inserts documents with their ids already assigned
+        Commit has to be called later!
         """
         cur = self.con.cursor()
 
-        res = cur.execute(
+        cur.executemany(
             """
-SELECT term_id FROM term WHERE name = ?
+INSERT INTO document(doc_id, title, text) VALUES(?, ?, ?);
                     """,
-            [name],
+            rows,
         )
 
-        return res.fetchone()[0]
-
-    def get_term_by_id(self, id: int) -> str:
+    def insert_values(self, rows: List[Tuple[int, int, float]]) -> None:
         """
-        Checks if the term is already presented
+        Inserts value relations given as [term_id, doc_id, value]
+        Commit has to be called later!
         """
         cur = self.con.cursor()
 
-        res = cur.execute(
+        cur.executemany(
             """
-SELECT name FROM term WHERE term_id = ?
+INSERT INTO value(term_id, doc_id, value) VALUES(?, ?, ?);
                     """,
-            [id],
+            rows,
         )
 
-        return res.fetchone()[0]
+    def get_or_insert_term(self, name: str) -> int:
+        """
+        Gets id of the term, the term is inserted if it's not presented
+        Commit has to be called later!
+        """
+        if self.has_term(name):
+            return self.get_term_id(name)
+        return self.insert_term(name)
 
-    def get_doc_id(self, title: str) -> int:
+    def get_max_doc_id(self) -> int:
         """
-        Checks if the term is already presented
+        Gets the highest document id used, 0 for no documents
         """
         cur = self.con.cursor()
 
-        res = cur.execute(
-            """
-SELECT doc_id FROM document WHERE title = ?
-                    """,
-            [title],
-        )
+        res = cur.execute(""" SELECT max(doc_id) FROM document; """)
 
-        return res.fetchone()[0]
+        return res.fetchone()[0] or 0
 
-    def get_doc_by_id(self, id: str) -> Tuple[str, str]:
+    def bulk_loader(
+        self, batch_size: int = BULK_BATCH_SIZE, memory_budget: int = 0
+    ) -> "BulkLoader":
         """
-        Checks if the term is already presented
+        Creates a loader writing to this database in batches
+        """
+        return BulkLoader(self, batch_size, memory_budget)
+
+    def limit_cache(self, size: int) -> None:
+        """
+        Limits the page cache of the connection to the number of bytes given
+        Temporary tables and sorts are stored in files
         """
         cur = self.con.cursor()
+        cur.execute(f""" PRAGMA cache_size = -{max(size // 1024, 1)}; """)
+        cur.execute(""" PRAGMA temp_store = FILE; """)
 
-        res = cur.execute(
+    def create_frequency_table(self) -> None:
+        """
+        Creates tables for absolute frequencies of terms in documents
+        and for the term statistics counted from them,
+        these are needed to update the index later
+        """
+        cur = self.con.cursor()
+        cur.execute(
             """
-SELECT title, text FROM document WHERE doc_id = ?
-                    """,
-            [id],
+CREATE TABLE IF NOT EXISTS frequency (
+    term_id INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    freq INTEGER NOT NULL
+);
+        """
+        )
+        cur.execute(
+            """
+CREATE TABLE IF NOT EXISTS term_stats (
+    term_id INTEGER NOT NULL PRIMARY KEY,
+    max_freq INTEGER NOT NULL,
+    df INTEGER NOT NULL,
+    dirty INTEGER NOT NULL DEFAULT 0
+);
+        """
         )
 
-        fetched = res.fetchone()
-        return (fetched[0], fetched[1])
-
-    def get_value_by_ids(self, term_id: int, doc_id: int) -> float:
+    def index_frequencies(self) -> None:
         """
-        Gets value for the pair given
+        Creates indexes used when the index is updated
         """
         cur = self.con.cursor()
+        cur.execute(
+            """
+CREATE INDEX IF NOT EXISTS frequency_term_id ON frequency (term_id);
+                    """
+        )
+        cur.execute(
+            """
+CREATE INDEX IF NOT EXISTS frequency_doc_id ON frequency (doc_id);
+                    """
+        )
+
+    def drop_frequency_tables(self) -> None:
+        """Drops the frequencies, the index can not be updated then"""
+        cur = self.con.cursor()
+        cur.execute(""" DROP TABLE IF EXISTS frequency; """)
+        cur.execute(""" DROP TABLE IF EXISTS term_stats; """)
 
+    def has_frequencies(self) -> bool:
+        """Checks if the database stores absolute frequencies"""
+        cur = self.con.cursor()
         res = cur.execute(
             """
-SELECT value FROM value WHERE term_id = ? AND doc_id = ?;
-                    """,
-            [term_id, doc_id],
+SELECT count(*) FROM sqlite_master WHERE type='table' and name='frequency';
+                    """
         )
 
-        return (res.fetchone() or [0.0])[0]
+        return res.fetchone()[0] != 0
 
-    def get_values_for_term(self, term_name: str) -> Dict[int, np.float32]:
+    def insert_frequencies(self, rows: List[Tuple[int, int, int]]) -> None:
         """
-        Gets value for the pair given
+        Inserts absolute frequencies given as [term_id, doc_id, freq]
+        Commit has to be called later!
         """
         cur = self.con.cursor()
 
-        res = cur.execute(
+        cur.executemany(
             """
-SELECT doc_id, value FROM term
-JOIN value USING(term_id)
-JOIN document USING(doc_id)
-WHERE term.name = ?
-ORDER BY term_id;
+INSERT INTO frequency(term_id, doc_id, freq) VALUES(?, ?, ?);
                     """,
-            [term_name],
+            rows,
         )
 
-        rows = res.fetchall()
-        doc_id_iter = (x[0] for x in rows)
-        value_iter = (np.float32(x[1]) for x in rows)
-        to_return = dict(zip(doc_id_iter, value_iter))
-
-        return to_return
-
-    def get_values_for_terms(self, term_names: List[str]) -> Dict[int, np.float32]:
+    def get_terms_of_doc_frequencies(self, doc_id: int) -> List[int]:
         """
-        Gets value for the pair given
+        Gets ids of the terms with a frequency stored for the document
         """
         cur = self.con.cursor()
 
-        question_marks = ",".join("?" * len(term_names))
         res = cur.execute(
-            f"""
-SELECT doc_id, value, term_rank FROM term
-JOIN value USING(term_id)
-JOIN document USING(doc_id)
-JOIN (
-    SELECT term_id, rank() OVER win AS term_rank FROM term
-    WHERE name IN ({question_marks})
-    WINDOW win AS (ORDER BY term_id)
-) USING(term_id)
-WHERE term.name IN ({question_marks})
-ORDER BY doc_id, term_rank;
+            """
+SELECT term_id FROM frequency WHERE doc_id = ?;
                     """,
-            term_names + term_names,
+            [doc_id],
         )
 
-        rows = res.fetchall()
-        dct: Dict[int, np.array[np.float32]] = {}
-        for row in rows:
-            doc_id, value, term_rank = row
-            if doc_id not in dct.keys():
-                dct[doc_id] = np.zeros(len(term_names))
-            dct[doc_id][term_rank - 1] = value
+        return [x[0] for x in res.fetchall()]
 
-        return dct
+    def delete_doc_postings(self, doc_id: int) -> None:
+        """
+        Deletes frequencies, values and norm of the document
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(""" DELETE FROM frequency WHERE doc_id = ?; """, [doc_id])
+        cur.execute(""" DELETE FROM value WHERE doc_id = ?; """, [doc_id])
+        cur.execute(""" DELETE FROM doc_norm WHERE doc_id = ?; """, [doc_id])
 
-    def get_terms_for_doc(self, doc_id: int) -> Dict[str, np.float32]:
+    def mark_terms_dirty(self, term_ids: List[int]) -> None:
         """
-        Gets terms in given document
+        Marks the terms, their statistics and weights have to be counted again
+        Commit has to be called later!
         """
         cur = self.con.cursor()
 
-        res = cur.execute(
+        cur.executemany(
             """
-SELECT term.name, value FROM term
-JOIN value USING(term_id)
-JOIN document USING(doc_id)
-WHERE doc_id = ?
-ORDER BY term_id;
+INSERT INTO term_stats(term_id, max_freq, df, dirty) VALUES(?, 0, 0, 1)
+ON CONFLICT(term_id) DO UPDATE SET dirty = 1;
                     """,
-            [doc_id],
+            [[x] for x in term_ids],
         )
 
-        rows = res.fetchall()
-        term_names = [row[0] for row in rows]
-        values = (np.float32(x[1]) for x in rows)
-        to_return = dict(zip(term_names, values))
-        return to_return
-
-    def has_index(self) -> bool:
-        """Checks if the database has created indexes"""
+    def count_dirty_terms(self) -> int:
+        """
+        Gets the number of terms to be counted again
+        """
         cur = self.con.cursor()
-        res = cur.execute(
-            """
-SELECT count(*) FROM sqlite_master WHERE type='index' and name='value_term_id';
-                    """
-        )
 
-        return res.fetchone()[0] != 0
+        res = cur.execute(""" SELECT count(*) FROM term_stats WHERE dirty; """)
 
-    def create_index(self):
-        print("Creating index")
+        return res.fetchone()[0]
 
+    def update_term_stats(self, only_dirty: bool = False) -> None:
+        """
+        Counts max frequency and number of docs of terms from the frequencies
+        Commit has to be called later!
+        """
         cur = self.con.cursor()
-        cur.execute(
-            """
-CREATE INDEX IF NOT EXISTS value_term_id ON value (term_id);
+
+        if not only_dirty:
+            cur.execute(""" DELETE FROM term_stats; """)
+            cur.execute(
+                """
+INSERT INTO term_stats(term_id, max_freq, df)
+SELECT term_id, max(freq), count(*) FROM frequency GROUP BY term_id;
                     """
-        )
+            )
+            return
+
         cur.execute(
             """
-CREATE INDEX IF NOT EXISTS value_doc_id ON value (doc_id);
+UPDATE term_stats SET (max_freq, df) = (
+    SELECT coalesce(max(freq), 0), count(*) FROM frequency
+    WHERE frequency.term_id = term_stats.term_id
+)
+WHERE dirty;
                     """
         )
-        cur.execute(
-            """
-CREATE INDEX IF NOT EXISTS term_term_id ON value (term_id);
+
+    def weights_from_frequencies(
+        self,
+        weight: Callable[[int, int, int], float],
+        top_docs: int = 0,
+        only_dirty: bool = False,
+    ) -> None:
+        """
+        Counts term weights from the frequencies inside the database
+        weight - gets freq, max freq of the term and number of docs with the term
+        top_docs - for each term store only top k docs, 0 for all
+        only_dirty - replace weights of the dirty terms only, of all the terms otherwise
+        Commit has to be called later!
+        """
+        self.con.create_function("term_weight", 3, weight, deterministic=True)
+        self.update_term_stats(only_dirty)
+
+        cur = self.con.cursor()
+        condition = ""
+        if only_dirty:
+            condition = "WHERE dirty"
+            cur.execute(
+                """
+DELETE FROM value WHERE term_id IN (SELECT term_id FROM term_stats WHERE dirty);
+                    """
+            )
+        else:
+            cur.execute(""" DELETE FROM value; """)
+
+        if top_docs == 0:
+            cur.execute(
+                f"""
+INSERT INTO value(term_id, doc_id, value)
+SELECT term_id, doc_id, term_weight(freq, max_freq, df) FROM frequency
+JOIN term_stats USING(term_id)
+{condition};
                     """
+            )
+            return
+
+        cur.execute(
+            f"""
+INSERT INTO value(term_id, doc_id, value)
+SELECT term_id, doc_id, weight FROM (
+    SELECT term_id, doc_id, weight,
+        row_number() OVER (PARTITION BY term_id ORDER BY weight DESC, doc_id) AS pos
+    FROM (
+        SELECT term_id, doc_id, term_weight(freq, max_freq, df) AS weight
+        FROM frequency JOIN term_stats USING(term_id)
+        {condition}
+    )
+)
+WHERE pos <= ?;
+                    """,
+            [top_docs],
         )
+
+    def clear_dirty_terms(self) -> None:
+        """
+        Marks all the terms as up to date
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(""" UPDATE term_stats SET dirty = 0 WHERE dirty; """)
+
+    def create_meta_table(self) -> None:
+        """
+        Creates table for key - value info about the index
+        """
+        cur = self.con.cursor()
         cur.execute(
             """
-CREATE INDEX IF NOT EXISTS document_doc_id ON value (doc_id);
-                    """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT NOT NULL PRIMARY KEY,
+    value TEXT NOT NULL
+);
+        """
         )
 
-    def drop_index(self):
-        print("Dropping index")
+    def set_meta(self, key: str, value: str | int) -> None:
+        """
+        Stores info about the index
+        Commit has to be called later!
+        """
+        self.create_meta_table()
 
         cur = self.con.cursor()
         cur.execute(
             """
-DROP INDEX IF EXISTS term_term_id;
+INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?);
+                    """,
+            [key, str(value)],
+        )
+
+    def get_meta(self, key: str, default: str | None = None) -> str | None:
+        """
+        Gets info about the index, default if it's not stored
+        """
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT count(*) FROM sqlite_master WHERE type='table' and name='meta';
                     """
         )
+        if res.fetchone()[0] == 0:
+            return default
+
+        res = cur.execute(""" SELECT value FROM meta WHERE key = ?; """, [key])
+        row = res.fetchone()
+        return default if row is None else row[0]
+
+    def bump_generation(self) -> None:
+        """
+        Marks that the index changed, so cached query results are invalid
+        The current time is used, so a rebuilt index never gets an old value
+        Commit has to be called later!
+        """
+        generation = max(time.time_ns(), self.get_generation() + 1)
+        self.set_meta(META_GENERATION, generation)
+
+    def get_generation(self) -> int:
+        """Gets the generation of the index, 0 if it was never bumped"""
+        return int(self.get_meta(META_GENERATION, "0"))
+
+    def get_all_titles(self) -> Dict[str, int]:
+        """
+        Gets all the document titles with their ids
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(""" SELECT title, doc_id FROM document; """)
+
+        return dict(res.fetchall())
+
+    def update_document(self, doc_id: int, text: str) -> None:
+        """
+        Replaces text of the document
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(
+            """
+UPDATE document SET text = ? WHERE doc_id = ?;
+                    """,
+            [text, doc_id],
+        )
+
+    def has_term(self, name: str) -> bool:
+        """
+        Checks if the term is already presented
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT name FROM term WHERE name = ?
+                    """,
+            [name],
+        )
+
+        return len(res.fetchall()) > 0
+
+    def get_term_id(self, name: str) -> int:
+        """
+        Checks if the term is already presented
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT term_id FROM term WHERE name = ?
+                    """,
+            [name],
+        )
+
+        return res.fetchone()[0]
+
+    def get_term_by_id(self, id: int) -> str:
+        """
+        Checks if the term is already presented
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT name FROM term WHERE term_id = ?
+                    """,
+            [id],
+        )
+
+        return res.fetchone()[0]
+
+    def get_doc_id(self, title: str) -> int:
+        """
+        Checks if the term is already presented
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(DOC_BY_TITLE_QUERY, [title])
+
+        return res.fetchone()[0]
+
+    @metrics.timed("db_get_doc_by_id")
+    def get_doc_by_id(self, id: str) -> Tuple[str, str]:
+        """
+        Checks if the term is already presented
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(DOC_BY_ID_QUERY, [id])
+
+        fetched = res.fetchone()
+        return (fetched[0], fetched[1])
+
+    def get_value_by_ids(self, term_id: int, doc_id: int) -> float:
+        """
+        Gets value for the pair given
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT value FROM value WHERE term_id = ? AND doc_id = ?;
+                    """,
+            [term_id, doc_id],
+        )
+
+        return (res.fetchone() or [0.0])[0]
+
+    def get_values_for_term(self, term_name: str) -> Dict[int, np.float32]:
+        """
+        Gets value for the pair given
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT doc_id, value FROM term
+JOIN value USING(term_id)
+JOIN document USING(doc_id)
+WHERE term.name = ?
+ORDER BY term_id;
+                    """,
+            [term_name],
+        )
+
+        rows = res.fetchall()
+        doc_id_iter = (x[0] for x in rows)
+        value_iter = (np.float32(x[1]) for x in rows)
+        to_return = dict(zip(doc_id_iter, value_iter))
+
+        return to_return
+
+    def get_values_for_terms(
+        self, term_names: List[str], limit: int | None = None
+    ) -> Dict[int, np.float32]:
+        """
+        Gets weight vectors of the documents containing any of the terms
+        i-th item of a vector is the weight of the i-th term given
+        limit - use only this many postings with the highest weight of each term
+        """
+        postings = self.get_postings(term_names, limit)
+        return postings_to_vectors([postings.get(x) for x in term_names])
+
+    @metrics.timed("db_get_postings")
+    def get_postings(
+        self, term_names: List[str], limit: int | None = None
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Gets posting lists of the terms given as doc ids and weights
+        Doc ids are sorted, unknown terms are left out
+        limit - keep only this many postings with the highest weight of each term
+        Whole posting lists are cached, only the missing ones are read,
+        changes of other processes are seen by the next session()
+        """
+        names = list(dict.fromkeys(term_names))
+        postings, missing = self.posting_cache.get_many(names)
+        metrics.inc("posting_cache_hits_total", len(names) - len(missing))
+        metrics.inc("posting_cache_misses_total", len(missing))
+
+        # a compact posting list is decoded whole anyway, so it's cached whole
+        if limit is None or self.is_compact():
+            read = self.read_postings(missing)
+            self.posting_cache.put_many(read)
+            postings.update(read)
+            if limit is not None:
+                postings = {x: top_postings(*y, limit) for x, y in postings.items()}
+        else:
+            postings = {x: top_postings(*y, limit) for x, y in postings.items()}
+            postings.update(self.read_postings(missing, limit))
+
+        return {x: postings[x] for x in names if x in postings}
+
+    def is_compact(self) -> bool:
+        """Checks if queries read the compact posting lists"""
+        # checked again once the cache is dropped by a commit or a new generation
+        if self.posting_cache.compact is None:
+            self.posting_cache.compact = self.has_postings()
+        return self.posting_cache.compact
+
+    @metrics.timed("db_read_postings")
+    def read_postings(
+        self, term_names: List[str], limit: int | None = None
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Reads posting lists of the terms given from the database
+        """
+        if len(term_names) == 0:
+            return {}
+
+        if self.is_compact():
+            postings = self.get_encoded_postings(term_names)
+            if limit is not None:
+                postings = {x: top_postings(*y, limit) for x, y in postings.items()}
+            return postings
+
+        if limit is not None:
+            return self.get_top_postings(term_names, limit)
+
+        cur = self.con.cursor()
+        names = list(dict.fromkeys(term_names))
+        to_return: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+        # stay under the SQLite host parameter limit
+        for i in range(0, len(names), MAX_SQL_PARAMS):
+            chunk = names[i : i + MAX_SQL_PARAMS]
+            question_marks = ",".join("?" * len(chunk))
+            res = cur.execute(POSTINGS_QUERY.format(params=question_marks), chunk)
+
+            # not ordered in SQL, so the planner does not scan all the terms
+            rows = sorted(res.fetchall())
+            for name, group in itertools.groupby(rows, key=lambda x: x[0]):
+                group = list(group)
+                doc_ids = np.fromiter((x[1] for x in group), np.int64, len(group))
+                values = np.fromiter((x[2] for x in group), np.float64, len(group))
+                to_return[name] = (doc_ids, values)
+
+        return to_return
+
+    def get_top_postings(
+        self, term_names: List[str], limit: int
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Gets only the postings with the highest weight of each term
+        Reads them in the impact order, so with the value_term_impact index
+        the low weight tail of a long posting list is not read at all
+        """
+        cur = self.con.cursor()
+        to_return: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+        for name in dict.fromkeys(term_names):
+            res = cur.execute(TOP_POSTINGS_QUERY, [name, limit])
+
+            rows = res.fetchall()
+            if len(rows) == 0 and not self.has_term(name):
+                continue
+
+            doc_ids = np.fromiter((x[0] for x in rows), np.int64, len(rows))
+            values = np.fromiter((x[1] for x in rows), np.float64, len(rows))
+            order = np.argsort(doc_ids)
+            to_return[name] = (doc_ids[order], values[order])
+
+        return to_return
+
+    def create_posting_table(self) -> None:
+        """
+        Creates table for compact posting lists, one row per term
+        """
+        self.posting_cache.clear()
+        cur = self.con.cursor()
         cur.execute(
             """
-DROP INDEX IF EXISTS document_doc_id;
+CREATE TABLE IF NOT EXISTS posting (
+    term_id INTEGER NOT NULL PRIMARY KEY,
+    doc_count INTEGER NOT NULL,
+    scale DOUBLE PRECISION,
+    doc_ids BLOB NOT NULL,
+    weights BLOB NOT NULL,
+    FOREIGN KEY(term_id) REFERENCES term(term_id)
+);
+        """
+        )
+
+    def drop_posting_table(self) -> None:
+        """
+        Drops compact posting lists, values are then read from the value table
+        """
+        self.posting_cache.clear()
+        cur = self.con.cursor()
+        cur.execute(""" DROP TABLE IF EXISTS posting; """)
+
+    def has_postings(self) -> bool:
+        """Checks if the database stores compact posting lists"""
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT count(*) FROM sqlite_master WHERE type='table' and name='posting';
+                    """
+        )
+
+        return res.fetchone()[0] != 0
+
+    def build_postings(
+        self, encoding: str = POSTING_FLOAT16, term_ids: List[int] | None = None
+    ) -> None:
+        """
+        Encodes the value table into compact posting lists
+        term_ids - encode only these terms, all if None
+        Commit has to be called later!
+        """
+        self.create_posting_table()
+        self.set_meta(META_POSTING_ENCODING, encoding)
+
+        cur = self.con.cursor()
+        if term_ids is None:
+            cur.execute(""" DELETE FROM posting; """)
+            postings = self.iter_all_postings()
+        else:
+            cur.executemany(
+                """ DELETE FROM posting WHERE term_id = ?; """,
+                [[x] for x in term_ids],
+            )
+            postings = self.iter_term_postings(term_ids)
+
+        rows = []
+        for term_id, doc_ids, values in postings:
+            encoded = encode_posting(doc_ids, values, encoding)
+            rows.append((term_id, len(doc_ids), *encoded))
+
+            if len(rows) >= BULK_BATCH_SIZE:
+                self.insert_postings(rows)
+                rows = []
+        self.insert_postings(rows)
+
+    def iter_all_postings(self) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Yields term id, doc ids and values of all the terms
+        The whole value table is read at once and sorted in memory
+        """
+        doc_ids, value_term_ids, values = self.get_all_values()
+        order = np.lexsort((doc_ids, value_term_ids))
+        doc_ids, value_term_ids = doc_ids[order], value_term_ids[order]
+        values = values[order]
+
+        uniques, starts = np.unique(value_term_ids, return_index=True)
+        ends = np.append(starts[1:], len(value_term_ids))
+        for term_id, start, end in zip(uniques.tolist(), starts, ends):
+            yield term_id, doc_ids[start:end], values[start:end]
+
+    def iter_term_postings(
+        self, term_ids: List[int]
+    ) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Yields term id, doc ids and values of the terms given with any values
+        Only values of these terms are read, in batches of terms
+        """
+        cur = self.con.cursor()
+        ids = sorted(set(term_ids))
+
+        # stay under the SQLite host parameter limit
+        for i in range(0, len(ids), MAX_SQL_PARAMS):
+            chunk = ids[i : i + MAX_SQL_PARAMS]
+            question_marks = ",".join("?" * len(chunk))
+            res = cur.execute(
+                f"""
+SELECT term_id, doc_id, value FROM value
+WHERE term_id IN ({question_marks})
+ORDER BY term_id;
+                    """,
+                chunk,
+            )
+
+            rows = res.fetchall()
+            for term_id, group in itertools.groupby(rows, key=lambda x: x[0]):
+                group = list(group)
+                doc_ids = np.fromiter((x[1] for x in group), np.int64, len(group))
+                values = np.fromiter((x[2] for x in group), np.float64, len(group))
+                order = np.argsort(doc_ids)
+                yield term_id, doc_ids[order], values[order]
+
+    def insert_postings(self, rows: List[Tuple[int, int, float, bytes, bytes]]) -> None:
+        """
+        Inserts encoded posting lists
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+
+        cur.executemany(
+            """
+INSERT INTO posting(term_id, doc_count, scale, doc_ids, weights)
+VALUES(?, ?, ?, ?, ?);
+                    """,
+            rows,
+        )
+
+    def get_encoded_postings(
+        self, term_names: List[str]
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Gets posting lists of the terms given from the compact posting table
+        """
+        cur = self.con.cursor()
+        names = list(dict.fromkeys(term_names))
+        to_return: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+        # stay under the SQLite host parameter limit
+        for i in range(0, len(names), MAX_SQL_PARAMS):
+            chunk = names[i : i + MAX_SQL_PARAMS]
+            question_marks = ",".join("?" * len(chunk))
+            res = cur.execute(
+                f"""
+SELECT term.name, doc_count, scale, doc_ids, weights FROM term
+JOIN posting USING(term_id)
+WHERE term.name IN ({question_marks});
+                    """,
+                chunk,
+            )
+
+            for name, doc_count, scale, doc_ids, weights in res.fetchall():
+                to_return[name] = decode_posting(doc_count, scale, doc_ids, weights)
+
+        return to_return
+
+    @metrics.timed("db_get_terms_for_doc")
+    def get_terms_for_doc(self, doc_id: int) -> Dict[str, np.float32]:
+        """
+        Gets terms in given document
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(TERMS_OF_DOC_QUERY, [doc_id])
+
+        rows = res.fetchall()
+        term_names = [row[0] for row in rows]
+        values = (np.float32(x[1]) for x in rows)
+        to_return = dict(zip(term_names, values))
+        return to_return
+
+    def get_all_values(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Gets the whole value table at once
+        Returns arrays in the order [doc_ids, term_ids, values]
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT doc_id, term_id, value FROM value;
                     """
         )
+
+        rows = res.fetchall()
+        if len(rows) == 0:
+            return (
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.float64),
+            )
+
+        doc_ids, term_ids, values = zip(*rows)
+        return (
+            np.array(doc_ids, dtype=np.int64),
+            np.array(term_ids, dtype=np.int64),
+            np.array(values, dtype=np.float64),
+        )
+
+    def get_all_terms(self) -> Dict[str, int]:
+        """
+        Gets all the terms with their ids
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT name, term_id FROM term ORDER BY term_id;
+                    """
+        )
+
+        return dict(res.fetchall())
+
+    def get_all_doc_ids(self) -> np.ndarray:
+        """
+        Gets ids of all the documents in ascending order
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(
+            """
+SELECT doc_id FROM document ORDER BY doc_id;
+                    """
+        )
+
+        return np.array([x[0] for x in res.fetchall()], dtype=np.int64)
+
+    def has_doc_norms(self) -> bool:
+        """Checks if the database stores document norms"""
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT count(*) FROM sqlite_master WHERE type='table' and name='doc_norm';
+                    """
+        )
+
+        return res.fetchone()[0] != 0
+
+    def update_doc_norms(self, only_dirty: bool = False) -> None:
+        """
+        Counts L2 norms of all the document weight vectors and stores them
+        only_dirty - count only norms of the documents containing a dirty term
+        Commit has to be called later!
+        """
+        self.create_doc_norm_table()
+
+        cur = self.con.cursor()
+        if only_dirty:
+            res = cur.execute(
+                """
+SELECT doc_id, sum(value * value) FROM value
+WHERE doc_id IN (
+    SELECT doc_id FROM frequency JOIN term_stats USING(term_id) WHERE dirty
+)
+GROUP BY doc_id;
+                    """
+            )
+        else:
+            res = cur.execute(COUNT_DOC_NORMS_QUERY)
+        norms = [(doc_id, math.sqrt(squares)) for doc_id, squares in res.fetchall()]
+
+        if not only_dirty:
+            cur.execute(""" DELETE FROM doc_norm; """)
+        cur.executemany(
+            """
+INSERT OR REPLACE INTO doc_norm(doc_id, norm) VALUES(?, ?);
+                    """,
+            norms,
+        )
+
+    def update_term_bounds(self) -> None:
+        """
+        Stores for each term it's max weight divided by the document norm,
+        which bounds the term contribution to a cosine similarity.
+        If compact posting lists are stored, queries score their rounded weights,
+        so the bounds are counted from them too.
+        Has to be called after the document norms and posting lists are updated.
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(
+            """
+CREATE TABLE IF NOT EXISTS term_bound (
+    term_id INTEGER NOT NULL PRIMARY KEY,
+    max_weight DOUBLE PRECISION NOT NULL,
+    FOREIGN KEY(term_id) REFERENCES term(term_id)
+);
+        """
+        )
+        cur.execute(""" DELETE FROM term_bound; """)
+        if self.has_postings():
+            cur.executemany(
+                """
+INSERT INTO term_bound(term_id, max_weight) VALUES(?, ?);
+                    """,
+                self.get_encoded_bounds(),
+            )
+            return
+
+        cur.execute(
+            """
+INSERT INTO term_bound(term_id, max_weight)
+SELECT term_id, max(value / norm) FROM value
+JOIN doc_norm USING(doc_id)
+WHERE norm > 0
+GROUP BY term_id;
+                    """
+        )
+
+    def get_encoded_bounds(self) -> Iterator[Tuple[int, float]]:
+        """
+        Yields term ids and max weights divided by the document norm
+        of the decoded compact posting lists
+        """
+        cur = self.con.cursor()
+        res = cur.execute(""" SELECT doc_id, norm FROM doc_norm ORDER BY doc_id; """)
+        rows = res.fetchall()
+        if len(rows) == 0:
+            return
+        norm_ids = np.fromiter((x[0] for x in rows), np.int64, len(rows))
+        norms = np.fromiter((x[1] for x in rows), np.float64, len(rows))
+
+        res = self.con.cursor().execute(
+            """
+SELECT term_id, doc_count, scale, doc_ids, weights FROM posting;
+                    """
+        )
+        for term_id, doc_count, scale, doc_ids, weights in res:
+            doc_ids, weights = decode_posting(doc_count, scale, doc_ids, weights)
+            rows = np.minimum(np.searchsorted(norm_ids, doc_ids), len(norm_ids) - 1)
+            doc_norms = np.where(norm_ids[rows] == doc_ids, norms[rows], 0.0)
+            positive = doc_norms > 0
+            if positive.any():
+                bounds = np.asarray(weights, np.float64)[positive] / doc_norms[positive]
+                yield term_id, float(bounds.max())
+
+    def has_term_bounds(self) -> bool:
+        """Checks if the database stores max weights of terms"""
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT count(*) FROM sqlite_master WHERE type='table' and name='term_bound';
+                    """
+        )
+
+        return res.fetchone()[0] != 0
+
+    def get_term_bounds(self, term_names: List[str]) -> Dict[str, float]:
+        """
+        Gets max normalized weights of the terms given
+        Unknown terms are left out, terms without postings have 0
+        """
+        if not self.has_term_bounds():
+            return {}
+
+        cur = self.con.cursor()
+        names = list(dict.fromkeys(term_names))
+        to_return: Dict[str, float] = {}
+
+        # stay under the SQLite host parameter limit
+        for i in range(0, len(names), MAX_SQL_PARAMS):
+            chunk = names[i : i + MAX_SQL_PARAMS]
+            question_marks = ",".join("?" * len(chunk))
+            res = cur.execute(
+                f"""
+SELECT name, coalesce(max_weight, 0) FROM term
+LEFT JOIN term_bound USING(term_id)
+WHERE name IN ({question_marks});
+                    """,
+                chunk,
+            )
+            to_return.update(res.fetchall())
+
+        return to_return
+
+    def create_similar_table(self, k: int) -> None:
+        """
+        Creates an empty table for the top k similar documents of each document
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(""" DROP TABLE IF EXISTS similar; """)
         cur.execute(
             """
-DROP INDEX IF EXISTS value_doc_id;
+CREATE TABLE similar (
+    doc_id INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    score DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY(doc_id, rank),
+    FOREIGN KEY(doc_id) REFERENCES document(doc_id),
+    FOREIGN KEY(similar_id) REFERENCES document(doc_id)
+);
+        """
+        )
+        self.set_meta(META_SIMILAR_K, k)
+
+    def drop_similar_table(self) -> None:
+        """
+        Drops the precomputed similar documents
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(""" DROP TABLE IF EXISTS similar; """)
+
+    def has_similar(self) -> bool:
+        """Checks if the database stores precomputed similar documents"""
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT count(*) FROM sqlite_master WHERE type='table' and name='similar';
                     """
         )
+
+        return res.fetchone()[0] != 0
+
+    def insert_similar(self, rows: List[Tuple[int, int, int, float]]) -> None:
+        """
+        Inserts similar documents as (doc_id, rank, similar_id, score)
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+
+        cur.executemany(
+            """
+INSERT INTO similar(doc_id, rank, similar_id, score) VALUES(?, ?, ?, ?);
+                    """,
+            rows,
+        )
+
+    def get_similar(self, doc_id: int, k: int) -> List[Tuple[float, int]] | None:
+        """
+        Gets top k precomputed similar documents, the document itself included
+        Returns None if they were not precomputed or less documents were stored
+        """
+        if not self.has_similar() or k > int(self.get_meta(META_SIMILAR_K, "0")):
+            return None
+
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT score, similar_id FROM similar
+WHERE doc_id = ? AND rank < ?
+ORDER BY rank;
+                    """,
+            [doc_id, k],
+        )
+
+        return res.fetchall()
+
+    def create_embedding_tables(self) -> None:
+        """
+        Creates empty tables for document embeddings and their clusters
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(""" DROP TABLE IF EXISTS embedding; """)
+        cur.execute(""" DROP TABLE IF EXISTS centroid; """)
+        cur.execute(
+            """
+CREATE TABLE centroid (
+    list_id INTEGER NOT NULL PRIMARY KEY,
+    vector BLOB NOT NULL
+);
+        """
+        )
         cur.execute(
             """
-DROP INDEX IF EXISTS value_term_id;
+CREATE TABLE embedding (
+    doc_id INTEGER NOT NULL PRIMARY KEY,
+    list_id INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    FOREIGN KEY(doc_id) REFERENCES document(doc_id),
+    FOREIGN KEY(list_id) REFERENCES centroid(list_id)
+);
+        """
+        )
+
+    def drop_embedding_tables(self) -> None:
+        """
+        Drops the document embeddings and their clusters
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.execute(""" DROP TABLE IF EXISTS embedding; """)
+        cur.execute(""" DROP TABLE IF EXISTS centroid; """)
+
+    def has_embeddings(self) -> bool:
+        """Checks if the database stores document embeddings"""
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT count(*) FROM sqlite_master WHERE type='table' and name='embedding';
                     """
         )
 
+        return res.fetchone()[0] != 0
+
+    def insert_centroids(self, rows: List[Tuple[int, bytes]]) -> None:
+        """
+        Inserts float32 centroids of the clusters
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.executemany(
+            """ INSERT INTO centroid(list_id, vector) VALUES(?, ?); """, rows
+        )
+
+    def insert_embeddings(self, rows: List[Tuple[int, int, bytes]]) -> None:
+        """
+        Inserts float32 embeddings of the documents with their clusters
+        Commit has to be called later!
+        """
+        cur = self.con.cursor()
+        cur.executemany(
+            """ INSERT INTO embedding(doc_id, list_id, vector) VALUES(?, ?, ?); """,
+            rows,
+        )
+
+    def get_embeddings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Gets doc ids, cluster ids and embeddings of all the documents
+        and centroids of all the clusters
+        """
+        cur = self.con.cursor()
+
+        res = cur.execute(""" SELECT vector FROM centroid ORDER BY list_id; """)
+        centroids = [x[0] for x in res.fetchall()]
+        dim = len(centroids[0]) // np.dtype(np.float32).itemsize if centroids else 0
+
+        res = cur.execute(
+            """ SELECT doc_id, list_id, vector FROM embedding ORDER BY doc_id; """
+        )
+        rows = res.fetchall()
+        doc_ids = np.fromiter((x[0] for x in rows), np.int64, len(rows))
+        list_ids = np.fromiter((x[1] for x in rows), np.int64, len(rows))
+        embeddings = np.frombuffer(b"".join(x[2] for x in rows), dtype=np.float32)
+
+        return (
+            doc_ids,
+            list_ids,
+            embeddings.reshape(len(rows), dim),
+            np.frombuffer(b"".join(centroids), np.float32).reshape(len(centroids), dim),
+        )
+
+    @metrics.timed("db_get_doc_norms")
+    def get_doc_norms(self, doc_ids: List[int]) -> Dict[int, float]:
+        """
+        Gets stored norms of the documents given
+        Documents without a norm stored are left out
+        """
+        if not self.has_doc_norms():
+            return {}
+
+        cur = self.con.cursor()
+        to_return: Dict[int, float] = {}
+
+        # stay under the SQLite host parameter limit
+        for i in range(0, len(doc_ids), MAX_SQL_PARAMS):
+            chunk = doc_ids[i : i + MAX_SQL_PARAMS]
+            question_marks = ",".join("?" * len(chunk))
+            res = cur.execute(DOC_NORMS_QUERY.format(params=question_marks), chunk)
+            to_return.update(res.fetchall())
+
+        return to_return
+
+    def has_index(self) -> bool:
+        """Checks if the database has created indexes"""
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT count(*) FROM sqlite_master WHERE type='index' and name='value_doc';
+                    """
+        )
+
+        return res.fetchone()[0] != 0
+
+    def is_clustered(self) -> bool:
+        """Checks if the value table is stored ordered by term id"""
+        cur = self.con.cursor()
+        res = cur.execute(
+            """
+SELECT sql FROM sqlite_master WHERE type='table' and name='value';
+                    """
+        )
+
+        fetched = res.fetchone()
+        return fetched is not None and "WITHOUT ROWID" in fetched[0].upper()
+
+    def create_index(self):
+        print("Creating index")
+
+        cur = self.con.cursor()
+        for name in LEGACY_INDEXES:
+            cur.execute(f""" DROP INDEX IF EXISTS {name}; """)
+
+        for name, columns in VALUE_INDEXES.items():
+            cur.execute(f""" CREATE INDEX IF NOT EXISTS {name} ON {columns}; """)
+
+        self.analyze()
+
+    def drop_index(self):
+        print("Dropping index")
+
+        cur = self.con.cursor()
+        for name in LEGACY_INDEXES + list(VALUE_INDEXES.keys()):
+            cur.execute(f""" DROP INDEX IF EXISTS {name}; """)
+
+    def analyze(self) -> None:
+        """
+        Gathers statistics of the tables and indexes,
+        so the query planner can choose between the indexes
+        """
+        self.commit()
+        self.con.execute(""" ANALYZE; """)
+
+    def explain_queries(self) -> Dict[str, List[str]]:
+        """
+        Returns plans SQLite uses for the main queries,
+        each plan is a list of the plan steps
+        """
+        cur = self.con.cursor()
+
+        plans = {}
+        for name, (sql, params) in EXPLAINED_QUERIES.items():
+            sql = sql.format(params=",".join("?" * len(params)))
+            res = cur.execute(f""" EXPLAIN QUERY PLAN {sql} """, params)
+            plans[name] = [row[3] for row in res.fetchall()]
+        return plans
+
     def get_stats(self) -> Tuple[int, int, int]:
         """
         Returns the number of rows in the DB tables
@@ -418,6 +1649,23 @@ DROP INDEX IF EXISTS value_term_id;
 
         return (terms, documents, values)
 
+    def get_table_sizes(self) -> Dict[str, int]:
+        """
+        Gets bytes used by each table and index, empty if SQLite
+        is built without the dbstat table
+        """
+        cur = self.con.cursor()
+        try:
+            res = cur.execute(
+                """
+SELECT name, sum(pgsize) FROM dbstat GROUP BY name ORDER BY sum(pgsize) DESC;
+                    """
+            )
+        except sqlite3.OperationalError:
+            return {}
+
+        return dict(res.fetchall())
+
     def print_stats(self) -> None:
         """Prints info about DB table sizes"""
         cur = self.con.cursor()
@@ -426,3 +1674,335 @@ DROP INDEX IF EXISTS value_term_id;
         print(f"Terms: {terms}")
         print(f"Documents: {documents}")
         print(f"Values: {values}")
+
+
+# Queries shown by explain_queries with example parameters
+EXPLAINED_QUERIES: Dict[str, Tuple[str, List]] = {
+    "postings": (POSTINGS_QUERY, ["a", "b"]),
+    "top postings": (TOP_POSTINGS_QUERY, ["a", 10]),
+    "terms of document": (TERMS_OF_DOC_QUERY, [1]),
+    "document norms": (COUNT_DOC_NORMS_QUERY, []),
+    "stored document norms": (DOC_NORMS_QUERY, [1, 2]),
+    "document by title": (DOC_BY_TITLE_QUERY, ["a"]),
+    "document by id": (DOC_BY_ID_QUERY, [1]),
+}
+
+
+def postings_to_vectors(
+    postings: List[Tuple[np.ndarray, np.ndarray] | None]
+) -> Dict[int, np.ndarray]:
+    """
+    Creates weight vectors of all the documents in the posting lists given
+    i-th item of a vector is the weight from the i-th posting list,
+    None stands for an empty posting list
+    """
+    present = [(i, x) for i, x in enumerate(postings) if x is not None]
+    if len(present) == 0:
+        return {}
+
+    all_doc_ids = np.concatenate([x[0] for _, x in present])
+    doc_ids, rows = np.unique(all_doc_ids, return_inverse=True)
+    cols = np.concatenate([np.full(len(x[0]), i) for i, x in present])
+    values = np.concatenate([x[1] for _, x in present])
+
+    vectors = np.zeros((len(doc_ids), len(postings)))
+    vectors[rows, cols] = values
+
+    return dict(zip(doc_ids.tolist(), vectors))
+
+
+def top_postings(
+    doc_ids: np.ndarray, weights: np.ndarray, limit: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keeps only limit postings with the highest weight, sorted by doc ids
+    """
+    if len(doc_ids) <= limit:
+        return doc_ids, weights
+
+    selected = np.sort(np.argpartition(weights, len(weights) - limit)[-limit:])
+    return doc_ids[selected], weights[selected]
+
+
+def encode_posting(
+    doc_ids: np.ndarray, weights: np.ndarray, encoding: str = POSTING_FLOAT16
+) -> Tuple[float | None, bytes, bytes]:
+    """
+    Encodes a posting list sorted by doc ids
+    Doc ids are stored as deltas, 2 bytes each if they fit, 4 bytes otherwise.
+    Weights are stored as float16 or as uint8 multiples of a scale.
+    Returns scale (None for float16), doc ids and weights
+    """
+    deltas = np.diff(doc_ids, prepend=0)
+    dtype = np.uint16 if deltas.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    encoded_ids = deltas.astype(dtype).tobytes()
+
+    if encoding == POSTING_UINT8:
+        scale = float(weights.max(initial=0)) / 255 or 1.0
+        quantized = np.round(weights / scale).astype(np.uint8)
+        return scale, encoded_ids, quantized.tobytes()
+
+    return None, encoded_ids, weights.astype(np.float16).tobytes()
+
+
+def decode_posting(
+    doc_count: int, scale: float | None, doc_ids: bytes, weights: bytes
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes a posting list created by encode_posting
+    Weights are returned as a view of the buffer given if possible
+    """
+    dtype = np.uint16 if len(doc_ids) == 2 * doc_count else np.uint32
+    decoded_ids = np.cumsum(np.frombuffer(doc_ids, dtype=dtype), dtype=np.int64)
+
+    if scale is None:
+        return decoded_ids, np.frombuffer(weights, dtype=np.float16)
+
+    return decoded_ids, np.frombuffer(weights, dtype=np.uint8) * scale
+
+
+class ConnectionPool:
+    """
+    Pool of read-only connections to a DB file
+    Connections are opened with a mode=ro URI and tuned for reading,
+    a connection is used by a single thread at a time.
+    The DB file is never written, index switches it to the WAL journal,
+    so the readers keep working while an update is written.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = POOL_SIZE,
+        cache_kib: int = POOL_CACHE_KIB,
+        mmap_bytes: int = POOL_MMAP_BYTES,
+    ):
+        self.path = path
+        self.cache_kib = cache_kib
+        self.mmap_bytes = mmap_bytes
+        self.connections: queue.Queue = queue.Queue()
+
+        if not pathlib.Path(path).is_file():
+            raise FileNotFoundError(f"The index {path} does not exist, run index first")
+        for _ in range(size):
+            self.connections.put(self.connect())
+
+    def connect(self) -> Connection:
+        uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro"
+        # autocommit, a failed write must not keep an old snapshot open
+        con = sqlite3.connect(
+            uri, uri=True, check_same_thread=False, isolation_level=None
+        )
+        con.execute(f""" PRAGMA cache_size = -{self.cache_kib}; """)
+        con.execute(f""" PRAGMA mmap_size = {self.mmap_bytes}; """)
+        con.execute(""" PRAGMA query_only = ON; """)
+        return con
+
+    def acquire(self, timeout: float | None = None) -> Connection:
+        """Checks out a connection, waits until one is free"""
+        return self.connections.get(timeout=timeout)
+
+    def release(self, con: Connection) -> None:
+        """Returns the connection checked out"""
+        con.rollback()
+        self.connections.put(con)
+
+    def close(self) -> None:
+        """Closes the connections not checked out"""
+        while not self.connections.empty():
+            self.connections.get_nowait().close()
+
+
+class PostingCache:
+    """
+    LRU cache of decoded posting lists of terms
+    Holds posting lists up to the size given in bytes,
+    the arrays are read-only as they are shared by the queries.
+    """
+
+    def __init__(self, max_bytes: int = POSTING_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict = OrderedDict()
+        self.generation: int | None = None
+        # if the compact posting table exists, None until checked
+        self.compact: bool | None = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_many(
+        self, term_names: List[str]
+    ) -> Tuple[Dict[str, Tuple[np.ndarray, np.ndarray]], List[str]]:
+        """
+        Returns the cached posting lists and the names of the missing terms
+        """
+        found: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        missing: List[str] = []
+
+        with self.lock:
+            for name in term_names:
+                posting = self.entries.get(name)
+                if posting is None:
+                    missing.append(name)
+                else:
+                    self.entries.move_to_end(name)
+                    found[name] = posting
+
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        return found, missing
+
+    def put_many(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> None:
+        """
+        Caches the posting lists, the least recently used ones are evicted
+        """
+        with self.lock:
+            for name, (doc_ids, weights) in postings.items():
+                size = doc_ids.nbytes + weights.nbytes
+                if size > self.max_bytes or name in self.entries:
+                    continue
+
+                doc_ids.flags.writeable = False
+                weights.flags.writeable = False
+                self.entries[name] = (doc_ids, weights)
+                self.size += size
+
+            while self.size > self.max_bytes:
+                _, (doc_ids, weights) = self.entries.popitem(last=False)
+                self.size -= doc_ids.nbytes + weights.nbytes
+
+    def check_generation(self, generation: int) -> None:
+        """Drops the cache if the index was changed since"""
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.compact = None
+
+
+class BulkLoader:
+    """
+    Buffers inserted terms, documents, values and frequencies
+    and writes them to the database in batches.
+    Ids are assigned in process, so no round trip is needed to get them,
+    term ids are resolved by an in-process vocabulary.
+    If a memory budget is given, all the buffers are written
+    once their estimated size reaches it.
+    The loader has to be the only writer of the database while used.
+    """
+
+    def __init__(
+        self,
+        db: WikiDatabase,
+        batch_size: int = BULK_BATCH_SIZE,
+        memory_budget: int = 0,
+    ):
+        """
+        memory_budget - max size of the buffers in bytes, 0 for no limit
+        """
+        self.db = db
+        self.batch_size = batch_size if batch_size > 0 else BULK_BATCH_SIZE
+        self.memory_budget = memory_budget
+        self.buffered_bytes = 0
+        self.vocabulary = db.get_all_terms()
+        self.next_term_id = max(self.vocabulary.values(), default=0) + 1
+        self.next_doc_id = db.get_max_doc_id() + 1
+        self.terms: List[Tuple[int, str]] = []
+        self.documents: List[Tuple[int, str, str]] = []
+        self.values: List[Tuple[int, int, float]] = []
+        self.frequencies: List[Tuple[int, int, int]] = []
+
+    def get_or_insert_term(self, name: str) -> int:
+        """
+        Gets id of the term, new terms are buffered
+        """
+        term_id = self.vocabulary.get(name)
+        if term_id is not None:
+            return term_id
+
+        term_id = self.next_term_id
+        self.next_term_id += 1
+        self.vocabulary[name] = term_id
+
+        self.terms.append((term_id, name))
+        self.track(ROW_BYTES + len(name))
+        if len(self.terms) >= self.batch_size:
+            self.flush_terms()
+
+        return term_id
+
+    def insert_document(self, title: str, text: str) -> int:
+        """
+        Buffers a new document
+        returns it's new id
+        """
+        doc_id = self.next_doc_id
+        self.next_doc_id += 1
+
+        self.documents.append((doc_id, title, text))
+        self.track(ROW_BYTES + len(title) + len(text))
+        if len(self.documents) >= self.batch_size:
+            self.flush_documents()
+
+        return doc_id
+
+    def insert_value(self, term_id: int, doc_id: int, value: float) -> None:
+        """
+        Buffers a new value relation
+        """
+        self.values.append((term_id, doc_id, value))
+        self.track(ROW_BYTES)
+        if len(self.values) >= self.batch_size:
+            self.flush_values()
+
+    def insert_frequency(self, term_id: int, doc_id: int, freq: int) -> None:
+        """
+        Buffers a new absolute term frequency
+        """
+        self.frequencies.append((term_id, doc_id, freq))
+        self.track(ROW_BYTES)
+        if len(self.frequencies) >= self.batch_size:
+            self.flush_frequencies()
+
+    def track(self, size: int) -> None:
+        """
+        Counts the bytes buffered, flushes if the budget is exceeded
+        """
+        self.buffered_bytes += size
+        if self.memory_budget > 0 and self.buffered_bytes >= self.memory_budget:
+            self.flush()
+
+    def flush_terms(self) -> None:
+        self.db.insert_terms(self.terms)
+        self.terms = []
+
+    def flush_documents(self) -> None:
+        self.db.insert_documents(self.documents)
+        self.documents = []
+
+    def flush_values(self) -> None:
+        self.db.insert_values(self.values)
+        self.values = []
+
+    def flush_frequencies(self) -> None:
+        # the staging table exists only during external builds
+        if len(self.frequencies) != 0:
+            self.db.insert_frequencies(self.frequencies)
+        self.frequencies = []
+
+    def flush(self) -> None:
+        """
+        Writes all the buffered rows
+        Commit has to be called later!
+        """
+        self.flush_terms()
+        self.flush_documents()
+        self.flush_values()
+        self.flush_frequencies()
+        self.buffered_bytes = 0
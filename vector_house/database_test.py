@@ -1,6 +1,18 @@
 from typing import Callable
 import random as rnd
-from vector_house.database import WikiDatabase
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from vector_house.database import (
+    WikiDatabase,
+    POSTING_FLOAT16,
+    POSTING_UINT8,
+    encode_posting,
+    decode_posting,
+    PostingCache,
+    EXPLAINED_QUERIES,
+)
 
 DB_PATH_TEST = "wiki-test-index.db"
 
@@ -21,10 +33,7 @@ def run_with_db(fun: Callable[[WikiDatabase], None]) -> None:
 
         try:
             fun(db)
-        except AssertionError:
-            close()
-            raise
-        else:
+        finally:
             close()
 
     return run
@@ -82,3 +91,285 @@ def test_insert_value(db: WikiDatabase) -> None:
         db.insert_value(term_id, doc_id, value)
         stored = db.get_value_by_ids(term_id, doc_id)
         assert stored == value
+
+
+@run_with_db
+def test_doc_norms(db: WikiDatabase) -> None:
+    doc_ids = [db.insert_document("Title " + str(i), "Text") for i in range(3)]
+    term_ids = [db.insert_term("Term " + str(i)) for i in range(2)]
+
+    db.insert_value(term_ids[0], doc_ids[0], 3)
+    db.insert_value(term_ids[1], doc_ids[0], 4)
+    db.insert_value(term_ids[1], doc_ids[1], 2)
+
+    assert db.has_doc_norms()
+    assert db.get_doc_norms(doc_ids) == {}
+
+    db.update_doc_norms()
+    assert db.get_doc_norms(doc_ids) == {doc_ids[0]: 5, doc_ids[1]: 2}
+    assert db.get_doc_norms([doc_ids[1]]) == {doc_ids[1]: 2}
+
+
+@run_with_db
+def test_bulk_loader(db: WikiDatabase) -> None:
+    existing_id = db.insert_term("Term 0")
+    db.insert_document("Title 0", "Text 0")
+
+    loader = db.bulk_loader(batch_size=3)
+    assert loader.get_or_insert_term("Term 0") == existing_id
+
+    term_ids = [loader.get_or_insert_term("Term " + str(i)) for i in range(1, 5)]
+    assert term_ids == [2, 3, 4, 5]
+    assert loader.get_or_insert_term("Term 3") == 4
+
+    doc_ids = [loader.insert_document("Title " + str(i), "Text") for i in range(1, 5)]
+    assert doc_ids == [2, 3, 4, 5]
+
+    for i in range(4):
+        loader.insert_value(term_ids[i], doc_ids[i], i / 10)
+
+    # first batches are written already
+    assert db.get_term_id("Term 3") == 4
+    assert db.get_value_by_ids(term_ids[1], doc_ids[1]) == 0.1
+    assert db.get_stats() == (4, 4, 3)
+
+    loader.flush()
+    assert db.get_stats() == (5, 5, 4)
+    assert db.get_doc_id("Title 4") == 5
+    assert db.get_value_by_ids(term_ids[3], doc_ids[3]) == 0.3
+
+    assert db.bulk_loader().get_or_insert_term("Term 4") == 5
+
+
+@run_with_db
+def test_postings(db: WikiDatabase) -> None:
+    doc_ids = [db.insert_document("Title " + str(i), "Text") for i in range(4)]
+    term_ids = [db.insert_term("Term " + str(i)) for i in range(3)]
+
+    db.insert_value(term_ids[0], doc_ids[3], 1.5)
+    db.insert_value(term_ids[0], doc_ids[1], 0.25)
+    db.insert_value(term_ids[1], doc_ids[2], 2)
+
+    names = ["Term 0", "Term 1", "Term 2"]
+    from_values = db.get_postings(names)
+    vectors = db.get_values_for_terms(names)
+
+    assert not db.has_postings()
+    assert list(from_values.keys()) == ["Term 0", "Term 1"]
+    assert list(from_values["Term 0"][0]) == [doc_ids[1], doc_ids[3]]
+    assert list(from_values["Term 0"][1]) == [0.25, 1.5]
+    assert list(vectors[doc_ids[1]]) == [0.25, 0, 0]
+    assert list(vectors[doc_ids[2]]) == [0, 2, 0]
+
+    for encoding in [POSTING_FLOAT16, POSTING_UINT8]:
+        db.build_postings(encoding)
+        assert db.has_postings()
+
+        encoded = db.get_postings(names)
+        assert encoded.keys() == from_values.keys()
+        for name, (ids, weights) in encoded.items():
+            assert list(ids) == list(from_values[name][0])
+            assert np.allclose(weights, from_values[name][1], atol=0.01)
+
+        assert db.get_values_for_terms(names).keys() == vectors.keys()
+
+        top = db.get_postings(names, limit=1)
+        assert list(top["Term 0"][0]) == [doc_ids[3]]
+        assert list(top["Term 1"][0]) == [doc_ids[2]]
+
+    db.drop_posting_table()
+    for create_index in [False, True]:
+        if create_index:
+            db.create_index()
+
+        top = db.get_postings(names, limit=1)
+        assert list(top.keys()) == ["Term 0", "Term 1", "Term 2"]
+        assert list(top["Term 0"][0]) == [doc_ids[3]]
+        assert list(top["Term 0"][1]) == [1.5]
+        assert len(top["Term 2"][0]) == 0
+        assert db.get_postings(names, limit=5)["Term 0"][1].tolist() == [0.25, 1.5]
+
+    # only the terms given are encoded again
+    db.build_postings(POSTING_FLOAT16)
+    db.insert_value(term_ids[0], doc_ids[0], 0.5)
+    db.insert_value(term_ids[1], doc_ids[0], 0.5)
+    db.insert_value(term_ids[2], doc_ids[0], 0.5)
+    db.build_postings(POSTING_FLOAT16, [term_ids[1], term_ids[2]])
+    db.commit()
+    encoded = db.get_postings(names)
+    assert list(encoded["Term 0"][0]) == [doc_ids[1], doc_ids[3]]
+    assert list(encoded["Term 1"][0]) == [doc_ids[0], doc_ids[2]]
+    assert list(encoded["Term 2"][0]) == [doc_ids[0]]
+
+    db.drop_posting_table()
+    assert len(db.get_postings(names)["Term 0"][0]) == 3
+
+
+@run_with_db
+def test_indexes(db: WikiDatabase) -> None:
+    """Tests the queries are answered from the covering indexes"""
+
+    doc_ids = [db.insert_document("Title " + str(i), "Text") for i in range(20)]
+    term_ids = [db.insert_term("Term " + str(i)) for i in range(10)]
+    for i, doc_id in enumerate(doc_ids):
+        for term_id in term_ids[: i % 10 + 1]:
+            db.insert_value(term_id, doc_id, i + 1)
+    db.con.execute(""" CREATE INDEX term_term_id ON value (term_id); """)
+    db.con.execute(""" CREATE INDEX value_term ON value (term_id, doc_id, value); """)
+    db.commit()
+
+    assert not db.has_index()
+    terms = db.get_terms_for_doc(doc_ids[3])
+    db.create_index()
+    assert db.has_index()
+    assert not db.is_clustered()
+    assert db.get_terms_for_doc(doc_ids[3]) == terms
+
+    names = db.con.execute(""" SELECT name FROM sqlite_master WHERE type='index'; """)
+    names = {x[0] for x in names.fetchall()}
+    assert not {"term_term_id", "value_term"} & names
+    assert {"value_term_impact", "value_doc", "document_title"} <= names
+
+    # every query reads only an index, postings are not sorted in SQL
+    plans = db.explain_queries()
+    assert plans.keys() == EXPLAINED_QUERIES.keys()
+    assert any("COVERING INDEX value_term_impact" in x for x in plans["postings"])
+    assert not any("TEMP B-TREE" in x for x in plans["postings"])
+    assert any("COVERING INDEX value_doc " in x for x in plans["terms of document"])
+    assert any("document_title" in x for x in plans["document by title"])
+
+    db.drop_index()
+    assert not db.has_index()
+
+    db.drop_database()
+    db.create_database(clustered=True)
+    doc_id = db.insert_document("Title", "Text")
+    db.insert_value(db.insert_term("Term"), doc_id, 0.5)
+    db.commit()
+    db.create_index()
+    assert db.is_clustered()
+    assert db.get_terms_for_doc(doc_id) == {"Term": 0.5}
+    assert db.get_postings(["Term"])["Term"][0].tolist() == [doc_id]
+
+
+@run_with_db
+def test_posting_cache(db: WikiDatabase) -> None:
+    doc_ids = [db.insert_document("Title " + str(i), "Text") for i in range(3)]
+    term_ids = [db.insert_term("Term " + str(i)) for i in range(3)]
+    for i, doc_id in enumerate(doc_ids):
+        db.insert_value(term_ids[0], doc_id, i + 1)
+    db.insert_value(term_ids[1], doc_ids[0], 0.5)
+    db.commit()
+
+    cache = db.posting_cache
+    postings = db.get_postings(["Term 0", "Term 1"])
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    postings = db.get_postings(["Term 2", "Term 1", "Term 0", "Unknown"])
+    assert list(postings.keys()) == ["Term 1", "Term 0"]
+    assert list(postings["Term 0"][1]) == [1, 2, 3]
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    # limited postings are cut from the cached ones
+    assert list(db.get_postings(["Term 0"], limit=1)["Term 0"][1]) == [3]
+    assert cache.hits == 3
+
+    db.insert_value(term_ids[1], doc_ids[1], 0.25)
+    db.commit()
+    assert len(db.get_postings(["Term 1"])["Term 1"][0]) == 2
+
+    # 3 doc ids and weights take 48 bytes
+    small = PostingCache(max_bytes=60)
+    small.put_many(db.get_postings(["Term 0", "Term 1"]))
+    assert list(small.entries.keys()) == ["Term 1"]
+    assert small.get_many(["Term 0", "Term 1"])[1] == ["Term 0"]
+
+    # compact posting lists are decoded whole, so a limited read caches them
+    db.build_postings(POSTING_FLOAT16)
+    db.commit()
+    assert len(db.get_postings(["Term 0"], limit=1)["Term 0"][0]) == 1
+    hits = db.posting_cache.hits
+    assert len(db.get_postings(["Term 0"])["Term 0"][0]) == 3
+    assert db.posting_cache.hits == hits + 1
+
+
+@run_with_db
+def test_connection_pool(db: WikiDatabase) -> None:
+    db.enable_wal()
+    doc_ids = [db.insert_document("Title " + str(i), "Text") for i in range(3)]
+    term_id = db.insert_term("Term")
+    for doc_id in doc_ids:
+        db.insert_value(term_id, doc_id, 1)
+    db.commit()
+
+    served = WikiDatabase(DB_PATH_TEST, read_only=True, pool_size=2)
+    try:
+        try:
+            served.get_stats()
+            assert False, "read-only DB queried outside of a session"
+        except RuntimeError:
+            pass
+
+        with served.session():
+            with served.session():
+                assert served.get_stats() == (1, 3, 3)
+            assert served.pool.connections.qsize() == 1
+
+            try:
+                served.insert_term("Other")
+                assert False, "read-only connection wrote"
+            except sqlite3.OperationalError:
+                pass
+
+            # readers see the last commit while an update is written
+            db.insert_document("Title 3", "Text")
+            assert served.get_stats()[1] == 3
+            db.commit()
+            assert served.get_stats()[1] == 4
+
+            # the generation is read by the session, not by each lookup
+            assert len(served.get_postings(["Term"])["Term"][0]) == 3
+            db.insert_value(term_id, 4, 1)
+            db.bump_generation()
+            db.commit()
+            assert len(served.get_postings(["Term"])["Term"][0]) == 3
+        with served.session():
+            assert len(served.get_postings(["Term"])["Term"][0]) == 4
+
+        def read(doc_id: int) -> str:
+            with served.session():
+                return served.get_doc_by_id(doc_id)[0]
+
+        with ThreadPoolExecutor(4) as executor:
+            titles = list(executor.map(read, [1, 2, 3, 4] * 5))
+        assert titles == ["Title 0", "Title 1", "Title 2", "Title 3"] * 5
+        assert served.pool.connections.qsize() == 2
+    finally:
+        served.close()
+
+
+def test_connection_pool_missing() -> None:
+    """Tests serving a missing DB fails instead of creating an empty one"""
+
+    path = "wiki-test-missing.db"
+    try:
+        WikiDatabase(path, read_only=True)
+        assert False, "missing DB served"
+    except FileNotFoundError:
+        pass
+    assert not os.path.exists(path)
+
+
+def test_posting_encoding() -> None:
+    doc_ids = np.array([3, 70000, 70001, 200000])
+    weights = np.array([0.5, 1.25, 13.37, 0])
+
+    for encoding in [POSTING_FLOAT16, POSTING_UINT8]:
+        encoded = encode_posting(doc_ids, weights, encoding)
+        decoded_ids, decoded_weights = decode_posting(len(doc_ids), *encoded)
+        assert list(decoded_ids) == list(doc_ids)
+        assert np.allclose(decoded_weights, weights, atol=0.03)
+
+    scale, encoded_ids, _ = encode_posting(np.array([1, 5, 9]), weights[:3])
+    assert scale is None
+    assert len(encoded_ids) == 2 * 3
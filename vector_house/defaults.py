@@ -0,0 +1,35 @@
+"""
+Defaults shared by the CLI options and the modules using them
+Importing this module loads nothing else, so the CLI can show its options
+without importing NLTK, SciPy or aiohttp.
+"""
+
+# Max number of Wiki pages to index
+INDEX_SIZE = 1000  # 8192
+# Memory used for buffers and DB cache by the external build, in MiB
+MEMORY_BUDGET = 256
+# Relative change of the document count after which append counts all the weights
+REFRESH_DRIFT = 0.1
+
+# Number of dimensions of the document embeddings
+EMBED_DIM = 128
+# Number of the nearest clusters searched by a query
+IVF_PROBES = 8
+
+MMAP_DEFAULT_DIR = "wiki-index-mmap"
+
+# Search engines answering the queries
+ENGINE_DB = "db"
+ENGINE_MATRIX = "matrix"
+ENGINE_MAXSCORE = "maxscore"
+ENGINE_ANN = "ann"
+
+# Max number of queries scored by a single matrix product
+BATCH_SIZE = 32
+# Seconds a query waits for others to join it's batch
+BATCH_WAIT = 0.002
+
+# Number of timed runs of each query
+LATENCY_RUNS = 10
+# Relative slowdown of a percentile reported as a regression
+REGRESSION_THRESHOLD = 0.2
@@ -0,0 +1,160 @@
+from typing import List, Tuple
+import numpy as np
+from scipy.sparse import diags
+from scipy.sparse.linalg import svds
+
+from vector_house.database import WikiDatabase
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.search_engine import top_k, TOP_K
+from vector_house.defaults import EMBED_DIM, IVF_PROBES
+
+# Number of k-means iterations clustering the embeddings
+IVF_ITERATIONS = 10
+
+
+def count_embeddings(engine: MatrixEngine, dim: int = EMBED_DIM) -> np.ndarray:
+    """
+    Reduces the normalized document vectors to dim dimensions by truncated SVD
+    The embeddings are normalized, so their dot product is a cosine similarity
+    """
+
+    with np.errstate(divide="ignore"):
+        inv_norms = np.where(engine.norms > 0, 1 / engine.norms, 0.0)
+    normalized = (diags(inv_norms) @ engine.matrix).astype(np.float64)
+
+    dim = min(dim, min(normalized.shape) - 1)
+    if dim <= 0:
+        return np.zeros((normalized.shape[0], 0), dtype=np.float32)
+
+    u, sigma, _ = svds(normalized, k=dim, random_state=0)
+    embeddings = (u * sigma).astype(np.float32)
+    return normalize_rows(embeddings)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def cluster(
+    embeddings: np.ndarray, lists: int, iterations: int = IVF_ITERATIONS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Clusters the embeddings by spherical k-means
+    Returns the normalized centroids and the cluster of each embedding
+    """
+
+    rng = np.random.default_rng(0)
+    lists = max(1, min(lists, len(embeddings)))
+    centroids = embeddings[rng.choice(len(embeddings), lists, replace=False)]
+
+    assignment = np.zeros(len(embeddings), dtype=np.int64)
+    for _ in range(iterations):
+        assignment = np.argmax(embeddings @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, embeddings)
+        # empty clusters keep their centroid
+        empty = np.bincount(assignment, minlength=lists) == 0
+        sums[empty] = centroids[empty]
+        centroids = normalize_rows(sums)
+
+    return centroids, np.argmax(embeddings @ centroids.T, axis=1)
+
+
+def build_ann_index(
+    wiki_db: WikiDatabase, dim: int = EMBED_DIM, lists: int | None = None
+) -> None:
+    """
+    Stores document embeddings and their clusters used by AnnIndex
+    lists - number of clusters, square root of the document count by default
+    """
+
+    engine = MatrixEngine.from_database(wiki_db)
+    if len(engine.doc_ids) == 0:
+        print("No documents to embed")
+        return
+    print(f"Counting {dim} dimensional embeddings of {len(engine.doc_ids)} documents")
+    embeddings = count_embeddings(engine, dim)
+
+    if lists is None:
+        lists = int(np.sqrt(len(embeddings)))
+    print(f"Clustering embeddings into {lists} lists")
+    centroids, assignment = cluster(embeddings, lists)
+
+    wiki_db.create_embedding_tables()
+    wiki_db.insert_centroids([(i, x.tobytes()) for i, x in enumerate(centroids)])
+    wiki_db.insert_embeddings(
+        [
+            (int(doc_id), int(list_id), x.tobytes())
+            for doc_id, list_id, x in zip(engine.doc_ids, assignment, embeddings)
+        ]
+    )
+    # results cached for the old embeddings are dropped
+    wiki_db.bump_generation()
+    wiki_db.commit()
+
+
+class AnnIndex:
+    """
+    Inverted file (IVF) index over the document embeddings
+    A query is compared only to the documents in the clusters
+    with the nearest centroids, so the result is approximate.
+    """
+
+    def __init__(
+        self,
+        doc_ids: np.ndarray,
+        embeddings: np.ndarray,
+        list_ids: np.ndarray,
+        centroids: np.ndarray,
+    ):
+        """
+        doc_ids - doc id of each embedding
+        list_ids - cluster of each embedding
+        centroids - centroid of each cluster
+        """
+        # documents of a cluster are stored next to each other
+        order = np.lexsort((doc_ids, list_ids))
+        self.doc_ids = doc_ids[order]
+        self.embeddings = embeddings[order]
+        self.centroids = centroids
+        self.offsets = np.searchsorted(list_ids[order], np.arange(len(centroids) + 1))
+        self.rows = dict(zip(self.doc_ids.tolist(), range(len(self.doc_ids))))
+
+    @staticmethod
+    def from_database(db: WikiDatabase) -> "AnnIndex":
+        """
+        Loads the embeddings stored by build_ann_index
+        """
+        doc_ids, list_ids, embeddings, centroids = db.get_embeddings()
+        return AnnIndex(doc_ids, embeddings, list_ids, centroids)
+
+    def search_vector(
+        self, vector: np.ndarray, k: int = TOP_K, probes: int = IVF_PROBES
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns top k documents with the embedding most similar to the one given
+        """
+
+        probes = min(probes, len(self.centroids))
+        if probes == 0:
+            return []
+
+        nearest = np.argpartition(-(self.centroids @ vector), probes - 1)[:probes]
+        rows = np.concatenate(
+            [np.arange(self.offsets[x], self.offsets[x + 1]) for x in nearest]
+        )
+        scores = self.embeddings[rows] @ vector
+        return top_k(scores.astype(np.float64), self.doc_ids[rows], k)
+
+    def similar(
+        self, doc_id: int, k: int = TOP_K, probes: int = IVF_PROBES
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns top k documents similar to the document given
+        """
+
+        row = self.rows.get(doc_id)
+        if row is None:
+            return []
+        return self.search_vector(self.embeddings[row], k, probes)
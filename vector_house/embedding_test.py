@@ -0,0 +1,52 @@
+import numpy as np
+from vector_house.database import WikiDatabase
+from vector_house.database_test import run_with_db
+from vector_house.query_eval_test import fill_db
+from vector_house.embedding import build_ann_index, cluster, AnnIndex
+
+
+def test_cluster() -> None:
+    """Tests each embedding is assigned to the nearest centroid"""
+
+    rng = np.random.default_rng(1)
+    embeddings = rng.normal(size=(50, 4)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    centroids, assignment = cluster(embeddings, 5)
+    assert centroids.shape == (5, 4)
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1)
+    assert list(assignment) == list(np.argmax(embeddings @ centroids.T, axis=1))
+
+
+@run_with_db
+def test_ann_index(db: WikiDatabase) -> None:
+    """Tests searching all the clusters is the same as the exhaustive search"""
+
+    assert not db.has_embeddings()
+    build_ann_index(db, dim=8, lists=6)
+    assert not db.has_embeddings()
+
+    fill_db(db)
+    generation = db.get_generation()
+    build_ann_index(db, dim=8, lists=6)
+    assert db.has_embeddings()
+    # results cached for the old embeddings are dropped
+    assert db.get_generation() != generation
+
+    ann = AnnIndex.from_database(db)
+    assert ann.embeddings.shape == (200, 8)
+    assert ann.centroids.shape == (6, 8)
+    assert list(ann.offsets) == sorted(ann.offsets)
+
+    for doc_id in [1, 42, 200]:
+        pages = ann.similar(doc_id, k=5, probes=6)
+        assert pages[0][1] == doc_id
+
+        row = ann.rows[doc_id]
+        scores = ann.embeddings @ ann.embeddings[row]
+        expected = ann.doc_ids[np.argsort(-scores, kind="stable")[:5]]
+        assert sorted(x[1] for x in pages) == sorted(expected)
+
+        assert len(ann.similar(doc_id, k=5, probes=1)) <= 5
+
+    assert ann.similar(4242) == []
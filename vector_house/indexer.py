@@ -1,24 +1,57 @@
-from vector_house.database import WikiDatabase
+from vector_house.database import (
+    WikiDatabase,
+    BulkLoader,
+    BULK_BATCH_SIZE,
+    POSTING_FLOAT16,
+    META_POSTING_ENCODING,
+)
+from vector_house.matrix_engine import MatrixEngine, SIM_BLOCK_SIZE
+from vector_house.search_engine import top_k
+from vector_house.profiling import StageTimer, timed_iter
+from vector_house.defaults import INDEX_SIZE, MEMORY_BUDGET, REFRESH_DRIFT
+import vector_house.metrics as metrics
 import glob
-import nltk
 import math
-import mwxml
 import string
+import multiprocessing
 from collections import defaultdict
+from functools import partial, lru_cache
 import itertools
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import stopwords
-from wiki_dump_reader import Cleaner
-from typing import List, Tuple
+import numpy as np
+from typing import List, Tuple, Iterator
 
-nltk.download("punkt")
-nltk.download("wordnet")
-nltk.download("stopwords")
-
-# Max number of Wiki pages to index
-INDEX_SIZE = 1000  # 8192
 WORD_LIMIT = 42069
+# Number of pages sent to each worker process at once
+PAGES_PER_WORKER = 16
+# Number of distinct tokens the lemmatizer remembers
+LEMMA_CACHE_SIZE = 65536
+EXTRA_STOP_WORDS = {"like", "&ndash;"}
+META_TOP_DOCS = "top_docs"
+META_LIMIT = "limit"
+# Number of documents the weights of all the terms were counted for
+META_WEIGHTS_DOCS = "weights_docs"
+# Tables and indexes kept by an appendable index
+FREQUENCY_TABLES = ["frequency", "term_stats", "frequency_term_id", "frequency_doc_id"]
+# NLTK resources used by the analyzer and packages they are downloaded in
+NLTK_DATA = {
+    "tokenizers/punkt": "punkt",
+    "corpora/wordnet": "wordnet",
+    "corpora/stopwords": "stopwords",
+}
 XML_LOCATION = "wiki-data/*wiki-*-pages-articles-multistream.xml"
+# Stages of an index build timed by StageTimer, in the order they run
+# workers - waiting for the pages cleaned and lemmatized by worker processes
+INDEX_STAGES = [
+    "parse",
+    "remove_wiki_shit",
+    "lemmatize_text",
+    "workers",
+    "documents_to_db",
+    "update_abs_freq",
+    "count_relative_freq",
+    "weights_to_db",
+    "finish",
+]
 
 
 def get_file_name() -> str:
@@ -35,55 +68,193 @@ def get_file_name() -> str:
     return file_name
 
 
-cleaner = Cleaner()
+cleaner = None
+
+
+def get_cleaner():
+    """Returns the wiki text cleaner shared by the whole process"""
+
+    global cleaner
+    if cleaner is None:
+        from wiki_dump_reader import Cleaner
+
+        cleaner = Cleaner()
+
+    return cleaner
 
 
 def remove_wiki_shit(text) -> str:
     """Remove wiki formatting from the text"""
 
+    cleaner = get_cleaner()
     text = cleaner.clean_text(text)
     text, links = cleaner.build_links(text)
 
     return text
 
 
+def ensure_nltk_data() -> None:
+    """Downloads the NLTK resources the analyzer uses, unless they are found locally"""
+
+    import nltk
+
+    for resource, package in NLTK_DATA.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            nltk.download(package)
+
+
+class TextAnalyzer:
+    """
+    Lemmatizes texts, removes stop words and counts frequencies.
+    The lemmatizer, stop words and punctuation table are created once
+    and lemmas of the recently seen tokens are remembered.
+    """
+
+    def __init__(self, cache_size: int = LEMMA_CACHE_SIZE):
+        ensure_nltk_data()
+        from nltk import word_tokenize
+        from nltk.stem import WordNetLemmatizer
+        from nltk.corpus import stopwords
+
+        self.tokenize = word_tokenize
+        self.punctuation = str.maketrans("", "", string.punctuation)
+        self.stop_words = set(stopwords.words("english"))
+        self.stop_words.update(EXTRA_STOP_WORDS)
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemmatize = lru_cache(maxsize=cache_size)(self.lemmatizer.lemmatize)
+
+    def count_frequencies(self, text: str, limit: int = 0) -> dict:
+        """Lemmatize the text, remove stop words and count frequencies."""
+
+        if limit == 0:
+            limit = WORD_LIMIT
+
+        text_no_punct = text.translate(self.punctuation)  # remove punctuation
+        tokens = self.tokenize(text_no_punct)
+
+        freq_dict = defaultdict(int)
+        for token in itertools.islice(tokens, limit):
+            word = token.lower()
+            if word not in self.stop_words:
+                word = self.lemmatize(word)
+                freq_dict[word] += 1
+
+        return freq_dict
+
+
+analyzer: TextAnalyzer | None = None
+
+
+def get_analyzer() -> TextAnalyzer:
+    """Returns the analyzer shared by the whole process"""
+
+    global analyzer
+    if analyzer is None:
+        analyzer = TextAnalyzer()
+
+    return analyzer
+
+
 def lemmatize_text(text: str, limit: int = 0) -> dict:
     """Lemmatize the text, remove stop words and count frequencies."""
 
-    if limit == 0:
-        limit = WORD_LIMIT
+    return get_analyzer().count_frequencies(text, limit)
+
+
+def read_pages(file_name: str) -> Iterator[Tuple[int, str, str]]:
+    """Yields id, title and raw text of the wikitext pages in the dump"""
+
+    import mwxml
+
+    dump = mwxml.Dump.from_file(open(file_name, encoding="utf8"))
+    print(dump.site_info.name, dump.site_info.dbname)
+
+    for page in dump:
+        revision = next(x for x in page)
+        if revision.model != "wikitext":
+            continue
 
-    text_no_punct = text.translate(
-        str.maketrans("", "", string.punctuation)
-    )  # remove punctuation
-    tokens = nltk.word_tokenize(text_no_punct)
-    lemmatizer = WordNetLemmatizer()
+        yield page.id, page.title, revision.text
 
-    stop_words = set(stopwords.words("english"))
-    extra_stop_words = {"like", "&ndash;"}
-    stop_words.update(extra_stop_words)
 
-    freq_dict = defaultdict(int)
-    for token in itertools.islice(tokens, limit):
-        word = token.lower()
-        if word not in stop_words:
-            word = lemmatizer.lemmatize(word)
-            freq_dict[word] += 1
+def analyze_page(
+    page: Tuple[int, str, str], limit: int = 0, timer: StageTimer | None = None
+) -> Tuple[int, str, str, dict] | None:
+    """
+    Cleans the page text and counts it's term frequencies
+    Returns id, title, clean text and frequencies, None for redirects
+    """
 
-    return freq_dict
+    timer = timer or StageTimer()
+    page_id, page_title, text = page
+    with timer.stage("remove_wiki_shit"):
+        text = remove_wiki_shit(text)
+    if text.startswith("REDIRECT"):
+        return None
+
+    with timer.stage("lemmatize_text"):
+        freq_dict = dict(lemmatize_text(text, limit))
+    return page_id, page_title, text, freq_dict
+
+
+def analyze_pages(
+    pages: Iterator[Tuple[int, str, str]],
+    limit: int = 0,
+    workers: int = 1,
+    timer: StageTimer | None = None,
+) -> Iterator[Tuple[int, str, str, dict]]:
+    """
+    Analyzes the pages given, redirects are left out
+    With more workers the pages are processed by a process pool,
+    the results are still yielded in the order of the pages given
+    timer - times reading, cleaning and lemmatizing of the pages,
+            with more workers only the time waiting for them is known
+    """
+
+    timer = timer or StageTimer()
+    pages = timed_iter(pages, timer, "parse")
+    analyze = partial(analyze_page, limit=limit)
+
+    if workers <= 1:
+        for page in pages:
+            analyzed = analyze(page, timer=timer)
+            if analyzed is not None:
+                yield analyzed
+        return
+
+    chunk_size = workers * PAGES_PER_WORKER
+    with multiprocessing.Pool(workers) as pool:
+        # the next chunk is processed while the current one is consumed
+        chunk = list(itertools.islice(pages, chunk_size))
+        pending = pool.map_async(analyze, chunk, PAGES_PER_WORKER)
+        while pending is not None:
+            chunk = list(itertools.islice(pages, chunk_size))
+            upcoming = None
+            if len(chunk) != 0:
+                upcoming = pool.map_async(analyze, chunk, PAGES_PER_WORKER)
+
+            with timer.stage("workers"):
+                results = pending.get()
+            for analyzed in results:
+                if analyzed is not None:
+                    yield analyzed
+
+            pending = upcoming
 
 
 def update_abs_freq(
-    freq_dict: dict, terms: set, doc_id: int, abs_dict: dict, wiki_db: WikiDatabase
+    freq_dict: dict,
+    terms: set,
+    doc_id: int,
+    abs_dict: dict,
+    wiki_db: WikiDatabase | BulkLoader,
 ) -> None:
     """Updates dictionary with absolute frequencies and adds terms to the database."""
 
     for term, value in freq_dict.items():
-        term_id = 0
-        if wiki_db.has_term(term):
-            term_id = wiki_db.get_term_id(term)
-        else:
-            term_id = wiki_db.insert_term(term)
+        term_id = wiki_db.get_or_insert_term(term)
 
         terms.add(term_id)
         abs_dict.setdefault(term_id, {})[doc_id] = value
@@ -114,11 +285,11 @@ def count_weight(num_of_docs: int, tf_ij: int, df_i: int) -> float:
 
 
 def weights_to_db(
-    wiki_db: WikiDatabase,
+    wiki_db: WikiDatabase | BulkLoader,
     relative_freq: dict,
     terms: set,
     num_of_docs: int,
-    top_docs: int,
+    top_docs: int = 0,
 ) -> None:
     for term_id in terms:
         if term_id not in relative_freq:
@@ -145,56 +316,421 @@ def weights_to_db(
             wiki_db.insert_value(term_id, doc_id, weight)
 
 
-def recreate_index(
-    index_size: int, limit: int, top_docs: int, wiki_db: WikiDatabase = WikiDatabase()
+def stage_frequencies(freq_dict: dict, doc_id: int, loader: BulkLoader) -> None:
+    """Writes absolute frequencies of the document to the database."""
+
+    for term, value in freq_dict.items():
+        term_id = loader.get_or_insert_term(term)
+        loader.insert_frequency(term_id, doc_id, value)
+
+
+def frequencies_to_db(
+    wiki_db: WikiDatabase, num_of_docs: int, top_docs: int = 0, only_dirty: bool = False
 ) -> None:
-    """Reads wiki dump and processes it"""
+    """Counts weights from the stored frequencies, the same way as weights_to_db."""
 
-    if limit != 0:
-        print(f"Using token limit: {limit}")
+    def weight(freq: int, max_freq: int, df: int) -> float:
+        tf_ij = round(freq / max_freq, 2)
+        return count_weight(num_of_docs, tf_ij, df)
 
-    if top_docs != 0:
-        print(f"Using top docs: {top_docs}")
+    wiki_db.weights_from_frequencies(weight, top_docs, only_dirty)
 
-    if index_size == 0:
-        index_size = INDEX_SIZE
 
-    file_name = get_file_name()
-    print(f"Using {file_name}")
-    dump = mwxml.Dump.from_file(open(file_name, encoding="utf8"))
-    print(dump.site_info.name, dump.site_info.dbname)
+def build_index(
+    analyzed_pages: Iterator[Tuple[int, str, str, dict]],
+    index_size: int,
+    top_docs: int,
+    wiki_db: WikiDatabase,
+    batch_size: int = BULK_BATCH_SIZE,
+    external: bool = False,
+    memory_budget: int = MEMORY_BUDGET,
+    clustered: bool = False,
+    timer: StageTimer | None = None,
+    limit: int = 0,
+    appendable: bool = False,
+) -> int:
+    """
+    Creates a new index from the pages given
+    In the external mode frequencies are not kept in memory,
+    but the weights are counted in the database,
+    memory_budget in MiB then bounds the buffers and the DB cache
+    clustered - store values ordered by term, see create_database
+    timer - times the stages of the build, see INDEX_STAGES
+    limit - the token limit the pages were analyzed with, append uses it again
+    appendable - keep the frequencies of the terms, so pages can be appended
+    Returns the number of documents indexed
+    """
+
+    timer = timer or StageTimer()
+    staged = external or appendable
 
     wiki_db.drop_if_exists()
-    wiki_db.create_if_needed()
+    wiki_db.create_if_needed(clustered)
+    if staged:
+        wiki_db.create_frequency_table()
+
+    if external:
+        print(f"Using external build with memory budget: {memory_budget} MiB")
+        # half for the buffers, half for the DB page cache
+        budget = memory_budget * 1024 * 1024 // 2
+        wiki_db.limit_cache(budget)
+        loader = wiki_db.bulk_loader(batch_size, budget)
+    else:
+        loader = wiki_db.bulk_loader(batch_size)
 
     terms = set()  # ids of all terms
     absolute_freq = {}
     pages_counter = 0
 
-    for page in dump:
-        page_id = page.id
-        page_title = page.title
-        revision = next(x for x in page)
-        if revision.model != "wikitext":
-            continue
-
-        text = revision.text
-        text = remove_wiki_shit(text)
-        if text.startswith("REDIRECT"):
-            continue
-
+    for page_id, page_title, text, freq_dict in analyzed_pages:
         print(f"{pages_counter:5} - {page_id:5}: {page_title}")
-        doc_id = wiki_db.insert_document(page_title, text)
-        freq_dict = lemmatize_text(text, limit)
-        update_abs_freq(freq_dict, terms, doc_id, absolute_freq, wiki_db)
+        with timer.stage("documents_to_db"):
+            doc_id = loader.insert_document(page_title, text)
+            if staged:
+                stage_frequencies(freq_dict, doc_id, loader)
+        if not external:
+            with timer.stage("update_abs_freq"):
+                update_abs_freq(freq_dict, terms, doc_id, absolute_freq, loader)
 
         pages_counter += 1
         if pages_counter >= index_size:
             break
 
-    relative_freq = count_relative_freq(absolute_freq, terms)
-    weights_to_db(wiki_db, relative_freq, terms, pages_counter, top_docs)
+    if external:
+        with timer.stage("documents_to_db"):
+            loader.flush()
+        with timer.stage("weights_to_db"):
+            frequencies_to_db(wiki_db, pages_counter, top_docs)
+    else:
+        with timer.stage("count_relative_freq"):
+            relative_freq = count_relative_freq(absolute_freq, terms)
+        with timer.stage("weights_to_db"):
+            weights_to_db(loader, relative_freq, terms, pages_counter, top_docs)
+            loader.flush()
+            if appendable:
+                wiki_db.update_term_stats()
+
+    with timer.stage("finish"):
+        if appendable:
+            wiki_db.index_frequencies()
+        elif staged:
+            wiki_db.drop_frequency_tables()
+        wiki_db.update_doc_norms()
+        wiki_db.update_term_bounds()
+        wiki_db.set_meta(META_TOP_DOCS, top_docs)
+        wiki_db.set_meta(META_LIMIT, limit)
+        wiki_db.set_meta(META_WEIGHTS_DOCS, pages_counter)
+        wiki_db.bump_generation()
+        wiki_db.commit()
+
+    if appendable:
+        sizes = wiki_db.get_table_sizes()
+        size = sum(sizes.get(x, 0) for x in FREQUENCY_TABLES)
+        print(f"Frequencies kept for --append: {size / 1024 / 1024:.1f} MiB")
+
+    metrics.inc("index_pages_total", pages_counter)
+    for stage, seconds in timer.times.items():
+        metrics.inc(f"index_{stage}_seconds_total", seconds)
+    return pages_counter
+
+
+def append_index(
+    analyzed_pages: Iterator[Tuple[int, str, str, dict]],
+    index_size: int,
+    wiki_db: WikiDatabase,
+    batch_size: int = BULK_BATCH_SIZE,
+    refresh_drift: float = REFRESH_DRIFT,
+) -> Tuple[int, int]:
+    """
+    Adds new and changed pages to an existing index
+    Only weights of the terms affected are counted again, IDF of the other
+    terms drifts as the number of documents changes. Once it changes by more
+    than refresh_drift since all the weights were counted, see refresh_index,
+    all of them are counted again.
+    Returns the number of documents added and changed
+    """
+
+    top_docs = int(wiki_db.get_meta(META_TOP_DOCS, "0"))
+    titles = wiki_db.get_all_titles()
+    counted_docs = int(wiki_db.get_meta(META_WEIGHTS_DOCS, "0")) or len(titles)
+    loader = wiki_db.bulk_loader(batch_size)
+
+    dirty_terms = set()
+    added_ids = set()  # documents still buffered by the loader
+    added, changed = 0, 0
+    pages_counter = 0
+
+    for page_id, page_title, text, freq_dict in analyzed_pages:
+        if pages_counter >= index_size:
+            break
+        pages_counter += 1
+
+        doc_id = titles.get(page_title)
+        if doc_id is None:
+            print(f"{pages_counter:5} - {page_id:5}: {page_title} (new)")
+            doc_id = loader.insert_document(page_title, text)
+            titles[page_title] = doc_id
+            added_ids.add(doc_id)
+            added += 1
+        else:
+            if doc_id in added_ids:
+                # the page is repeated by the dump, it's first version is buffered
+                loader.flush()
+                added_ids.clear()
+            _, old_text = wiki_db.get_doc_by_id(doc_id)
+            if old_text == text:
+                continue
+
+            print(f"{pages_counter:5} - {page_id:5}: {page_title} (changed)")
+            dirty_terms.update(wiki_db.get_terms_of_doc_frequencies(doc_id))
+            wiki_db.delete_doc_postings(doc_id)
+            wiki_db.update_document(doc_id, text)
+            changed += 1
+
+        for term, value in freq_dict.items():
+            term_id = loader.get_or_insert_term(term)
+            loader.insert_frequency(term_id, doc_id, value)
+            dirty_terms.add(term_id)
+
+    loader.flush()
+    num_of_docs = wiki_db.get_stats()[1]
+    if abs(num_of_docs - counted_docs) > refresh_drift * counted_docs:
+        print(f"Documents changed from {counted_docs} to {num_of_docs} since")
+        print("weights of all the terms were counted, counting them again")
+        refresh_index(wiki_db)
+        return added, changed
+
+    wiki_db.mark_terms_dirty(list(dirty_terms))
+    print(f"Counting weights of {wiki_db.count_dirty_terms()} terms")
+
+    frequencies_to_db(wiki_db, num_of_docs, top_docs, only_dirty=True)
+    wiki_db.update_doc_norms(only_dirty=True)
+    if wiki_db.has_postings():
+        encoding = wiki_db.get_meta(META_POSTING_ENCODING, POSTING_FLOAT16)
+        wiki_db.build_postings(encoding, list(dirty_terms))
+    # norms of documents changed, so bounds of all their terms could change
+    wiki_db.update_term_bounds()
+    wiki_db.clear_dirty_terms()
+    wiki_db.bump_generation()
     wiki_db.commit()
 
+    return added, changed
+
+
+def drop_outdated(wiki_db: WikiDatabase, similar: bool = True) -> None:
+    """
+    Drops the data counted from the weights before they were changed
+    similar - drop also the precomputed similar documents
+    """
+
+    if similar and wiki_db.has_similar():
+        # any document could get new similar documents, counting them again
+        # would take as long as for a new index, so they are dropped
+        print("Dropping the outdated similar documents, use --precompute-sim")
+        wiki_db.drop_similar_table()
+        wiki_db.bump_generation()
+        wiki_db.commit()
+    if wiki_db.has_embeddings():
+        # new documents have no embeddings, the ann engine would miss them
+        print("Dropping the outdated embeddings, run embed again")
+        wiki_db.drop_embedding_tables()
+        wiki_db.bump_generation()
+        wiki_db.commit()
+
+
+def refresh_index(wiki_db: WikiDatabase) -> None:
+    """
+    Counts weights of all the terms of an appendable index again,
+    with norms, bounds and posting lists, the same as a new build would
+    """
+
+    num_of_docs = wiki_db.get_stats()[1]
+    top_docs = int(wiki_db.get_meta(META_TOP_DOCS, "0"))
+    print(f"Counting weights of all the terms in {num_of_docs} documents")
+
+    frequencies_to_db(wiki_db, num_of_docs, top_docs)
+    wiki_db.update_doc_norms()
+    if wiki_db.has_postings():
+        encoding = wiki_db.get_meta(META_POSTING_ENCODING, POSTING_FLOAT16)
+        wiki_db.build_postings(encoding)
+    wiki_db.update_term_bounds()
+    wiki_db.clear_dirty_terms()
+    wiki_db.set_meta(META_WEIGHTS_DOCS, num_of_docs)
+    wiki_db.bump_generation()
+    wiki_db.commit()
+
+
+def external_similar(
+    wiki_db: WikiDatabase, k: int, memory_budget: int
+) -> Iterator[Tuple[int, List[Tuple[float, int]]]]:
+    """
+    Yields top k similar documents of each document, as all_similar does,
+    without loading the whole index. Similarities of a block of documents
+    to all the documents are summed term by term from the posting lists,
+    the block is as big as fits the memory budget in MiB.
+    """
+
+    doc_ids = wiki_db.get_all_doc_ids()
+    if len(doc_ids) == 0:
+        return
+    norms = wiki_db.get_doc_norms(doc_ids.tolist())
+    if len(norms) < len(doc_ids):
+        wiki_db.update_doc_norms()
+        norms = wiki_db.get_doc_norms(doc_ids.tolist())
+    norms = np.array([norms.get(x, 0.0) for x in doc_ids.tolist()])
+    with np.errstate(divide="ignore"):
+        inv_norms = np.where(norms > 0, 1 / norms, 0.0)
+
+    block_size = memory_budget * 1024 * 1024 // (8 * len(doc_ids))
+    block_size = max(1, min(SIM_BLOCK_SIZE, block_size))
+
+    for start in range(0, len(doc_ids), block_size):
+        block = doc_ids[start : start + block_size].tolist()
+        block_terms = defaultdict(list)
+        for row, doc_id in enumerate(block):
+            for term, value in wiki_db.get_terms_for_doc(doc_id).items():
+                block_terms[term].append((row, float(value)))
+
+        sims = np.zeros((len(block), len(doc_ids)))
+        for term, entries in block_terms.items():
+            posting = wiki_db.read_postings([term]).get(term)
+            if posting is None:
+                continue
+            cols = np.searchsorted(doc_ids, posting[0])
+            rows = np.array([x[0] for x in entries])
+            values = np.array([x[1] for x in entries])
+            sims[np.ix_(rows, cols)] += np.outer(values, posting[1])
+
+        sims *= inv_norms[start : start + len(block), None] * inv_norms[None, :]
+        for row, doc_id in enumerate(block):
+            found = np.flatnonzero(sims[row])
+            yield doc_id, top_k(sims[row, found], doc_ids[found], k)
+
+
+def precompute_similar(
+    wiki_db: WikiDatabase,
+    k: int,
+    block_size: int = SIM_BLOCK_SIZE,
+    memory_budget: int = 0,
+) -> None:
+    """
+    Stores top k similar documents of each document
+    The whole index is loaded into a sparse matrix for that,
+    unless a memory budget in MiB is given, see external_similar
+    """
+
+    print(f"Precomputing {k} similar documents")
+    if memory_budget > 0:
+        all_similar = external_similar(wiki_db, k, memory_budget)
+    else:
+        engine = MatrixEngine.from_database(wiki_db)
+        all_similar = engine.all_similar(k, block_size)
+    wiki_db.create_similar_table(k)
+
+    rows = []
+    for doc_id, pages in all_similar:
+        rows.extend((doc_id, rank, x[1], x[0]) for rank, x in enumerate(pages))
+
+        if len(rows) >= BULK_BATCH_SIZE:
+            wiki_db.insert_similar(rows)
+            rows = []
+    wiki_db.insert_similar(rows)
+    wiki_db.commit()
+
+
+def recreate_index(
+    index_size: int,
+    limit: int,
+    top_docs: int,
+    wiki_db: WikiDatabase | None = None,
+    batch_size: int = BULK_BATCH_SIZE,
+    workers: int = 1,
+    external: bool = False,
+    memory_budget: int = MEMORY_BUDGET,
+    append: bool = False,
+    precompute_sim: int = 0,
+    clustered: bool = False,
+    timer: StageTimer | None = None,
+    file_name: str | None = None,
+    pages: Iterator[Tuple[int, str, str]] | None = None,
+    appendable: bool = False,
+    refresh_drift: float = REFRESH_DRIFT,
+) -> None:
+    """
+    Reads wiki dump and processes it
+    In the append mode the existing index is updated instead,
+    using the limit and top_docs it was created with
+    precompute_sim - store this many similar documents of each document
+    timer - times the stages of a new index build, see INDEX_STAGES
+    file_name - the dump to read, the first one found in wiki-data by default
+    pages - id, title and text of the pages to index instead of the dump
+    appendable - keep the frequencies needed by a later append
+    refresh_drift - see append_index
+    """
+
+    if wiki_db is None:
+        wiki_db = WikiDatabase()
+
+    # pages served from the index keep working while it's appended to,
+    # a new index drops the tables though, so the pages fail until it's built
+    wiki_db.enable_wal()
+
+    if append:
+        if not wiki_db.has_frequencies():
+            print("The index is not appendable, create it again with --appendable")
+            return
+        # the same limit and top docs have to be used as when it was created
+        stored_limit = int(wiki_db.get_meta(META_LIMIT, "0"))
+        stored_top_docs = int(wiki_db.get_meta(META_TOP_DOCS, "0"))
+        if (limit, top_docs) not in [(0, 0), (stored_limit, stored_top_docs)]:
+            print("Ignoring the limit and top docs given, the index ones are used")
+        limit, top_docs = stored_limit, stored_top_docs
+
+    if limit != 0:
+        print(f"Using token limit: {limit}")
+
+    if top_docs != 0:
+        print(f"Using top docs: {top_docs}")
+
+    if workers > 1:
+        print(f"Using workers: {workers}")
+
+    if index_size == 0:
+        index_size = INDEX_SIZE
+
+    if pages is None:
+        if file_name is None:
+            file_name = get_file_name()
+        print(f"Using {file_name}")
+        pages = read_pages(file_name)
+
+    analyzed_pages = analyze_pages(pages, limit, workers, timer)
+    if append:
+        added, changed = append_index(
+            analyzed_pages, index_size, wiki_db, batch_size, refresh_drift
+        )
+        print(f"Added {added} and changed {changed} documents")
+    else:
+        build_index(
+            analyzed_pages,
+            index_size,
+            top_docs,
+            wiki_db,
+            batch_size,
+            external,
+            memory_budget,
+            clustered,
+            timer,
+            limit,
+            appendable,
+        )
+    analyzed_pages.close()  # stops the workers
+
+    if append:
+        drop_outdated(wiki_db, similar=precompute_sim == 0)
+    if precompute_sim > 0:
+        budget = memory_budget if external else 0
+        precompute_similar(wiki_db, precompute_sim, memory_budget=budget)
+
     wiki_db.create_index()
-    wiki_db.print_stats()
\ No newline at end of file
+    wiki_db.print_stats()
@@ -0,0 +1,239 @@
+from typing import List, Tuple, Iterator, Callable
+import numpy as np
+from scipy.sparse import csr_matrix, diags, vstack
+
+from vector_house.database import WikiDatabase
+from vector_house.mmap_index import MmapIndex
+from vector_house.search_engine import top_k, TOP_K
+from vector_house.profiling import StageTimer, timed_stage
+import vector_house.metrics as metrics
+
+# Number of documents compared to all the others at once
+SIM_BLOCK_SIZE = 256
+
+
+class MatrixEngine:
+    """
+    Search backend holding the whole value table in memory
+    as a sparse document x term matrix.
+    A query is then a single sparse matrix - vector product.
+    """
+
+    def __init__(
+        self,
+        matrix: csr_matrix,
+        doc_ids: np.ndarray,
+        term_col: Callable[[str], int | None],
+        norms: np.ndarray = None,
+    ):
+        """
+        matrix - rows are documents, columns are terms
+        doc_ids - doc id of each matrix row, ascending
+        term_col - finds matrix column of the term name, None if it's unknown
+        norms - norm of each document, counted from the matrix if not given
+        """
+        self.matrix = matrix
+        self.doc_ids = doc_ids
+        self.term_col = term_col
+        if norms is None:
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        self.norms = norms
+
+    @staticmethod
+    def from_database(db: WikiDatabase) -> "MatrixEngine":
+        """
+        Loads the whole value table of the database given
+        """
+
+        term_names = db.get_all_terms()
+        term_ids = np.array(sorted(term_names.values()), dtype=np.int64)
+        doc_ids = db.get_all_doc_ids()
+        value_doc_ids, value_term_ids, values = db.get_all_values()
+
+        rows = np.searchsorted(doc_ids, value_doc_ids)
+        cols = np.searchsorted(term_ids, value_term_ids)
+        matrix = csr_matrix((values, (rows, cols)), shape=(len(doc_ids), len(term_ids)))
+        term_cols = {
+            name: int(np.searchsorted(term_ids, term_id))
+            for name, term_id in term_names.items()
+        }
+
+        return MatrixEngine(matrix, doc_ids, term_cols.get)
+
+    @staticmethod
+    def from_mmap(index: MmapIndex) -> "MatrixEngine":
+        """
+        Creates the matrix from an exported index, the arrays are not copied
+        Terms are looked up in the sorted names of the index by each query,
+        so no names are read when the engine is created
+        """
+
+        terms, documents, _ = index.get_stats()
+        matrix = csr_matrix(
+            (index.doc_data, index.doc_cols, index.doc_ptr),
+            shape=(documents, terms),
+            copy=False,
+        )
+        return MatrixEngine(matrix, index.doc_ids, index.get_term_col, index.norms)
+
+    def get_shape(self) -> Tuple[int, int]:
+        """
+        Returns the number of documents and terms loaded
+        """
+        return self.matrix.shape
+
+    def query_vector(self, terms: List[str], wanted: np.array = None) -> np.ndarray:
+        """
+        Creates a dense query vector over all the terms.
+        Unknown terms are ignored, each term has weight 1 if wanted is not given.
+        """
+
+        vector = np.zeros(self.matrix.shape[1])
+        for i, term in enumerate(terms):
+            col = self.term_col(term)
+            if col is None:
+                continue
+
+            vector[col] += 1 if wanted is None else wanted[i]
+
+        return vector
+
+    def count_cos_sims(self, vector: np.ndarray) -> np.ndarray:
+        """
+        Counts cosine similarity of the vector given to all the documents
+        Documents not sharing any term with the vector get 0
+        """
+
+        dots = self.matrix @ vector
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return np.zeros(len(self.doc_ids))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sims = dots / (self.norms * norm)
+
+        return np.nan_to_num(sims, nan=0.0, posinf=0.0, neginf=0.0)
+
+    @metrics.timed("matrix_search")
+    def search_vector(
+        self, vector: np.ndarray, k: int = TOP_K, timer: StageTimer | None = None
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns top k documents most similar to the query vector given
+        timer - counts the time to the scoring and top_k stages
+        """
+
+        with timed_stage(timer, "scoring"):
+            sims = self.count_cos_sims(vector)
+            candidates = np.flatnonzero(sims)
+        with timed_stage(timer, "top_k"):
+            return top_k(sims[candidates], self.doc_ids[candidates], k)
+
+    def search(
+        self,
+        terms: List[str],
+        wanted: np.array = None,
+        k: int = TOP_K,
+        timer: StageTimer | None = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns top k documents for the terms given
+        Works the same way as search_engine.search with find_vectors
+        timer - counts the time to the assembly, scoring and top_k stages
+        """
+
+        with timed_stage(timer, "assembly"):
+            vector = self.query_vector(terms, wanted)
+        return self.search_vector(vector, k, timer)
+
+    def query_row(self, terms: List[str], wanted: np.array = None) -> csr_matrix:
+        """
+        Creates a sparse query vector, a single row matrix over all the terms
+        Unknown terms are ignored, each term has weight 1 if wanted is not given.
+        """
+
+        cols, values = [], []
+        for i, term in enumerate(terms):
+            col = self.term_col(term)
+            if col is not None:
+                cols.append(col)
+                values.append(1 if wanted is None else wanted[i])
+
+        # duplicate columns are summed
+        return csr_matrix(
+            (values, (np.zeros(len(cols), dtype=np.int64), cols)),
+            shape=(1, self.matrix.shape[1]),
+            dtype=np.float64,
+        )
+
+    def doc_row(self, doc_id: int) -> csr_matrix | None:
+        """Gets the weight vector of the document as a single row matrix"""
+
+        row = np.searchsorted(self.doc_ids, doc_id)
+        if row >= len(self.doc_ids) or self.doc_ids[row] != doc_id:
+            return None
+        return self.matrix.getrow(row)
+
+    @metrics.timed("matrix_search_many")
+    def search_many(
+        self, queries: List[csr_matrix], k: int = TOP_K
+    ) -> List[List[Tuple[float, int]]]:
+        """
+        Returns top k documents for each of the query rows given
+        All the queries are scored by a single sparse matrix product
+        """
+
+        if len(queries) == 0:
+            return []
+
+        batch = vstack(queries).tocsr()
+        query_norms = np.sqrt(np.asarray(batch.multiply(batch).sum(axis=1)).ravel())
+        dots = (self.matrix @ batch.T).tocsc()
+        dots.eliminate_zeros()
+
+        results = []
+        for i in range(len(queries)):
+            begin, end = dots.indptr[i], dots.indptr[i + 1]
+            rows = dots.indices[begin:end]
+            norms = self.norms[rows] * query_norms[i]
+            nonzero = norms > 0
+            sims = dots.data[begin:end][nonzero] / norms[nonzero]
+            results.append(top_k(sims, self.doc_ids[rows[nonzero]], k))
+
+        return results
+
+    def similar(self, doc_id: int, k: int = TOP_K) -> List[Tuple[float, int]]:
+        """
+        Returns top k documents similar to the document given
+        """
+
+        row = self.doc_row(doc_id)
+        if row is None:
+            return []
+
+        return self.search_vector(row.toarray().ravel(), k)
+
+    def all_similar(
+        self, k: int = TOP_K, block_size: int = SIM_BLOCK_SIZE
+    ) -> Iterator[Tuple[int, List[Tuple[float, int]]]]:
+        """
+        Yields top k similar documents of each document, as similar does
+        Rows are normalized once, then a block of rows is multiplied
+        by the whole transposed matrix at once, so only the similarities
+        of a single block are held in memory
+        """
+
+        with np.errstate(divide="ignore"):
+            inv_norms = np.where(self.norms > 0, 1 / self.norms, 0.0)
+        normalized = (diags(inv_norms) @ self.matrix).tocsr()
+        transposed = normalized.T.tocsc()
+
+        for start in range(0, len(self.doc_ids), block_size):
+            sims = (normalized[start : start + block_size] @ transposed).tocsr()
+            sims.eliminate_zeros()
+
+            for row in range(sims.shape[0]):
+                begin, end = sims.indptr[row], sims.indptr[row + 1]
+                scores = sims.data[begin:end]
+                doc_ids = self.doc_ids[sims.indices[begin:end]]
+                yield int(self.doc_ids[start + row]), top_k(scores, doc_ids, k)
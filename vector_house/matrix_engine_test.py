@@ -0,0 +1,142 @@
+import numpy as np
+from vector_house.database import WikiDatabase
+from vector_house.database_test import run_with_db
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.indexer import precompute_similar, external_similar
+
+
+def fill_db(db: WikiDatabase) -> None:
+    """Inserts a small index, doc i contains terms t1 .. ti"""
+
+    terms = ["t1", "t2", "t3", "t4"]
+    term_ids = [db.insert_term(x) for x in terms]
+    doc_ids = [db.insert_document(f"d{i + 1}", "body") for i in range(4)]
+
+    for i, doc_id in enumerate(doc_ids):
+        for j in range(i + 1):
+            db.insert_value(term_ids[j], doc_id, (i + 1) * (j + 1) / 10)
+
+    db.commit()
+
+
+@run_with_db
+def test_load(db: WikiDatabase) -> None:
+    """Tests loading the value table"""
+
+    fill_db(db)
+    engine = MatrixEngine.from_database(db)
+
+    assert engine.get_shape() == (4, 4)
+    assert engine.matrix.nnz == 10
+    assert round(engine.norms[0], 2) == 0.1
+    assert round(engine.norms[1], 2) == round(np.linalg.norm([0.2, 0.4]), 2)
+
+
+@run_with_db
+def test_search(db: WikiDatabase) -> None:
+    """Tests the whole document norm is used"""
+
+    fill_db(db)
+    engine = MatrixEngine.from_database(db)
+
+    pages = engine.search(["t1"])
+    assert [x[1] for x in pages] == [1, 2, 3, 4]
+    assert round(pages[0][0], 2) == 1.0
+    assert round(pages[1][0], 2) == round(0.2 / np.linalg.norm([0.2, 0.4]), 2)
+
+    pages = engine.search(["t4", "unknown"])
+    assert [x[1] for x in pages] == [4]
+
+    assert engine.search(["unknown"]) == []
+    assert len(engine.search(["t1"], k=2)) == 2
+
+
+@run_with_db
+def test_similar(db: WikiDatabase) -> None:
+    """Tests similar documents, the document itself is the most similar"""
+
+    fill_db(db)
+    engine = MatrixEngine.from_database(db)
+
+    pages = engine.similar(3)
+    assert [x[1] for x in pages] == [3, 4, 2, 1]
+    assert round(pages[0][0], 2) == 1.0
+
+    terms = ["t1", "t2", "t3"]
+    wanted = np.array([0.3, 0.6, 0.9])
+    assert engine.search(terms, wanted) == pages
+
+    assert engine.similar(42) == []
+
+
+@run_with_db
+def test_all_similar(db: WikiDatabase) -> None:
+    """Tests similar documents of all the documents counted in blocks"""
+
+    fill_db(db)
+    engine = MatrixEngine.from_database(db)
+
+    all_similar = list(engine.all_similar(k=3, block_size=3))
+    assert [x[0] for x in all_similar] == [1, 2, 3, 4]
+    for doc_id, pages in all_similar:
+        assert [x[1] for x in pages] == [x[1] for x in engine.similar(doc_id, k=3)]
+        assert np.allclose(
+            [x[0] for x in pages], [x[0] for x in engine.similar(doc_id, k=3)]
+        )
+
+
+@run_with_db
+def test_precompute_similar(db: WikiDatabase) -> None:
+    """Tests the similar documents lookup"""
+
+    fill_db(db)
+    assert not db.has_similar()
+    assert db.get_similar(3, 2) is None
+
+    precompute_similar(db, 3)
+    assert db.has_similar()
+    assert [x[1] for x in db.get_similar(3, 3)] == [3, 4, 2]
+    assert [x[1] for x in db.get_similar(3, 2)] == [3, 4]
+    assert db.get_similar(3, 4) is None
+    assert db.get_similar(42, 3) == []
+
+    # counted from the posting lists, a document at a time fits the budget
+    expected = list(MatrixEngine.from_database(db).all_similar(k=3))
+    for budget in [1, 0]:
+        block = list(external_similar(db, 3, budget))
+        assert [x[0] for x in block] == [x[0] for x in expected]
+        for (_, pages), (_, other) in zip(block, expected):
+            assert [x[1] for x in pages] == [x[1] for x in other]
+            assert np.allclose([x[0] for x in pages], [x[0] for x in other])
+
+    db.drop_similar_table()
+    assert not db.has_similar()
+
+
+@run_with_db
+def test_search_many(db: WikiDatabase) -> None:
+    """Tests a batch of queries returns the same as the single queries"""
+
+    fill_db(db)
+    engine = MatrixEngine.from_database(db)
+
+    queries = [
+        (["t1"], None),
+        (["t4", "unknown"], None),
+        (["unknown"], None),
+        (["t1", "t2", "t2"], np.array([0.5, 1, 2])),
+    ]
+    rows = [engine.query_row(terms, wanted) for terms, wanted in queries]
+    rows.append(engine.doc_row(3))
+
+    results = engine.search_many(rows, k=3)
+    expected = [engine.search(terms, wanted, k=3) for terms, wanted in queries]
+    expected.append(engine.similar(3, k=3))
+
+    assert len(results) == len(expected)
+    for pages, expected_pages in zip(results, expected):
+        assert [x[1] for x in pages] == [x[1] for x in expected_pages]
+        assert np.allclose([x[0] for x in pages], [x[0] for x in expected_pages])
+
+    assert engine.doc_row(42) is None
+    assert engine.search_many([]) == []
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Dict, List, Callable, Iterator, ContextManager
+
+# Metrics are collected only once enabled, also by this environment variable
+ENV_ENABLE = "VECTOR_HOUSE_METRICS"
+# Where the CLI adds the metrics collected by each command
+METRICS_FILE = "vector-house-metrics.json"
+PREFIX = "vector_house_"
+# Upper bounds of the buckets of timed operations, in seconds
+TIME_BUCKETS = [
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+]
+
+# Checked by every hook, so disabled metrics cost a single test
+enabled = os.environ.get(ENV_ENABLE, "") not in ["", "0"]
+
+
+class Histogram:
+    """Counts of the observed values in cumulative buckets, as Prometheus does"""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        if other.buckets != self.buckets:
+            raise ValueError("Histograms with different buckets can not be merged")
+        self.counts = [x + y for x, y in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+
+class Registry:
+    """Counters and histograms shared by all the threads of the process"""
+
+    def __init__(self):
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(
+        self, name: str, value: float, buckets: List[float] = TIME_BUCKETS
+    ) -> None:
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def merge(self, other: "Registry") -> None:
+        with self.lock:
+            for name, value in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram in other.histograms.items():
+                if name in self.histograms:
+                    self.histograms[name].merge(histogram)
+                else:
+                    self.histograms[name] = histogram
+
+    def to_json(self) -> Dict:
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: {
+                        "buckets": x.buckets,
+                        "counts": x.counts,
+                        "sum": x.sum,
+                        "count": x.count,
+                    }
+                    for name, x in self.histograms.items()
+                },
+            }
+
+    @staticmethod
+    def from_json(data: Dict) -> "Registry":
+        registry = Registry()
+        registry.counters.update(data.get("counters", {}))
+        for name, item in data.get("histograms", {}).items():
+            histogram = Histogram(item["buckets"])
+            histogram.counts = item["counts"]
+            histogram.sum = item["sum"]
+            histogram.count = item["count"]
+            registry.histograms[name] = histogram
+        return registry
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text format"""
+
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                lines.append(f"{PREFIX}{name} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{PREFIX}{name}_bucket{{le="{bound}"}} {count}')
+                lines.append(f'{PREFIX}{name}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{PREFIX}{name}_sum {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def enable(on: bool = True) -> None:
+    global enabled
+    enabled = on
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Increases the counter, names of counters end with _total"""
+    if enabled:
+        registry.inc(name, value)
+
+
+def observe(name: str, value: float, buckets: List[float] = TIME_BUCKETS) -> None:
+    """Adds the value to the histogram"""
+    if enabled:
+        registry.observe(name, value, buckets)
+
+
+@contextmanager
+def _timer(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(f"{name}_seconds", time.perf_counter() - start)
+
+
+def timer(name: str) -> ContextManager:
+    """Times the block into the histogram name_seconds"""
+    return _timer(name) if enabled else nullcontext()
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Decorator timing each call of the function into name_seconds"""
+
+    def decorator(fun: Callable) -> Callable:
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fun(*args, **kwargs)
+            with _timer(name):
+                return fun(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def load(path: str = METRICS_FILE) -> Registry:
+    """Loads the metrics saved before, empty if there are none"""
+    if not os.path.isfile(path):
+        return Registry()
+    with open(path) as file:
+        return Registry.from_json(json.load(file))
+
+
+def save(path: str = METRICS_FILE) -> None:
+    """
+    Adds the metrics collected by this process to the ones saved before
+    Processes saving at once wait for each other on a lock file,
+    the file is replaced at once, so it's never read half written.
+    """
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stored = load(path)
+        stored.merge(registry)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(stored.to_json(), file, indent=2)
+        os.replace(temp_path, path)
+    registry.clear()
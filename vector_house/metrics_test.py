@@ -0,0 +1,88 @@
+import os
+import sys
+import subprocess
+import vector_house.metrics as metrics
+
+TEST_METRICS_FILE = "test-metrics.json"
+
+
+@metrics.timed("add")
+def add(a: int, b: int) -> int:
+    return a + b
+
+
+def test_disabled() -> None:
+    """Tests nothing is recorded until metrics are enabled"""
+
+    metrics.enable(False)
+    metrics.registry.clear()
+    metrics.inc("queries_total")
+    metrics.observe("size", 3)
+    with metrics.timer("block"):
+        pass
+    assert add(1, 2) == 3
+    assert metrics.registry.counters == {}
+    assert metrics.registry.histograms == {}
+
+
+def test_metrics() -> None:
+    """Tests counters, histograms and their export"""
+
+    metrics.enable()
+    metrics.registry.clear()
+    try:
+        metrics.inc("queries_total")
+        metrics.inc("queries_total", 2)
+        metrics.observe("size", 3, [1, 5, 10])
+        metrics.observe("size", 7, [1, 5, 10])
+        assert add(1, 2) == 3
+
+        assert metrics.registry.counters == {"queries_total": 3}
+        size = metrics.registry.histograms["size"]
+        assert size.counts == [0, 1, 2]
+        assert size.sum == 10
+        assert metrics.registry.histograms["add_seconds"].count == 1
+
+        text = metrics.registry.to_prometheus()
+        assert "vector_house_queries_total 3\n" in text
+        assert 'vector_house_size_bucket{le="5"} 1\n' in text
+        assert 'vector_house_size_bucket{le="+Inf"} 2\n' in text
+        assert "vector_house_size_sum 10.0\n" in text
+
+        loaded = metrics.Registry.from_json(metrics.registry.to_json())
+        assert loaded.to_prometheus() == text
+
+        # saved metrics are added to the ones saved before
+        metrics.save(TEST_METRICS_FILE)
+        assert metrics.registry.counters == {}
+        metrics.inc("queries_total")
+        metrics.save(TEST_METRICS_FILE)
+        stored = metrics.load(TEST_METRICS_FILE)
+        assert stored.counters == {"queries_total": 4}
+        assert stored.histograms["size"].count == 2
+    finally:
+        metrics.enable(False)
+        metrics.registry.clear()
+        for path in [TEST_METRICS_FILE, TEST_METRICS_FILE + ".lock"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def test_concurrent_save() -> None:
+    """Tests no update is lost by processes saving at once"""
+
+    code = (
+        "import vector_house.metrics as metrics\n"
+        + "metrics.enable()\n"
+        + "for _ in range(20):\n"
+        + "    metrics.inc('queries_total')\n"
+        + f"    metrics.save('{TEST_METRICS_FILE}')\n"
+    )
+    try:
+        processes = [subprocess.Popen([sys.executable, "-c", code]) for _ in range(4)]
+        assert all(x.wait() == 0 for x in processes)
+        assert metrics.load(TEST_METRICS_FILE).counters == {"queries_total": 80}
+    finally:
+        for path in [TEST_METRICS_FILE, TEST_METRICS_FILE + ".lock"]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,284 @@
+import os
+import os.path
+from typing import List, Dict, Tuple
+import numpy as np
+from scipy.sparse import coo_matrix
+
+from vector_house.database import WikiDatabase, postings_to_vectors, top_postings
+from vector_house.defaults import MMAP_DEFAULT_DIR
+
+# Files of an exported index, each is a .npy array
+TERM_BYTES = "term_bytes"  # utf-8 term names sorted, concatenated
+TERM_OFFSETS = "term_offsets"  # start of each term name, one extra at the end
+TERM_PTR = "term_ptr"  # CSC, postings of i-th term are in [ptr[i], ptr[i + 1])
+TERM_ROWS = "term_rows"  # CSC, document rows of the postings
+TERM_DATA = "term_data"  # CSC, weights of the postings
+DOC_PTR = "doc_ptr"  # CSR, terms of i-th document are in [ptr[i], ptr[i + 1])
+DOC_COLS = "doc_cols"  # CSR, term columns of the document terms
+DOC_DATA = "doc_data"  # CSR, weights of the document terms
+DOC_IDS = "doc_ids"  # doc id of each row, ascending
+DOC_NORMS = "doc_norms"  # L2 norm of each row
+TERM_BOUNDS = "term_bounds"  # max weight divided by the doc norm of each column
+TITLE_BYTES = "title_bytes"
+TITLE_OFFSETS = "title_offsets"
+TEXT_BYTES = "text_bytes"
+TEXT_OFFSETS = "text_offsets"
+
+
+def npy_path(directory: str, name: str) -> str:
+    return os.path.join(directory, name + ".npy")
+
+
+def export_strings(
+    directory: str, name_bytes: str, name_offsets: str, strings: List[str]
+) -> None:
+    """Stores strings as a single utf-8 buffer with offsets"""
+
+    encoded = [x.encode("utf8") for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+
+    np.save(npy_path(directory, name_offsets), offsets)
+    np.save(npy_path(directory, name_bytes), np.frombuffer(b"".join(encoded), np.uint8))
+
+
+def export_texts(directory: str, wiki_db: WikiDatabase, doc_ids: np.ndarray) -> None:
+    """
+    Stores texts of the documents as a single utf-8 buffer with offsets
+    Texts are streamed from the database, they are not kept in memory
+    """
+
+    cur = wiki_db.con.cursor()
+    res = cur.execute(
+        """
+SELECT coalesce(sum(length(CAST(text AS BLOB))), 0) FROM document;
+                    """
+    )
+    size = res.fetchone()[0]
+
+    text_bytes = np.lib.format.open_memmap(
+        npy_path(directory, TEXT_BYTES), mode="w+", dtype=np.uint8, shape=(size,)
+    )
+    offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+
+    res = cur.execute(""" SELECT text FROM document ORDER BY doc_id; """)
+    position = 0
+    for i, (text,) in enumerate(res):
+        encoded = text.encode("utf8")
+        text_bytes[position : position + len(encoded)] = np.frombuffer(
+            encoded, np.uint8
+        )
+        position += len(encoded)
+        offsets[i + 1] = position
+
+    text_bytes.flush()
+    del text_bytes
+    np.save(npy_path(directory, TEXT_OFFSETS), offsets)
+
+
+def export_mmap(wiki_db: WikiDatabase, directory: str = MMAP_DEFAULT_DIR) -> None:
+    """
+    Exports the index as NumPy arrays, so it can be served by MmapIndex
+    """
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    term_names = wiki_db.get_all_terms()
+    names = sorted(term_names.keys())
+    term_ids = np.array([term_names[x] for x in names], dtype=np.int64)
+    doc_ids = wiki_db.get_all_doc_ids()
+    value_doc_ids, value_term_ids, values = wiki_db.get_all_values()
+
+    # columns are ordered by term names, so a term lookup gives the column
+    col_of_id = np.argsort(term_ids)
+    rows = np.searchsorted(doc_ids, value_doc_ids)
+    cols = col_of_id[np.searchsorted(term_ids[col_of_id], value_term_ids)]
+    matrix = coo_matrix(
+        (values.astype(np.float32), (rows, cols)), shape=(len(doc_ids), len(names))
+    )
+
+    csc = matrix.tocsc()
+    csc.sort_indices()
+    np.save(npy_path(directory, TERM_PTR), csc.indptr.astype(np.int64))
+    np.save(npy_path(directory, TERM_ROWS), csc.indices.astype(np.int32))
+    np.save(npy_path(directory, TERM_DATA), csc.data)
+
+    csr = matrix.tocsr()
+    csr.sort_indices()
+    np.save(npy_path(directory, DOC_PTR), csr.indptr.astype(np.int64))
+    np.save(npy_path(directory, DOC_COLS), csr.indices.astype(np.int32))
+    np.save(npy_path(directory, DOC_DATA), csr.data)
+
+    stored_norms = wiki_db.get_doc_norms(doc_ids.tolist())
+    norms = np.sqrt(np.asarray(csr.multiply(csr).sum(axis=1)).ravel())
+    for i, doc_id in enumerate(doc_ids.tolist()):
+        norms[i] = stored_norms.get(doc_id, norms[i])
+    np.save(npy_path(directory, DOC_IDS), doc_ids)
+    np.save(npy_path(directory, DOC_NORMS), norms)
+
+    with np.errstate(divide="ignore"):
+        inv_norms = np.where(norms > 0, 1 / norms, 0.0)
+    normalized = csc.multiply(inv_norms[:, np.newaxis]).tocsc()
+    bounds = np.asarray(normalized.max(axis=0).todense()).ravel()
+    np.save(npy_path(directory, TERM_BOUNDS), bounds.astype(np.float64))
+
+    export_strings(directory, TERM_BYTES, TERM_OFFSETS, names)
+    res = wiki_db.con.execute(""" SELECT title FROM document ORDER BY doc_id; """)
+    titles = [x[0] for x in res.fetchall()]
+    export_strings(directory, TITLE_BYTES, TITLE_OFFSETS, titles)
+    export_texts(directory, wiki_db, doc_ids)
+
+
+class MmapIndex:
+    """
+    Read-only index exported by export_mmap.
+    All the arrays are memory mapped, so processes serving the same index
+    share it through the page cache and opening it costs nearly nothing.
+    Provides the reading methods of WikiDatabase used by the search engine.
+    """
+
+    def __init__(self, directory: str = MMAP_DEFAULT_DIR):
+        self.path = directory
+
+        def load(name: str) -> np.ndarray:
+            return np.load(npy_path(directory, name), mmap_mode="r")
+
+        self.term_bytes = load(TERM_BYTES)
+        self.term_offsets = load(TERM_OFFSETS)
+        self.term_ptr = load(TERM_PTR)
+        self.term_rows = load(TERM_ROWS)
+        self.term_data = load(TERM_DATA)
+        self.doc_ptr = load(DOC_PTR)
+        self.doc_cols = load(DOC_COLS)
+        self.doc_data = load(DOC_DATA)
+        self.doc_ids = load(DOC_IDS)
+        self.norms = load(DOC_NORMS)
+        self.title_bytes = load(TITLE_BYTES)
+        self.title_offsets = load(TITLE_OFFSETS)
+        self.text_bytes = load(TEXT_BYTES)
+        self.text_offsets = load(TEXT_OFFSETS)
+        # older exports do not contain the bounds
+        self.bounds = None
+        if os.path.isfile(npy_path(directory, TERM_BOUNDS)):
+            self.bounds = load(TERM_BOUNDS)
+
+    @staticmethod
+    def is_exported(directory: str) -> bool:
+        """Checks if the directory contains an exported index"""
+        return os.path.isfile(npy_path(directory, TERM_PTR))
+
+    def get_term_name(self, col: int) -> str:
+        start, end = self.term_offsets[col], self.term_offsets[col + 1]
+        return self.term_bytes[start:end].tobytes().decode("utf8")
+
+    def get_term_col(self, name: str) -> int | None:
+        """
+        Finds column of the term by binary search over the sorted names
+        """
+        encoded = name.encode("utf8")
+        low, high = 0, len(self.term_offsets) - 1
+        while low < high:
+            mid = (low + high) // 2
+            start, end = self.term_offsets[mid], self.term_offsets[mid + 1]
+            if self.term_bytes[start:end].tobytes() < encoded:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < len(self.term_offsets) - 1 and self.get_term_name(low) == name:
+            return low
+        return None
+
+    def get_doc_row(self, doc_id: int) -> int | None:
+        row = int(np.searchsorted(self.doc_ids, doc_id))
+        if row < len(self.doc_ids) and self.doc_ids[row] == doc_id:
+            return row
+        return None
+
+    def get_stats(self) -> Tuple[int, int, int]:
+        """
+        Returns the number of terms, documents and values
+        """
+        return (len(self.term_ptr) - 1, len(self.doc_ids), len(self.term_data))
+
+    def get_postings(
+        self, term_names: List[str], limit: int | None = None
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Gets posting lists of the terms given as doc ids and weights
+        limit - keep only this many postings with the highest weight of each term
+        """
+        to_return: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for name in term_names:
+            col = self.get_term_col(name)
+            if col is None:
+                continue
+
+            start, end = self.term_ptr[col], self.term_ptr[col + 1]
+            rows = self.term_rows[start:end]
+            to_return[name] = (self.doc_ids[rows], self.term_data[start:end])
+            if limit is not None:
+                to_return[name] = top_postings(*to_return[name], limit)
+
+        return to_return
+
+    def get_values_for_terms(
+        self, term_names: List[str], limit: int | None = None
+    ) -> Dict[int, np.ndarray]:
+        """
+        Gets weight vectors of the documents containing any of the terms
+        """
+        postings = self.get_postings(term_names, limit)
+        return postings_to_vectors([postings.get(x) for x in term_names])
+
+    def get_terms_for_doc(self, doc_id: int) -> Dict[str, np.float32]:
+        """
+        Gets terms in given document
+        """
+        row = self.get_doc_row(doc_id)
+        if row is None:
+            return {}
+
+        start, end = self.doc_ptr[row], self.doc_ptr[row + 1]
+        cols = self.doc_cols[start:end]
+        values = self.doc_data[start:end]
+        return {self.get_term_name(c): v for c, v in zip(cols.tolist(), values)}
+
+    def get_doc_norms(self, doc_ids: List[int]) -> Dict[int, float]:
+        """
+        Gets norms of the documents given
+        """
+        ids = np.asarray(doc_ids, dtype=np.int64)
+        rows = np.clip(np.searchsorted(self.doc_ids, ids), 0, len(self.doc_ids) - 1)
+        found = self.doc_ids[rows] == ids
+        return dict(zip(ids[found].tolist(), self.norms[rows[found]].tolist()))
+
+    def has_term_bounds(self) -> bool:
+        return self.bounds is not None
+
+    def get_term_bounds(self, term_names: List[str]) -> Dict[str, float]:
+        """
+        Gets max normalized weights of the terms given
+        """
+        to_return: Dict[str, float] = {}
+        if self.bounds is None:
+            return to_return
+
+        for name in term_names:
+            col = self.get_term_col(name)
+            if col is not None:
+                to_return[name] = float(self.bounds[col])
+        return to_return
+
+    def get_doc_by_id(self, id: int) -> Tuple[str, str]:
+        """
+        Gets title and text of the document
+        """
+        row = self.get_doc_row(id)
+
+        start, end = self.title_offsets[row], self.title_offsets[row + 1]
+        title = self.title_bytes[start:end].tobytes().decode("utf8")
+        start, end = self.text_offsets[row], self.text_offsets[row + 1]
+        text = self.text_bytes[start:end].tobytes().decode("utf8")
+        return (title, text)
@@ -0,0 +1,52 @@
+import tempfile
+import numpy as np
+from vector_house.database import WikiDatabase
+from vector_house.database_test import run_with_db
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.matrix_engine_test import fill_db
+from vector_house.mmap_index import MmapIndex, export_mmap
+import vector_house.search_engine as se
+
+
+@run_with_db
+def test_export(db: WikiDatabase) -> None:
+    """Tests the exported index gives the same results as the database"""
+
+    fill_db(db)
+    db.insert_document("Žluťoučký kůň", "úpěl ďábelské ódy")
+    db.update_doc_norms()
+
+    with tempfile.TemporaryDirectory() as directory:
+        assert not MmapIndex.is_exported(directory)
+        export_mmap(db, directory)
+        assert MmapIndex.is_exported(directory)
+        index = MmapIndex(directory)
+
+        assert index.get_stats() == db.get_stats()
+        for doc_id in range(1, 6):
+            assert index.get_doc_by_id(doc_id) == db.get_doc_by_id(doc_id)
+            assert index.get_terms_for_doc(doc_id).keys() == (
+                db.get_terms_for_doc(doc_id).keys()
+            )
+
+        terms = ["t4", "unknown", "t2"]
+        vectors = db.get_values_for_terms(terms)
+        from_index = index.get_values_for_terms(terms)
+        assert vectors.keys() == from_index.keys()
+        for doc_id, vector in vectors.items():
+            assert np.allclose(vector, from_index[doc_id])
+
+        assert_same_pages(se.find_pages(index, terms), se.find_pages(db, terms))
+        assert index.get_doc_norms([1, 42]).keys() == {1}
+
+        engine = MatrixEngine.from_mmap(index)
+        from_db = MatrixEngine.from_database(db)
+        assert_same_pages(engine.similar(3), from_db.similar(3))
+        assert_same_pages(engine.search(terms), from_db.search(terms))
+
+
+def assert_same_pages(pages1: list, pages2: list) -> None:
+    """Weights are exported as float32, the scores differ a bit"""
+
+    assert [x[1] for x in pages1] == [x[1] for x in pages2]
+    assert np.allclose([x[0] for x in pages1], [x[0] for x in pages2])
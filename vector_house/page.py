@@ -12,33 +12,163 @@ sys.path.append(str(pathlib.Path().absolute()))
 
 import vector_house.indexer as ind
 import vector_house.search_engine as se
-from vector_house.database import WikiDatabase
+from vector_house.database import WikiDatabase, DB_DEFAULT_FILENAME
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.query_eval import max_score_search
+from vector_house.result_cache import ResultCache
+from vector_house.embedding import AnnIndex
+from vector_house.shards import ShardedIndex, META_SHARDS, is_shards_only
+import vector_house.metrics as metrics
 
 NUM_OF_PAGES = 10
+SEARCH_VECTOR = "Vector model"
+SEARCH_MATRIX = "Sparse matrix"
+SEARCH_MAXSCORE = "MaxScore"
+SEARCH_ANN = "Embeddings (approximate)"
+SEARCH_SHARDED = "Sharded"
+
+
+@st.cache_resource
+def open_database(path: str) -> WikiDatabase:
+    """
+    Opens the DB once in the serving mode, all the sessions share
+    it's pool of read-only connections and the posting list cache
+    """
+
+    print("Connecting DB")
+    return WikiDatabase(path, read_only=True)
+
+
+@st.cache_resource(max_entries=1)
+def load_matrix_engine(
+    path: str, generation: int, _wiki_db: WikiDatabase
+) -> MatrixEngine:
+    """
+    Loads the index into memory once for each generation of the index,
+    shared by all the sessions. Read by the pooled connection of the session.
+    """
+
+    print("Loading sparse matrix")
+    return MatrixEngine.from_database(_wiki_db)
+
+
+@st.cache_resource(max_entries=1)
+def load_ann_index(path: str, generation: int, _wiki_db: WikiDatabase) -> AnnIndex:
+    """Loads the embeddings once for each generation, shared by all the sessions"""
+
+    print("Loading embeddings")
+    return AnnIndex.from_database(_wiki_db)
+
+
+@st.cache_resource(max_entries=1)
+def load_sharded_index(path: str, generation: int) -> ShardedIndex:
+    """
+    Starts the shard workers once for each generation of the index,
+    shared by all the sessions. Workers of the generation dropped
+    from the cache stop once it's executor is garbage collected.
+    """
+
+    print("Starting shard workers")
+    return ShardedIndex(path, read_only=True)
+
+
+def get_documents() -> WikiDatabase | ShardedIndex:
+    """The main DB, the shards if the split documents were dropped from it"""
+    wiki_db = st.session_state.wiki_db
+    if is_shards_only(wiki_db):
+        return load_sharded_index(wiki_db.path, wiki_db.get_generation())
+    return wiki_db
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """Results are shared by all the sessions"""
+    return ResultCache()
 
 
 def get_pages(keywords: List) -> List[Tuple[int, int]]:
-    """Gets ids of 10 pages to show"""
+    """
+    Gets ids of 10 pages to show
+    Uses the precomputed similar pages if possible, repeated queries are cached
+    """
 
-    vectors = se.find_vectors(st.session_state.wiki_db, keywords)
+    wiki_db = st.session_state.wiki_db
+    if st.session_state.get("sim_doc") is not None:
+        pages = wiki_db.get_similar(st.session_state.sim_doc, NUM_OF_PAGES)
+        if pages is not None:
+            return pages
+
+    sim_to = st.session_state.get("sim_to")
+    if sim_to is not None and sim_to.size == 0:
+        sim_to = None
+
+    # only the terms with the highest weight of the page are queried
+    mode = st.type_of_search
+    if sim_to is not None and st.session_state.approximate:
+        keywords, sim_to = se.prune_query(keywords, sim_to, se.SIM_MAX_TERMS)
+        mode += " approximate"
+
+    return get_result_cache().get(
+        wiki_db,
+        keywords,
+        sim_to,
+        NUM_OF_PAGES,
+        mode,
+        lambda: count_pages(keywords, sim_to),
+    )
 
-    print("Counting cos similarity")
-    if "sim_to" not in st.session_state or st.session_state.sim_to.size == 0:
-        pages = se.search(vectors)
-    else:
-        pages = se.search(vectors, st.session_state.sim_to)
 
-    return pages
+def count_pages(keywords: List, sim_to: np.array | None) -> List[Tuple[int, int]]:
+    """Counts ids of 10 pages to show"""
+
+    if st.type_of_search == SEARCH_MATRIX:
+        wiki_db = st.session_state.wiki_db
+        engine = load_matrix_engine(wiki_db.path, wiki_db.get_generation(), wiki_db)
+        if sim_to is None:
+            return engine.search(keywords, k=NUM_OF_PAGES)
+        return engine.search(keywords, sim_to, k=NUM_OF_PAGES)
+
+    print("Counting cos similarity")
+    wiki_db = st.session_state.wiki_db
+    posting_limit = se.SIM_POSTING_LIMIT if st.session_state.approximate else None
+    sim_doc = st.session_state.get("sim_doc")
+    if st.type_of_search == SEARCH_ANN and sim_doc is not None:
+        # only similar pages are searched by embeddings
+        if wiki_db.has_embeddings():
+            ann = load_ann_index(wiki_db.path, wiki_db.get_generation(), wiki_db)
+            return ann.similar(sim_doc, k=NUM_OF_PAGES)
+    # an index not split into shards is searched as a whole
+    if (
+        st.type_of_search == SEARCH_SHARDED
+        and wiki_db.get_meta(META_SHARDS, "0") != "0"
+    ):
+        sharded = load_sharded_index(wiki_db.path, wiki_db.get_generation())
+        if sim_to is None:
+            return sharded.find_pages(keywords, k=NUM_OF_PAGES)
+        return sharded.find_pages(
+            keywords, sim_to, NUM_OF_PAGES, posting_limit=posting_limit
+        )
+    if sim_to is None:
+        if st.type_of_search == SEARCH_MAXSCORE:
+            return max_score_search(wiki_db, keywords, k=NUM_OF_PAGES)
+        return se.find_pages(wiki_db, keywords, k=NUM_OF_PAGES)
+
+    if st.type_of_search == SEARCH_MAXSCORE:
+        return max_score_search(wiki_db, keywords, sim_to, k=NUM_OF_PAGES)
+    return se.find_pages(
+        wiki_db, keywords, sim_to, NUM_OF_PAGES, posting_limit=posting_limit
+    )
 
 
 def set_new_state(page_id: int) -> None:
     """Sets new state to show similar pages to given one"""
 
-    wiki_db = st.session_state.wiki_db
+    wiki_db = get_documents()
     dict_term_val = wiki_db.get_terms_for_doc(page_id)
     st.session_state.keywords = list(dict_term_val.keys())
     st.session_state.sim_to = np.array(list(dict_term_val.values()))
     st.session_state.name = wiki_db.get_doc_by_id(page_id)[0]
+    st.session_state.sim_doc = page_id
     st.experimental_rerun()
 
 
@@ -46,7 +176,7 @@ def print_pages(pages: list) -> None:
     """Prints the title and the text of pages, shows buttons"""
 
     st.write("---")
-    wiki_db = st.session_state.wiki_db
+    wiki_db = get_documents()
     index = 0
 
     for page in pages:
@@ -103,14 +233,22 @@ def run_page() -> None:
         get_keywords()
 
     st.write("Showing pages about:", st.session_state.name)
-    st.type_of_search = st.radio(
-        "Choose type of search", ("Vector model", "Sequential")
+    # an index dropped from the main DB by shard --drop-split is in the shards only
+    types = (SEARCH_VECTOR, SEARCH_MATRIX, SEARCH_MAXSCORE, SEARCH_ANN, SEARCH_SHARDED)
+    if is_shards_only(st.session_state.wiki_db):
+        types = (SEARCH_SHARDED,)
+    st.type_of_search = st.radio("Choose type of search", types)
+    st.session_state.approximate = st.checkbox(
+        f"Approximate similar pages, query only {se.SIM_MAX_TERMS} terms"
+        + f" and {se.SIM_POSTING_LIMIT} pages of each term",
+        value=False,
     )
 
-    if st.type_of_search == "Vector model" and not st.session_state.wiki_db.has_index():
-        st.session_state.wiki_db.create_index()
-    elif st.type_of_search == "Sequential" and st.session_state.wiki_db.has_index():
-        st.session_state.wiki_db.drop_index()
+    # the shared DB is read only, its indexes are created by index or db-index
+    if st.session_state.wiki_db.has_index():
+        st.write("DB indexes: created")
+    else:
+        st.write("DB indexes: dropped, postings are read by a full scan")
 
     if st.session_state.reload:
         start_time = time.time()
@@ -119,6 +257,8 @@ def run_page() -> None:
         st.session_state.time = round(end_time - start_time, 2)
 
     st.write("Time taken (in seconds):", st.session_state.time)
+    cache = get_result_cache()
+    st.write("Cached results used:", cache.hits, "of", cache.hits + cache.misses)
 
     print_pages(st.session_state.pages)
 
@@ -128,10 +268,13 @@ def run_page() -> None:
 
 
 if "wiki_db" not in st.session_state:
-    print("Connecting DB")
     st.session_state.keywords = []
-    st.session_state.wiki_db = WikiDatabase()
-    st.session_state.wiki_db.connect_database()
+    st.session_state.wiki_db = open_database(DB_DEFAULT_FILENAME)
     st.session_state.reload = True
 
-run_page()
+with st.session_state.wiki_db.session():
+    run_page()
+
+# metrics of the page are added to the file read by info --metrics
+if metrics.enabled:
+    metrics.save()
@@ -0,0 +1,108 @@
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import (
+    Dict,
+    List,
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
+    TypeVar,
+)
+import numpy as np
+
+# Percentiles reported by summarize
+PERCENTILES = [50, 95, 99]
+# Number of functions and allocation sites printed by profile_call
+PROFILE_TOP = 20
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    """
+    Accumulates wall clock time spent in named stages
+    Either time a block by stage() or split a sequence of steps by lap().
+    """
+
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+        self.last = time.perf_counter()
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+    def lap(self, stage: str) -> None:
+        """Counts the time since the previous lap (or the start) to the stage"""
+        now = time.perf_counter()
+        self.add(stage, now - self.last)
+        self.last = now
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Counts the time spent in the block to the stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def total(self) -> float:
+        return sum(self.times.values())
+
+
+def timed_stage(timer: StageTimer | None, stage: str) -> ContextManager:
+    """Counts the time spent in the block to the stage, if a timer is given"""
+    if timer is None:
+        return nullcontext()
+    return timer.stage(stage)
+
+
+def timed_iter(items: Iterable[T], timer: StageTimer, stage: str) -> Iterator[T]:
+    """Yields the items, time spent producing them is counted to the stage"""
+    iterator = iter(items)
+    while True:
+        with timer.stage(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Returns the percentiles of the times given in seconds as milliseconds,
+    keys are p50, p95 and p99
+    """
+    if len(samples) == 0:
+        return {f"p{x}": 0.0 for x in PERCENTILES}
+
+    values = np.percentile(np.asarray(samples) * 1000, PERCENTILES)
+    return {f"p{x}": float(value) for x, value in zip(PERCENTILES, values)}
+
+
+def profile_call(fun: Callable[[], T], top: int = PROFILE_TOP) -> T:
+    """
+    Runs the function under cProfile and tracemalloc, prints the functions
+    with the highest cumulative time and the lines allocating the most memory
+    """
+
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(fun)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    print(f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB")
+    for stat in snapshot.statistics("lineno")[:top]:
+        print(stat)
+
+    return result
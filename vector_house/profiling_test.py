@@ -0,0 +1,33 @@
+import time
+from vector_house.profiling import StageTimer, summarize, timed_iter
+
+
+def test_stage_timer() -> None:
+    timer = StageTimer()
+    with timer.stage("sleep"):
+        time.sleep(0.01)
+    timer.lap("rest")
+    timer.lap("rest")
+    timer.add("other", 1.0)
+
+    assert timer.times["sleep"] >= 0.01
+    assert timer.times["rest"] >= timer.times["sleep"]
+    assert timer.total() == sum(timer.times.values())
+
+
+def test_summarize() -> None:
+    summary = summarize([x / 1000 for x in range(1, 101)])
+    assert round(summary["p50"], 2) == 50.5
+    assert round(summary["p99"], 2) == 99.01
+    assert summarize([]) == {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+
+
+def test_timed_iter() -> None:
+    def produce():
+        for i in range(3):
+            time.sleep(0.01)
+            yield i
+
+    timer = StageTimer()
+    assert list(timed_iter(produce(), timer, "produce")) == [0, 1, 2]
+    assert timer.times["produce"] >= 0.03
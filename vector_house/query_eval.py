@@ -0,0 +1,178 @@
+from typing import List, Dict, Tuple
+import numpy as np
+
+from vector_house.database import WikiDatabase
+from vector_house.search_engine import find_pages, top_k, TOP_K
+from vector_house.profiling import StageTimer, timed_stage
+import vector_house.metrics as metrics
+
+# Relative slack of the upper bounds, covers rounding of the stored max weights
+BOUND_SLACK = 1e-9
+
+
+def kth_score(scores: np.ndarray, k: int) -> float:
+    """Returns the k-th best score or -inf if there are less candidates"""
+
+    if len(scores) < k:
+        return -np.inf
+    return float(np.partition(scores, len(scores) - k)[len(scores) - k])
+
+
+def merge_query(terms: List[str], wanted: np.array) -> Dict[str, float]:
+    """Sums weights of the terms present in the query multiple times"""
+
+    weights: Dict[str, float] = {}
+    for term, weight in zip(terms, wanted):
+        weights[term] = weights.get(term, 0.0) + float(weight)
+    return weights
+
+
+class Accumulator:
+    """
+    Partial cosine similarities of the candidate documents,
+    kept sorted by doc id so postings can be merged in with searchsorted
+    timer - counts the time reading norms to fetch, the rest to scoring
+    """
+
+    def __init__(self, db: WikiDatabase, timer: StageTimer | None = None):
+        self.db = db
+        self.timer = timer
+        self.doc_ids = np.empty(0, dtype=np.int64)
+        self.scores = np.empty(0)
+        self.inv_norms = np.empty(0)
+
+    def add(self, posting: Tuple[np.ndarray, np.ndarray], weight: float) -> None:
+        """Adds contributions of the posting, new documents become candidates"""
+
+        with timed_stage(self.timer, "scoring"):
+            post_ids = np.asarray(posting[0], dtype=np.int64)
+            new_ids = np.setdiff1d(post_ids, self.doc_ids)
+
+        if len(new_ids) != 0:
+            with timed_stage(self.timer, "fetch"):
+                norms = self.db.get_doc_norms(new_ids.tolist())
+
+            with timed_stage(self.timer, "scoring"):
+                new_norms = np.fromiter(
+                    (norms.get(x, 0.0) for x in new_ids.tolist()),
+                    dtype=np.float64,
+                    count=len(new_ids),
+                )
+                with np.errstate(divide="ignore"):
+                    new_inv = np.where(new_norms > 0, 1 / new_norms, 0.0)
+
+                doc_ids = np.concatenate((self.doc_ids, new_ids))
+                order = np.argsort(doc_ids, kind="stable")
+                self.doc_ids = doc_ids[order]
+                scores = np.concatenate((self.scores, np.zeros(len(new_ids))))
+                self.scores = scores[order]
+                self.inv_norms = np.concatenate((self.inv_norms, new_inv))[order]
+
+        self.update(posting, weight)
+
+    def update(self, posting: Tuple[np.ndarray, np.ndarray], weight: float) -> None:
+        """Adds contributions of the posting to the current candidates only"""
+
+        post_ids, post_weights = posting
+        if len(self.doc_ids) == 0 or len(post_ids) == 0:
+            return
+
+        with timed_stage(self.timer, "scoring"):
+            rows = np.searchsorted(self.doc_ids, post_ids)
+            rows = np.minimum(rows, len(self.doc_ids) - 1)
+            found = self.doc_ids[rows] == post_ids
+            rows = rows[found]
+            values = np.asarray(post_weights, dtype=np.float64)[found]
+            self.scores[rows] += values * weight * self.inv_norms[rows]
+
+    def prune(self, threshold: float) -> None:
+        """Drops candidates whose score can not reach the threshold"""
+
+        with timed_stage(self.timer, "scoring"):
+            keep = self.scores >= threshold
+            self.doc_ids = self.doc_ids[keep]
+            self.scores = self.scores[keep]
+            self.inv_norms = self.inv_norms[keep]
+
+    def kth_score(self, k: int) -> float:
+        """The k-th best final score, see kth_score"""
+
+        with timed_stage(self.timer, "scoring"):
+            return kth_score(self.final_scores(), k)
+
+    def final_scores(self) -> np.ndarray:
+        """Scores as counted by search, documents with zero norm get -1"""
+        return np.where(self.inv_norms > 0, self.scores, -1.0)
+
+
+@metrics.timed("max_score_search")
+def max_score_search(
+    db: WikiDatabase,
+    terms: List[str],
+    wanted: np.array = None,
+    k: int = TOP_K,
+    timer: StageTimer | None = None,
+) -> List[Tuple[float, int]]:
+    """
+    Returns top k documents for the terms given, same as find_pages,
+    but evaluates the query term at a time using MaxScore.
+    Terms are processed from the one with the highest upper bound of it's
+    contribution. Once the bounds of the remaining terms together can not
+    beat the k-th best score, no new documents can enter the top k, so the
+    remaining postings only update the current candidates.
+    Falls back to find_pages if the term max weights are not stored
+    or the query has negative weights, so scores could decrease.
+    timer - counts the time spent in the fetch, assembly, scoring and top_k stages
+    """
+
+    with timed_stage(timer, "assembly"):
+        if wanted is None:
+            wanted = np.ones(len(terms))
+        query_norm = np.linalg.norm(wanted)
+        weights = merge_query(terms, wanted)
+
+    with timed_stage(timer, "fetch"):
+        has_bounds = db.has_term_bounds()
+    if k <= 0 or query_norm == 0 or min(weights.values()) < 0 or not has_bounds:
+        return find_pages(db, terms, wanted, k, timer=timer)
+
+    with timed_stage(timer, "fetch"):
+        bounds = db.get_term_bounds(list(weights.keys()))
+    with timed_stage(timer, "assembly"):
+        uppers = {
+            term: weights[term] * bound / query_norm for term, bound in bounds.items()
+        }
+        order = sorted(uppers.keys(), key=lambda x: uppers[x], reverse=True)
+
+        # remaining[i] bounds the score a document gets from the terms i, i + 1, ...
+        remaining = np.zeros(len(order) + 1)
+        remaining[:-1] = np.cumsum([uppers[x] for x in order][::-1])[::-1]
+        remaining *= 1 + BOUND_SLACK
+
+    acc = Accumulator(db, timer)
+    processed = 0
+    while processed < len(order):
+        if remaining[processed] < acc.kth_score(k):
+            break
+
+        term = order[processed]
+        with timed_stage(timer, "fetch"):
+            posting = db.get_postings([term]).get(term)
+        if posting is not None:
+            acc.add(posting, weights[term] / query_norm)
+        processed += 1
+
+    rest = order[processed:]
+    if rest:
+        threshold = acc.kth_score(k)
+        acc.prune(threshold - remaining[processed])
+
+        with timed_stage(timer, "fetch"):
+            postings = db.get_postings(rest)
+        for i, term in enumerate(rest, processed + 1):
+            if term in postings:
+                acc.update(postings[term], weights[term] / query_norm)
+            acc.prune(threshold - remaining[i])
+
+    with timed_stage(timer, "top_k"):
+        return top_k(acc.final_scores(), acc.doc_ids, k)
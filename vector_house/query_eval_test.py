@@ -0,0 +1,127 @@
+import numpy as np
+from vector_house.database import WikiDatabase, POSTING_FLOAT16, POSTING_UINT8
+from vector_house.database_test import run_with_db
+from vector_house.query_eval import max_score_search
+from vector_house.search_engine import find_pages
+
+
+def fill_db(db: WikiDatabase) -> None:
+    """Inserts random weights of 30 terms in 200 documents"""
+
+    rng = np.random.default_rng(42)
+    term_ids = [db.insert_term(f"t{i}") for i in range(30)]
+    doc_ids = [db.insert_document(f"d{i}", "body") for i in range(200)]
+
+    for doc_id in doc_ids:
+        for i in rng.choice(30, size=rng.integers(1, 10), replace=False):
+            db.insert_value(term_ids[i], doc_id, float(rng.random()))
+
+    db.update_doc_norms()
+    db.update_term_bounds()
+    db.commit()
+
+
+def assert_same_pages(pages, expected) -> None:
+    """Scores are summed in a different order, so ties are compared rounded"""
+
+    def rounded(x):
+        return sorted([(round(sim, 6), doc_id) for sim, doc_id in x], reverse=True)
+
+    assert rounded(pages) == rounded(expected)
+
+
+@run_with_db
+def test_max_score(db: WikiDatabase) -> None:
+    """Tests MaxScore returns the same pages as the exhaustive search"""
+
+    fill_db(db)
+
+    queries = [["t1"], ["t1", "t2", "t3"], ["t5", "t5", "unknown"], ["unknown"]]
+    for terms in queries:
+        for k in [1, 5, 10, 500]:
+            assert_same_pages(
+                max_score_search(db, terms, k=k), find_pages(db, terms, k=k)
+            )
+
+    terms = [f"t{i}" for i in range(30)]
+    wanted = np.linspace(0.1, 3, 30)
+    assert_same_pages(
+        max_score_search(db, terms, wanted), find_pages(db, terms, wanted)
+    )
+
+    # similar documents, all the terms of the document are used
+    doc_terms = db.get_terms_for_doc(7)
+    terms = list(doc_terms.keys())
+    wanted = np.array(list(doc_terms.values()))
+    pages = max_score_search(db, terms, wanted)
+    assert pages[0][1] == 7
+    assert_same_pages(pages, find_pages(db, terms, wanted))
+
+
+@run_with_db
+def test_max_score_encoded(db: WikiDatabase) -> None:
+    """Tests MaxScore on rounded weights of the compact posting lists"""
+
+    fill_db(db)
+    exact = db.get_term_bounds(["t1"])["t1"]
+
+    for encoding in [POSTING_UINT8, POSTING_FLOAT16]:
+        db.build_postings(encoding)
+        db.update_term_bounds()
+        db.bump_generation()
+        db.commit()
+        assert db.get_term_bounds(["t1"])["t1"] != exact
+
+        for terms in [["t1"], ["t1", "t2", "t3"], [f"t{i}" for i in range(30)]]:
+            for k in [1, 5, 10]:
+                assert_same_pages(
+                    max_score_search(db, terms, k=k), find_pages(db, terms, k=k)
+                )
+
+        doc_terms = db.get_terms_for_doc(7)
+        terms = list(doc_terms.keys())
+        wanted = np.array(list(doc_terms.values()))
+        assert_same_pages(
+            max_score_search(db, terms, wanted), find_pages(db, terms, wanted)
+        )
+
+
+@run_with_db
+def test_max_score_rounded(db: WikiDatabase) -> None:
+    """Tests a document scoring above the exact bound thanks to rounding is kept"""
+
+    term_ids = [db.insert_term(x) for x in ["a", "b", "c"]]
+    doc_ids = [db.insert_document(x, "body") for x in ["d1", "d2"]]
+    db.insert_value(term_ids[0], doc_ids[0], 1)
+    # float16 rounds 1000.3 up to 1000.5, above the norm of the document
+    db.insert_value(term_ids[1], doc_ids[1], 1000.3)
+    db.insert_value(term_ids[2], doc_ids[1], 10)
+    db.update_doc_norms()
+    db.build_postings(POSTING_FLOAT16)
+    db.update_term_bounds()
+    db.commit()
+
+    expected = find_pages(db, ["a", "b"], k=1)
+    assert expected[0][1] == doc_ids[1]
+    assert_same_pages(max_score_search(db, ["a", "b"], k=1), expected)
+
+
+@run_with_db
+def test_term_bounds(db: WikiDatabase) -> None:
+    """Tests max weights divided by the document norms"""
+
+    term_ids = [db.insert_term(x) for x in ["t1", "t2", "t3"]]
+    doc_ids = [db.insert_document(x, "body") for x in ["d1", "d2"]]
+    db.insert_value(term_ids[0], doc_ids[0], 3)
+    db.insert_value(term_ids[1], doc_ids[0], 4)
+    db.insert_value(term_ids[0], doc_ids[1], 1)
+    db.commit()
+
+    assert not db.has_term_bounds()
+    db.update_doc_norms()
+    db.update_term_bounds()
+    db.commit()
+
+    assert db.has_term_bounds()
+    bounds = db.get_term_bounds(["t1", "t2", "t3", "unknown"])
+    assert bounds == {"t1": 1.0, "t2": 0.8, "t3": 0.0}
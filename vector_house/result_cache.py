@@ -0,0 +1,166 @@
+import os
+import json
+import fcntl
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Callable, Hashable
+import numpy as np
+
+from vector_house.database import WikiDatabase
+import vector_house.metrics as metrics
+
+# Number of query results kept
+CACHE_SIZE = 1024
+# Number of lookups after which the hit and miss counters are stored
+STATS_FLUSH_EVERY = 100
+# The counters of a DB are stored next to it, the DB is never written
+STATS_SUFFIX = "-cache-stats.json"
+
+
+def query_key(terms: List[str], wanted: np.array = None) -> Tuple[Hashable, ...]:
+    """
+    Normalizes the query, so the order of the terms does not matter
+    Terms are sorted with their weights, the weights are hashed
+    """
+
+    if wanted is None:
+        return (tuple(sorted(terms)), None)
+
+    pairs = sorted(zip(terms, np.asarray(wanted, dtype=np.float64).tolist()))
+    weights = np.array([x[1] for x in pairs], dtype=np.float64)
+    digest = hashlib.blake2b(weights.tobytes(), digest_size=16).hexdigest()
+    return (tuple(x[0] for x in pairs), digest)
+
+
+class ResultCache:
+    """
+    LRU cache of query results
+    Results are valid only for the index generation they were computed for,
+    the cache is cleared once the generation stored in the DB changes.
+    Can be shared by threads, the result is computed outside of the lock.
+    Hits and misses are added to the stats file of the DB every
+    STATS_FLUSH_EVERY lookups and when the process exits.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.entries: OrderedDict = OrderedDict()
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        # hits and misses of each DB path not stored yet
+        self.stats: Dict[str, List[int]] = {}
+        self.unflushed = 0
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def get(
+        self,
+        db: WikiDatabase,
+        terms: List[str],
+        wanted: np.array,
+        k: int,
+        mode: str,
+        compute: Callable[[], List[Tuple[float, int]]],
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns the cached result of the query or computes and caches it
+        mode - distinguishes engines returning different results
+        """
+
+        generation = db.get_generation()
+        key = (db.path, query_key(terms, wanted), k, mode)
+
+        with self.lock:
+            if self.generations.get(db.path) != generation:
+                self.invalidate(db.path)
+                self.generations[db.path] = generation
+
+            pages = self.entries.get(key)
+            if pages is not None:
+                self.entries.move_to_end(key)
+                self.count(db, hit=True)
+                return pages
+
+        pages = compute()
+        with self.lock:
+            if self.generations.get(db.path) == generation:
+                self.entries[key] = pages
+                if len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+            self.count(db, hit=False)
+        return pages
+
+    def invalidate(self, path: str) -> None:
+        """Drops all the results of the index given"""
+        for key in [x for x in self.entries.keys() if x[0] == path]:
+            del self.entries[key]
+
+    def count(self, db: WikiDatabase, hit: bool) -> None:
+        """Counts a lookup, has to be called with the lock held"""
+        metrics.inc("result_cache_hits_total" if hit else "result_cache_misses_total")
+        stats = self.stats.setdefault(db.path, [0, 0])
+        if hit:
+            self.hits += 1
+            stats[0] += 1
+        else:
+            self.misses += 1
+            stats[1] += 1
+
+        self.unflushed += 1
+        if self.unflushed >= STATS_FLUSH_EVERY:
+            self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """
+        Adds the hits and misses counted since the last flush to the stats file
+        of each DB, they are added later if a file can not be written now
+        Has to be called with the lock held.
+        """
+        for path, (hits, misses) in list(self.stats.items()):
+            try:
+                add_stats(path, hits, misses)
+            except OSError:
+                return
+            del self.stats[path]
+        self.unflushed = 0
+
+    def close(self) -> None:
+        """Stores the counters not stored yet, called when the process exits"""
+        with self.lock:
+            self.flush_stats()
+
+
+def stats_path(db_path: str) -> str:
+    """Returns the file storing the counters of the DB"""
+    return db_path + STATS_SUFFIX
+
+
+def add_stats(db_path: str, hits: int, misses: int) -> None:
+    """
+    Adds the counters to the ones stored by all the processes before
+    Processes adding at once wait for each other on a lock file,
+    the file is replaced at once, so it's never read half written.
+    """
+    path = stats_path(db_path)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stored_hits, stored_misses = get_stats(db_path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(
+                {"hits": stored_hits + hits, "misses": stored_misses + misses}, file
+            )
+        os.replace(temp_path, path)
+
+
+def get_stats(db_path: str) -> Tuple[int, int]:
+    """Returns the numbers of cache hits and misses stored by all the processes"""
+    try:
+        with open(stats_path(db_path)) as file:
+            stats = json.load(file)
+    except (OSError, ValueError):
+        return 0, 0
+    return stats.get("hits", 0), stats.get("misses", 0)
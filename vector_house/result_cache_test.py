@@ -0,0 +1,80 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import vector_house.result_cache as rc
+from vector_house.database import WikiDatabase
+from vector_house.database_test import run_with_db
+from vector_house.result_cache import ResultCache, query_key
+
+
+def test_query_key() -> None:
+    """Tests the order of the terms does not matter"""
+
+    assert query_key(["b", "a"]) == query_key(["a", "b"])
+    assert query_key(["a", "a"]) != query_key(["a"])
+
+    wanted = np.array([0.5, 0.25])
+    assert query_key(["b", "a"], wanted) == query_key(["a", "b"], wanted[::-1])
+    assert query_key(["b", "a"], wanted) != query_key(["a", "b"], wanted)
+    assert query_key(["b", "a"], wanted) != query_key(["b", "a"])
+
+
+@run_with_db
+def test_result_cache(db: WikiDatabase) -> None:
+    """Tests eviction and invalidation by the index generation"""
+
+    cache = ResultCache(size=2)
+    computed = []
+
+    def get(terms, k=10):
+        return cache.get(db, terms, None, k, "db", lambda: computed.append(terms) or [])
+
+    get(["a"])
+    get(["a"])
+    get(["b"])
+    get(["a"])
+    assert computed == [["a"], ["b"]]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # ["b"] was used the least recently
+    get(["c"])
+    get(["a"])
+    get(["b"])
+    assert computed == [["a"], ["b"], ["c"], ["b"]]
+
+    # a different number of pages is a different query
+    get(["b"], k=5)
+    assert len(computed) == 5
+
+    db.bump_generation()
+    db.commit()
+    get(["b"], k=5)
+    assert len(computed) == 6
+
+    # the counters are stored next to the DB, the DB is not written
+    generation = db.get_generation()
+    assert rc.get_stats(db.path) == (0, 0)
+    try:
+        cache.close()
+        cache.close()
+        assert rc.get_stats(db.path) == (3, 6)
+        assert db.get_generation() == generation
+
+        # counters of other processes are added, the ones not stored at exit
+        code = (
+            "from vector_house.database import WikiDatabase\n"
+            + "from vector_house.result_cache import ResultCache\n"
+            + f"db = WikiDatabase('{db.path}', read_only=True)\n"
+            + "cache = ResultCache()\n"
+            + "with db.session():\n"
+            + "    for _ in range(3):\n"
+            + "        cache.get(db, ['a'], None, 10, 'db', lambda: [])\n"
+        )
+        processes = [subprocess.Popen([sys.executable, "-c", code]) for _ in range(4)]
+        assert all(x.wait() == 0 for x in processes)
+        assert rc.get_stats(db.path) == (3 + 4 * 2, 6 + 4)
+    finally:
+        for path in [rc.stats_path(db.path), rc.stats_path(db.path) + ".lock"]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,15 +1,33 @@
 from typing import List, Dict, Tuple
-from queue import PriorityQueue
 import numpy as np
-from vector_house.database import WikiDatabase
-
-
-def find_vectors(db: WikiDatabase, terms: List[str]) -> Dict[int, np.array]:
+from vector_house.database import WikiDatabase, postings_to_vectors
+from vector_house.profiling import StageTimer, timed_stage
+import vector_house.metrics as metrics
+
+# Number of documents returned by a search
+TOP_K = 10
+# Bounds of the approximate similar documents queries of the web page
+SIM_MAX_TERMS = 50
+SIM_POSTING_LIMIT = 1000
+
+
+@metrics.timed("find_vectors")
+def find_vectors(
+    db: WikiDatabase,
+    terms: List[str],
+    posting_limit: int | None = None,
+    timer: StageTimer | None = None,
+) -> Dict[int, np.array]:
     """
     Finds weight vectors for the terms given
+    posting_limit - use only the postings with the highest weight of each term
+    timer - counts the time reading the postings to fetch, the rest to assembly
     """
 
-    return db.get_values_for_terms(terms)
+    with timed_stage(timer, "fetch"):
+        postings = db.get_postings(terms, posting_limit)
+    with timed_stage(timer, "assembly"):
+        return postings_to_vectors([postings.get(x) for x in terms])
 
     size = len(terms)
     to_return: Dict[int, np.array] = dict()
@@ -43,34 +61,139 @@ def count_cos_sim(vec1: np.array, vec2: np.array) -> float:
     return np.dot(vec1, vec2) / (norm_vec1 * norm_vec2)
 
 
+def top_k(
+    scores: np.ndarray, doc_ids: np.ndarray, k: int = TOP_K
+) -> List[Tuple[float, int]]:
+    """
+    Selects k documents with the highest score, the best one first
+    Ties are broken by the higher doc id first
+    """
+
+    size = len(scores)
+    if size == 0 or k <= 0:
+        return []
+
+    if k < size:
+        best = np.argpartition(scores, size - k)[size - k :]
+        # keep all the ties of the k-th score so the order is deterministic
+        selected = np.flatnonzero(scores >= scores[best].min())
+    else:
+        selected = np.arange(size)
+
+    order = np.lexsort((doc_ids[selected], scores[selected]))[::-1][:k]
+    selected = selected[order]
+
+    return [(float(scores[i]), int(doc_ids[i])) for i in selected]
+
+
+def count_cos_sims(
+    vectors: np.ndarray, wanted: np.array, norms: np.ndarray = None
+) -> np.ndarray:
+    """
+    Counts cosine similarity of each row of the matrix given to the wanted vector
+    Norms of the whole documents can be given, otherwise norms of the rows are used
+    Rows with zero norm get -1 as in count_cos_sim
+    """
+
+    if norms is None:
+        norms = np.linalg.norm(vectors, axis=1)
+    wanted_norm = np.linalg.norm(wanted)
+    dots = vectors @ wanted
+
+    sims = np.full(len(vectors), -1.0)
+    if wanted_norm == 0:
+        return sims
+
+    nonzero = norms != 0
+    sims[nonzero] = dots[nonzero] / (norms[nonzero] * wanted_norm)
+    return sims
+
+
+@metrics.timed("search")
 def search(
-    data: Dict[int, np.array], wanted: np.array = None
+    data: Dict[int, np.array],
+    wanted: np.array = None,
+    k: int = TOP_K,
+    norms: Dict[int, float] = None,
+    timer: StageTimer | None = None,
 ) -> List[Tuple[float, int]]:
     """
-    Returns ids of top 10 most relevant documents in order
+    Returns ids of top k most relevant documents in order
+    If the norms of the whole documents are given, they are used
+    instead of the norms of the partial vectors
+    timer - counts the time to the assembly, scoring and top_k stages
     """
 
     if not data:
         return []
 
-    if wanted is None:
-        num_of_terms = len(list(data.values())[0])
-        wanted = np.ones(num_of_terms)
+    with timed_stage(timer, "assembly"):
+        doc_ids = np.fromiter(data.keys(), dtype=np.int64, count=len(data))
+        vectors = np.vstack(list(data.values()))
+
+        if wanted is None:
+            wanted = np.ones(vectors.shape[1])
+
+        doc_norms = None
+        if norms:
+            doc_norms = np.fromiter(
+                (norms.get(doc_id, np.nan) for doc_id in data.keys()),
+                dtype=np.float64,
+                count=len(data),
+            )
+            missing = np.isnan(doc_norms)
+            doc_norms[missing] = np.linalg.norm(vectors[missing], axis=1)
+
+    with timed_stage(timer, "scoring"):
+        sims = count_cos_sims(vectors, wanted, doc_norms)
+    with timed_stage(timer, "top_k"):
+        return top_k(sims, doc_ids, k)
+
+
+def prune_query(
+    terms: List[str],
+    wanted: np.array,
+    max_terms: int | None = None,
+    mass: float | None = None,
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Keeps only the terms with the highest weight of the query vector
+    max_terms - keep at most this many terms
+    mass - keep the fewest terms covering this share of the squared vector norm
+    Returns the terms kept and their weights, the highest weight first
+    """
 
-    top_docs = PriorityQueue(maxsize=11)
+    wanted = np.asarray(wanted, dtype=np.float64)
+    order = np.argsort(-wanted, kind="stable")
 
-    for doc_id, vector in data.items():
-        cos_sim = count_cos_sim(vector, wanted)
-        top_docs.put((cos_sim, doc_id))
+    if mass is not None:
+        squares = np.cumsum(wanted[order] ** 2)
+        total = squares[-1] if len(squares) else 0
+        needed = np.searchsorted(squares, mass * total * (1 - 1e-12)) + 1
+        order = order[:needed]
+    if max_terms is not None:
+        order = order[:max_terms]
 
-        if top_docs.full():
-            top_docs.get()
+    return [terms[i] for i in order], wanted[order]
 
-    if top_docs.full():
-        top_docs.get()
 
-    res = []
-    while not top_docs.empty():
-        res.append(top_docs.get())
+@metrics.timed("find_pages")
+def find_pages(
+    db: WikiDatabase,
+    terms: List[str],
+    wanted: np.array = None,
+    k: int = TOP_K,
+    posting_limit: int | None = None,
+    timer: StageTimer | None = None,
+) -> List[Tuple[float, int]]:
+    """
+    Returns top k documents for the terms given
+    using the document norms stored in the database
+    posting_limit - use only the postings with the highest weight of each term
+    timer - counts the time spent in the fetch, assembly, scoring and top_k stages
+    """
 
-    return res[::-1]  # swap
+    vectors = find_vectors(db, terms, posting_limit, timer)
+    with timed_stage(timer, "fetch"):
+        norms = db.get_doc_norms(list(vectors.keys()))
+    return search(vectors, wanted, k, norms, timer)
@@ -78,3 +78,69 @@ def test_search() -> None:
     assert doc_ids == [3, 2, 1]
 
     assert se.search({}) == []
+
+
+def test_search_top_k() -> None:
+    """Tests returning other number of documents than 10"""
+
+    data = {i: np.array([i, 10 - i]) for i in range(1, 10)}
+    wanted = np.array([1, 0])
+
+    doc_ids = [x[1] for x in se.search(data, wanted, k=3)]
+    assert doc_ids == [9, 8, 7]
+
+    doc_ids = [x[1] for x in se.search(data, wanted, k=20)]
+    assert doc_ids == list(range(9, 0, -1))
+
+    assert se.search(data, wanted, k=0) == []
+
+
+def test_cos_sims() -> None:
+    """Tests counting cosine similarity of more vectors at once"""
+
+    vectors = np.array([[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0, 0, 0]])
+    wanted = np.array([1, 1, 1])
+
+    sims = se.count_cos_sims(vectors, wanted)
+    for i in range(len(vectors)):
+        assert round(sims[i], 6) == round(se.count_cos_sim(vectors[i], wanted), 6)
+
+
+@run_with_db
+def test_find_pages(db: WikiDatabase) -> None:
+    """Tests the norms of the whole documents are used"""
+
+    term_ids = [db.insert_term(x) for x in ["t1", "t2"]]
+    doc_ids = [db.insert_document(x, "body") for x in ["d1", "d2"]]
+
+    db.insert_value(term_ids[0], doc_ids[0], 1)
+    db.insert_value(term_ids[0], doc_ids[1], 1)
+    db.insert_value(term_ids[1], doc_ids[1], 1)
+
+    # partial vectors are the same
+    pages = se.find_pages(db, ["t1"])
+    assert [round(x[0], 2) for x in pages] == [1, 1]
+
+    db.update_doc_norms()
+    pages = se.find_pages(db, ["t1"])
+    assert [x[1] for x in pages] == [doc_ids[0], doc_ids[1]]
+    assert round(pages[1][0], 2) == round(1 / np.sqrt(2), 2)
+
+
+def test_prune_query() -> None:
+    """Tests keeping only the terms with the highest weight"""
+
+    terms = ["t1", "t2", "t3", "t4"]
+    wanted = np.array([0.1, 0.4, 0.2, 0.8])
+
+    assert se.prune_query(terms, wanted)[0] == ["t4", "t2", "t3", "t1"]
+
+    kept, weights = se.prune_query(terms, wanted, max_terms=2)
+    assert kept == ["t4", "t2"]
+    assert list(weights) == [0.8, 0.4]
+
+    # 0.64 + 0.16 is 0.8 of 0.85
+    assert se.prune_query(terms, wanted, mass=0.95)[0] == ["t4", "t2", "t3"]
+    assert se.prune_query(terms, wanted, mass=0.8 / 0.85)[0] == ["t4", "t2"]
+    assert se.prune_query(terms, wanted, max_terms=1, mass=0.9)[0] == ["t4"]
+    assert se.prune_query([], np.array([]), 5, 0.5)[0] == []
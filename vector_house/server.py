@@ -0,0 +1,211 @@
+import asyncio
+from typing import List, Tuple
+from aiohttp import web
+from scipy.sparse import csr_matrix
+
+from vector_house.database import WikiDatabase
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.mmap_index import MmapIndex
+from vector_house.search_engine import TOP_K
+from vector_house.defaults import BATCH_SIZE, BATCH_WAIT
+import vector_house.metrics as metrics
+
+# Max number of results a client can ask for
+MAX_TOP = 1000
+# Upper bounds of the batch size histogram buckets
+BATCH_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+class QueryBatcher:
+    """
+    Collects queries arriving at about the same time into batches,
+    each batch is scored against the matrix by one product in the executor.
+    Has to be used from the event loop thread only.
+    """
+
+    def __init__(
+        self,
+        engine: MatrixEngine,
+        batch_size: int = BATCH_SIZE,
+        batch_wait: float = BATCH_WAIT,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pending: List[Tuple[csr_matrix, int, asyncio.Future]] = []
+        self.timer: asyncio.TimerHandle | None = None
+        self.batches = 0
+        self.queries = 0
+
+    async def search(
+        self, query: csr_matrix, k: int = TOP_K
+    ) -> List[Tuple[float, int]]:
+        """Returns top k documents for the query row, see MatrixEngine.query_row"""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((query, k, future))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.batch_wait, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        """Sends the pending queries to the executor as a single batch"""
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        self.batches += 1
+        self.queries += len(batch)
+        metrics.observe("server_batch_size", len(batch), BATCH_BUCKETS)
+        k = max(x[1] for x in batch)
+        task = asyncio.get_running_loop().run_in_executor(
+            None, self.engine.search_many, [x[0] for x in batch], k
+        )
+        task.add_done_callback(lambda x: self.resolve(batch, x))
+
+    @staticmethod
+    def resolve(batch, task: asyncio.Future) -> None:
+        """Passes the results of the batch to the waiting queries"""
+
+        for i, (_, k, future) in enumerate(batch):
+            if future.done():  # the client has gone away
+                continue
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result()[i][:k])
+
+
+class QueryServer:
+    """
+    HTTP/JSON query API, the index is opened once for all the requests
+    Scoring runs in the default executor, so the event loop keeps accepting
+    requests and the concurrent ones get batched by QueryBatcher.
+    """
+
+    def __init__(
+        self,
+        wiki_db: WikiDatabase | MmapIndex,
+        engine: MatrixEngine,
+        batch_size: int = BATCH_SIZE,
+        batch_wait: float = BATCH_WAIT,
+    ):
+        """
+        wiki_db - used to read documents, a DB should be opened read only
+        engine - the index loaded from the same DB or the exported directory
+        """
+        self.wiki_db = wiki_db
+        self.engine = engine
+        self.batcher = QueryBatcher(engine, batch_size, batch_wait)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/search", self.search),
+                web.get("/sim/{doc_id}", self.sim),
+                web.get("/show/{doc_id}", self.show),
+                web.get("/info", self.info),
+                web.get("/metrics", self.get_metrics),
+            ]
+        )
+        return app
+
+    def read_docs(self, doc_ids: List[int]) -> List[Tuple[str, str]]:
+        """Reads the documents, blocks, so it is run in the executor"""
+        if isinstance(self.wiki_db, WikiDatabase):
+            with self.wiki_db.session():
+                return [self.wiki_db.get_doc_by_id(x) for x in doc_ids]
+        return [self.wiki_db.get_doc_by_id(x) for x in doc_ids]
+
+    async def pages_response(self, pages: List[Tuple[float, int]]) -> web.Response:
+        loop = asyncio.get_running_loop()
+        docs = await loop.run_in_executor(None, self.read_docs, [x[1] for x in pages])
+        return web.json_response(
+            {
+                "pages": [
+                    {"doc_id": int(doc_id), "score": float(score), "title": doc[0]}
+                    for (score, doc_id), doc in zip(pages, docs)
+                ]
+            }
+        )
+
+    async def search(self, request: web.Request) -> web.Response:
+        """GET /search?q=some+terms&top=10"""
+
+        terms = request.query.get("q", "").split()
+        if len(terms) == 0:
+            raise web.HTTPBadRequest(text="Empty query")
+
+        query = self.engine.query_row(terms)
+        pages = await self.batcher.search(query, get_top(request))
+        return await self.pages_response(pages)
+
+    async def sim(self, request: web.Request) -> web.Response:
+        """GET /sim/42?top=10"""
+
+        query = self.engine.doc_row(get_doc_id(request))
+        if query is None:
+            raise web.HTTPNotFound(text="Unknown document")
+
+        pages = await self.batcher.search(query, get_top(request))
+        return await self.pages_response(pages)
+
+    async def show(self, request: web.Request) -> web.Response:
+        """GET /show/42"""
+
+        doc_id = get_doc_id(request)
+        if self.engine.doc_row(doc_id) is None:
+            raise web.HTTPNotFound(text="Unknown document")
+
+        loop = asyncio.get_running_loop()
+        docs = await loop.run_in_executor(None, self.read_docs, [doc_id])
+        title, text = docs[0]
+        return web.json_response({"doc_id": doc_id, "title": title, "text": text})
+
+    async def info(self, request: web.Request) -> web.Response:
+        """GET /info"""
+
+        documents, terms = self.engine.get_shape()
+        return web.json_response(
+            {
+                "documents": documents,
+                "terms": terms,
+                "batches": self.batcher.batches,
+                "queries": self.batcher.queries,
+            }
+        )
+
+    async def get_metrics(self, request: web.Request) -> web.Response:
+        """GET /metrics, in the Prometheus text format"""
+        return web.Response(text=metrics.registry.to_prometheus())
+
+
+def get_top(request: web.Request) -> int:
+    try:
+        top = int(request.query.get("top", TOP_K))
+    except ValueError:
+        raise web.HTTPBadRequest(text="top has to be a number")
+    if top <= 0 or top > MAX_TOP:
+        raise web.HTTPBadRequest(text=f"top has to be between 1 and {MAX_TOP}")
+    return top
+
+
+def get_doc_id(request: web.Request) -> int:
+    try:
+        return int(request.match_info["doc_id"])
+    except ValueError:
+        raise web.HTTPBadRequest(text="doc id has to be a number")
+
+
+def run_server(server: QueryServer, host: str, port: int) -> None:
+    """Serves until interrupted"""
+    web.run_app(server.create_app(), host=host, port=port)
@@ -0,0 +1,51 @@
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from vector_house.database import WikiDatabase
+from vector_house.database_test import run_with_db
+from vector_house.matrix_engine import MatrixEngine
+from vector_house.matrix_engine_test import fill_db
+from vector_house.server import QueryServer
+
+
+async def query_server(server: QueryServer) -> None:
+    client = TestClient(TestServer(server.create_app()))
+    await client.start_server()
+    try:
+        # concurrent queries are scored as a single batch
+        responses = await asyncio.gather(
+            client.get("/search", params={"q": "t4", "top": "2"}),
+            client.get("/search", params={"q": "t1 t2"}),
+            client.get("/sim/3"),
+        )
+        results = [await x.json() for x in responses]
+        assert server.batcher.batches == 1
+        assert server.batcher.queries == 3
+
+        score = server.engine.search(["t4"])[0][0]
+        assert results[0]["pages"] == [{"doc_id": 4, "score": score, "title": "d4"}]
+        expected = server.engine.search(["t1", "t2"])
+        assert [x["doc_id"] for x in results[1]["pages"]] == [x[1] for x in expected]
+        expected = server.engine.similar(3)
+        assert [x["doc_id"] for x in results[2]["pages"]] == [x[1] for x in expected]
+
+        response = await client.get("/show/2")
+        assert await response.json() == {"doc_id": 2, "title": "d2", "text": "body"}
+
+        response = await client.get("/info")
+        assert (await response.json())["documents"] == 4
+
+        assert (await client.get("/show/42")).status == 404
+        assert (await client.get("/sim/abc")).status == 400
+        assert (await client.get("/search")).status == 400
+        assert (await client.get("/search?q=t1&top=0")).status == 400
+    finally:
+        await client.close()
+
+
+@run_with_db
+def test_server(db: WikiDatabase) -> None:
+    """Tests the API endpoints and batching of concurrent queries"""
+
+    fill_db(db)
+    server = QueryServer(db, MatrixEngine.from_database(db), batch_wait=0.1)
+    asyncio.run(query_server(server))
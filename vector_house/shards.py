@@ -0,0 +1,264 @@
+import os.path
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple
+import numpy as np
+
+from vector_house.database import (
+    WikiDatabase,
+    POSTING_FLOAT16,
+    META_POSTING_ENCODING,
+    META_GENERATION,
+)
+from vector_house.query_eval import max_score_search
+from vector_house.search_engine import find_pages, top_k, TOP_K
+
+# Number of shards the index was split into, stored in the main DB
+META_SHARDS = "shards"
+# Range of doc ids stored in a shard
+META_SHARD_FIRST = "shard_first"
+META_SHARD_LAST = "shard_last"
+# Set in the main DB once the split documents are dropped from it
+META_SHARDS_ONLY = "shards_only"
+
+
+def shard_path(db_path: str, shard: int) -> str:
+    """Path of the shard DB, wiki-index.db has wiki-index-shard-0.db, ..."""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}-shard-{shard}{ext}"
+
+
+def split_index(wiki_db: WikiDatabase, shards: int, drop: bool = False) -> List[str]:
+    """
+    Splits the index into shard DBs by doc id ranges of the same size
+    Weights are copied as they are, so IDF stays counted over all the documents.
+    Each shard stores it's documents, their values and norms
+    and the terms contained in them with the same term ids.
+    drop - drop the split documents from the main DB, see drop_split
+    Returns paths of the shards
+    """
+
+    if is_shards_only(wiki_db):
+        raise ValueError(f"The documents of {wiki_db.path} were moved to it's shards")
+
+    doc_ids = wiki_db.get_all_doc_ids()
+    shards = max(1, min(shards, len(doc_ids)))
+    encoding = None
+    if wiki_db.has_postings():
+        encoding = wiki_db.get_meta(META_POSTING_ENCODING, POSTING_FLOAT16)
+    # coordinators kept by the web page start new workers for the new shards
+    wiki_db.bump_generation()
+    generation = wiki_db.get_generation()
+    wiki_db.commit()  # a database can not be attached in a transaction
+
+    paths = []
+    for shard, chunk in enumerate(np.array_split(doc_ids, shards)):
+        path = shard_path(wiki_db.path, shard)
+        first, last = (int(chunk[0]), int(chunk[-1])) if len(chunk) else (0, -1)
+        print(f"Creating shard {path} with doc ids {first} - {last}")
+
+        shard_db = WikiDatabase(path)
+        shard_db.drop_if_exists()
+        shard_db.create_database()
+        shard_db.close()
+
+        copy_documents(wiki_db, path, first, last)
+
+        shard_db = WikiDatabase(path)
+        if encoding is not None:
+            shard_db.build_postings(encoding)
+        shard_db.update_term_bounds()
+        shard_db.set_meta(META_SHARD_FIRST, first)
+        shard_db.set_meta(META_SHARD_LAST, last)
+        shard_db.set_meta(META_GENERATION, generation)
+        shard_db.create_index()
+        shard_db.commit()
+        shard_db.close()
+        paths.append(path)
+
+    wiki_db.set_meta(META_SHARDS, shards)
+    wiki_db.commit()
+    if drop:
+        drop_split(wiki_db)
+    return paths
+
+
+def drop_split(wiki_db: WikiDatabase) -> None:
+    """
+    Drops the documents copied to the shards from the main DB and everything
+    counted from them, the main DB then keeps only the terms and the meta,
+    so the index is stored once. It can only be queried by ShardedIndex then,
+    appending and splitting it again need the index to be built again.
+    """
+
+    print(f"Dropping the split documents from {wiki_db.path}")
+    cur = wiki_db.con.cursor()
+    for table in ["value", "doc_norm", "document"]:
+        cur.execute(f""" DELETE FROM {table}; """)
+    cur.execute(""" DROP TABLE IF EXISTS term_bound; """)
+    wiki_db.drop_posting_table()
+    wiki_db.drop_frequency_tables()
+    wiki_db.drop_similar_table()
+    wiki_db.drop_embedding_tables()
+    wiki_db.set_meta(META_SHARDS_ONLY, 1)
+    wiki_db.bump_generation()
+    wiki_db.commit()
+    # the freed pages are given back, so the file shrinks
+    wiki_db.con.execute(""" VACUUM; """)
+
+
+def is_shards_only(wiki_db: WikiDatabase) -> bool:
+    """Checks if the documents were dropped from the main DB by drop_split"""
+    return wiki_db.get_meta(META_SHARDS_ONLY, "0") == "1"
+
+
+def copy_documents(wiki_db: WikiDatabase, path: str, first: int, last: int) -> None:
+    """
+    Copies documents in the doc id range and all the related rows
+    to the empty shard DB given
+    """
+
+    cur = wiki_db.con.cursor()
+    cur.execute(""" ATTACH DATABASE ? AS shard; """, [path])
+    try:
+        cur.execute(
+            """
+INSERT INTO shard.document(doc_id, title, text)
+SELECT doc_id, title, text FROM document WHERE doc_id BETWEEN ? AND ?;
+                    """,
+            [first, last],
+        )
+        cur.execute(
+            """
+INSERT INTO shard.value(doc_id, term_id, value)
+SELECT doc_id, term_id, value FROM value WHERE doc_id BETWEEN ? AND ?;
+                    """,
+            [first, last],
+        )
+        cur.execute(
+            """
+INSERT INTO shard.doc_norm(doc_id, norm)
+SELECT doc_id, norm FROM doc_norm WHERE doc_id BETWEEN ? AND ?;
+                    """,
+            [first, last],
+        )
+        cur.execute(
+            """
+INSERT INTO shard.term(term_id, name)
+SELECT term_id, name FROM term
+WHERE term_id IN (SELECT DISTINCT term_id FROM shard.value);
+                    """
+        )
+        wiki_db.commit()
+    finally:
+        cur.execute(""" DETACH DATABASE shard; """)
+
+
+# DBs opened by a worker process, one for each shard
+worker_dbs: Dict[str, WikiDatabase] = {}
+
+
+def search_shard(
+    path: str,
+    terms: List[str],
+    wanted: np.array,
+    k: int,
+    max_score: bool,
+    posting_limit: int | None = None,
+) -> List[Tuple[float, int]]:
+    """Runs in a worker process, returns top k documents of a single shard"""
+
+    if path not in worker_dbs:
+        worker_dbs[path] = WikiDatabase(path, read_only=True, pool_size=1)
+    db = worker_dbs[path]
+
+    with db.session():
+        if max_score:
+            return max_score_search(db, terms, wanted, k)
+        return find_pages(db, terms, wanted, k, posting_limit)
+
+
+class ShardedIndex:
+    """
+    Coordinator of an index split by split_index
+    Queries are sent to all the shards at once, each shard is searched
+    by a worker process and the top k documents of the shards are merged.
+    Documents are read from the shard containing them.
+    Starting the workers takes a while, so a coordinator should be kept
+    for all the queries, as the web page does. The CLI starts it for each query.
+    """
+
+    def __init__(
+        self, db_path: str, workers: int | None = None, read_only: bool = False
+    ):
+        """
+        db_path - the main DB the shards were split from
+        workers - number of worker processes, one for each shard by default
+        read_only - open the DBs in the serving mode, see WikiDatabase
+        Raises FileNotFoundError if the main DB or a shard is missing
+        """
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"The index {db_path} does not exist")
+        main_db = WikiDatabase(db_path, read_only=read_only, pool_size=1)
+        with main_db.session():
+            shards = int(main_db.get_meta(META_SHARDS, "0"))
+        main_db.close()
+        if shards == 0:
+            raise ValueError(f"The index {db_path} is not split into shards")
+
+        self.paths = [shard_path(db_path, x) for x in range(shards)]
+        # a missing shard would be created empty and miss it's documents
+        for path in self.paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"The shard {path} is missing, split again")
+        self.dbs = [WikiDatabase(x, read_only=read_only) for x in self.paths]
+        firsts = []
+        for db in self.dbs:
+            with db.session():
+                firsts.append(int(db.get_meta(META_SHARD_FIRST, "0")))
+        self.firsts = np.array(firsts, dtype=np.int64)
+        self.pool = ProcessPoolExecutor(workers or shards)
+
+    def close(self) -> None:
+        """Stops the worker processes"""
+        self.pool.shutdown()
+        for db in self.dbs:
+            db.close()
+
+    def find_pages(
+        self,
+        terms: List[str],
+        wanted: np.array = None,
+        k: int = TOP_K,
+        max_score: bool = False,
+        posting_limit: int | None = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns top k documents of all the shards for the terms given
+        posting_limit - as for find_pages, not used by MaxScore
+        """
+
+        futures = [
+            self.pool.submit(
+                search_shard, path, terms, wanted, k, max_score, posting_limit
+            )
+            for path in self.paths
+        ]
+        pages = list(itertools.chain(*[x.result() for x in futures]))
+
+        scores = np.array([x[0] for x in pages], dtype=np.float64)
+        doc_ids = np.array([x[1] for x in pages], dtype=np.int64)
+        return top_k(scores, doc_ids, k)
+
+    def get_shard(self, doc_id: int) -> WikiDatabase:
+        """Gets the shard storing the document"""
+        shard = max(0, int(np.searchsorted(self.firsts, doc_id, side="right")) - 1)
+        return self.dbs[shard]
+
+    def get_doc_by_id(self, doc_id: int) -> Tuple[str, str]:
+        with self.get_shard(doc_id).session() as db:
+            return db.get_doc_by_id(doc_id)
+
+    def get_terms_for_doc(self, doc_id: int) -> Dict[str, np.float32]:
+        with self.get_shard(doc_id).session() as db:
+            return db.get_terms_for_doc(doc_id)
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from vector_house.database import WikiDatabase
+from vector_house.database_test import run_with_db
+from vector_house.query_eval_test import fill_db, assert_same_pages
+from vector_house.search_engine import find_pages
+from vector_house.shards import split_index, shard_path, ShardedIndex
+
+
+@run_with_db
+def test_sharded_search(db: WikiDatabase) -> None:
+    """Tests the merged results of the shards are the same as of the whole index"""
+
+    fill_db(db)
+    generation = db.get_generation()
+    paths = split_index(db, 3)
+    assert paths == [shard_path(db.path, x) for x in range(3)]
+    assert db.get_generation() != generation
+
+    index = ShardedIndex(db.path, workers=2)
+    served = ShardedIndex(db.path, workers=1, read_only=True)
+    try:
+        assert list(index.firsts) == [1, 68, 135]
+        assert index.get_doc_by_id(150) == db.get_doc_by_id(150)
+        assert index.get_terms_for_doc(70) == db.get_terms_for_doc(70)
+
+        for terms in [["t1"], ["t2", "t3", "t3"], ["unknown"]]:
+            expected = find_pages(db, terms)
+            assert_same_pages(index.find_pages(terms), expected)
+            assert_same_pages(index.find_pages(terms, max_score=True), expected)
+
+        doc_terms = db.get_terms_for_doc(7)
+        terms = list(doc_terms.keys())
+        wanted = np.array(list(doc_terms.values()))
+        pages = index.find_pages(terms, wanted, k=20)
+        assert_same_pages(pages, find_pages(db, terms, wanted, k=20))
+
+        # the coordinator of the web page is queried repeatedly
+        assert list(served.firsts) == list(index.firsts)
+        assert served.get_doc_by_id(150) == db.get_doc_by_id(150)
+        for terms in [["t1"], ["t2", "t3"]]:
+            for _ in range(2):
+                assert_same_pages(served.find_pages(terms), find_pages(db, terms))
+    finally:
+        index.close()
+        served.close()
+        for path in paths:
+            os.remove(path)
+
+
+@run_with_db
+def test_drop_split(db: WikiDatabase) -> None:
+    """Tests the main DB keeps no documents, missing shards are not created"""
+
+    fill_db(db)
+    expected = find_pages(db, ["t1"])
+    doc = db.get_doc_by_id(150)
+    paths = split_index(db, 2, drop=True)
+    try:
+        assert db.get_stats()[1:] == (0, 0)
+        # the freed pages are given back by the vacuum
+        assert db.con.execute(""" PRAGMA freelist_count; """).fetchone()[0] == 0
+
+        index = ShardedIndex(db.path, workers=1)
+        try:
+            assert_same_pages(index.find_pages(["t1"]), expected)
+            assert index.get_doc_by_id(150) == doc
+        finally:
+            index.close()
+
+        try:
+            split_index(db, 2)
+            assert False, "split documents split again"
+        except ValueError:
+            pass
+
+        os.remove(paths[1])
+        try:
+            ShardedIndex(db.path, workers=1)
+            assert False, "missing shard opened"
+        except FileNotFoundError:
+            pass
+        assert not os.path.exists(paths[1])
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,106 @@
+import os
+from typing import List, Tuple, Iterator
+from xml.sax.saxutils import escape
+import numpy as np
+
+# Defaults of the generated corpus
+SYNTH_LENGTH = 300
+SYNTH_VOCABULARY = 50000
+# Exponent of the Zipf's law, frequency of the r-th most common term ~ 1 / r^s
+ZIPF_EXPONENT = 1.1
+SYNTH_SEED = 0
+SYNTH_DUMP = "wiki-data/synthwiki-latest-pages-articles-multistream.xml"
+
+CONSONANTS = "bdfgklmnprstvz"
+VOWELS = "aeiou"
+SYLLABLES = [c + v for c in CONSONANTS for v in VOWELS]
+
+
+def make_word(rank: int) -> str:
+    """
+    Creates a pronounceable word of at least two syllables for the rank,
+    different ranks get different words
+    """
+    length = 2
+    while rank >= len(SYLLABLES) ** length:
+        rank -= len(SYLLABLES) ** length
+        length += 1
+
+    syllables = []
+    for _ in range(length):
+        rank, syllable = divmod(rank, len(SYLLABLES))
+        syllables.append(SYLLABLES[syllable])
+    return "".join(syllables)
+
+
+def make_vocabulary(size: int) -> List[str]:
+    return [make_word(x) for x in range(size)]
+
+
+def synthetic_pages(
+    docs: int,
+    length: int = SYNTH_LENGTH,
+    vocabulary: int = SYNTH_VOCABULARY,
+    exponent: float = ZIPF_EXPONENT,
+    seed: int = SYNTH_SEED,
+) -> Iterator[Tuple[int, str, str]]:
+    """
+    Yields id, title and text of the generated pages, the same as read_pages
+    Words are drawn from the vocabulary by the Zipf's law, the length of a page
+    is uniform between half and one and a half of the length given.
+    The same arguments always generate the same pages.
+    """
+
+    rng = np.random.default_rng(seed)
+    words = np.array(make_vocabulary(vocabulary))
+    weights = 1 / np.arange(1, vocabulary + 1) ** exponent
+    cdf = np.cumsum(weights / weights.sum())
+
+    for page_id in range(1, docs + 1):
+        size = int(rng.integers(length // 2, length * 3 // 2 + 1))
+        ranks = np.searchsorted(cdf, rng.random(size), side="right")
+        ranks = np.minimum(ranks, vocabulary - 1)
+        text = " ".join(words[ranks].tolist())
+        yield page_id, f"Page {page_id}", text
+
+
+def write_dump(path: str, pages: Iterator[Tuple[int, str, str]]) -> int:
+    """
+    Writes the pages as a MediaWiki XML export readable by mwxml
+    Returns the number of pages written
+    """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    count = 0
+    with open(path, "w", encoding="utf8") as file:
+        file.write(
+            """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Synthetic Wikipedia</sitename>
+    <dbname>synthwiki</dbname>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+    </namespaces>
+  </siteinfo>
+"""
+        )
+        for page_id, title, text in pages:
+            file.write(
+                f"""  <page>
+    <title>{escape(title)}</title>
+    <ns>0</ns>
+    <id>{page_id}</id>
+    <revision>
+      <id>{page_id}</id>
+      <timestamp>2023-01-01T00:00:00Z</timestamp>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text xml:space="preserve">{escape(text)}</text>
+    </revision>
+  </page>
+"""
+            )
+            count += 1
+        file.write("</mediawiki>\n")
+
+    return count
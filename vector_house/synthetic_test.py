@@ -0,0 +1,50 @@
+import os
+from collections import Counter
+from vector_house.indexer import read_pages
+from vector_house.synthetic import (
+    make_vocabulary,
+    synthetic_pages,
+    write_dump,
+    SYLLABLES,
+)
+
+DUMP_PATH_TEST = "synthwiki-test.xml"
+
+
+def test_vocabulary() -> None:
+    size = len(SYLLABLES) ** 2 + 10
+    vocabulary = make_vocabulary(size)
+    assert len(set(vocabulary)) == size
+    assert vocabulary[0] == "baba"
+    assert len(vocabulary[-1]) == 6
+
+
+def test_synthetic_pages() -> None:
+    """Tests the pages are reproducible and follow the Zipf's law"""
+
+    pages = list(synthetic_pages(200, length=100, vocabulary=1000))
+    assert pages == list(synthetic_pages(200, length=100, vocabulary=1000))
+    assert pages != list(synthetic_pages(200, length=100, vocabulary=1000, seed=1))
+    assert [x[0] for x in pages] == list(range(1, 201))
+    assert len(set(x[1] for x in pages)) == 200
+
+    lengths = [len(x[2].split()) for x in pages]
+    assert min(lengths) >= 50 and max(lengths) <= 150
+
+    vocabulary = make_vocabulary(1000)
+    counts = Counter(" ".join(x[2] for x in pages).split())
+    top = [x[0] for x in counts.most_common(3)]
+    assert top == vocabulary[:3]
+    assert counts[vocabulary[0]] > 1.5 * counts[vocabulary[1]]
+
+
+def test_write_dump() -> None:
+    """Tests the dump is read as the pages written"""
+
+    pages = list(synthetic_pages(5, length=10, vocabulary=50))
+    pages.append((6, "Title <&>", "text with 'markup' & <tags>"))
+    try:
+        assert write_dump(DUMP_PATH_TEST, iter(pages)) == 6
+        assert list(read_pages(DUMP_PATH_TEST)) == pages
+    finally:
+        os.remove(DUMP_PATH_TEST)
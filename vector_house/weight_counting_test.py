@@ -1,6 +1,7 @@
 from vector_house.database import WikiDatabase
 from vector_house.database_test import run_with_db
 import vector_house.indexer as ind
+from vector_house.profiling import StageTimer
 
 
 @run_with_db
@@ -52,3 +53,142 @@ def test_weight_counting(db: WikiDatabase) -> None:
     assert db.get_value_by_ids(earth_id, doc_id1) == 0.58
     assert db.get_value_by_ids(earth_id, doc_id2) == 0.29
     assert db.get_value_by_ids(earth_id, doc_id3) == 0
+
+
+def test_parallel_analysis() -> None:
+    texts = [
+        "Clouds are cool.",
+        "REDIRECT Clouds",
+        "Aerosols directly scatter and absorb radiation.",
+        "Cloud albedo has substantial influence over atmospheric temperatures.",
+    ] * 10
+    pages = [(i, f"Title {i}", text) for i, text in enumerate(texts)]
+
+    serial = list(ind.analyze_pages(iter(pages)))
+    parallel = list(ind.analyze_pages(iter(pages), workers=3))
+
+    assert len(serial) == 30
+    assert serial == parallel
+
+
+def test_analyzer_cache() -> None:
+    analyzer = ind.TextAnalyzer(cache_size=4)
+    text = "Clouds keep Earth cool, clouds are cool."
+
+    freq_dict = analyzer.count_frequencies(text)
+    assert freq_dict == ind.lemmatize_text(text)
+    assert freq_dict["cloud"] == 2
+
+    info = analyzer.lemmatize.cache_info()
+    assert info.hits > 0
+    assert info.currsize <= 4
+
+
+@run_with_db
+def test_external_weights(db: WikiDatabase) -> None:
+    freq_dicts = [
+        {"cloud": 4, "earth": 2, "albedo": 1},
+        {"cloud": 1, "earth": 1, "aerosol": 5},
+        {"cloud": 1, "cool": 1},
+        {"aerosol": 1, "cool": 2, "earth": 3},
+    ]
+
+    def load(top_docs: int, external: bool) -> list:
+        db.drop_database()
+        db.create_database()
+        loader = db.bulk_loader(batch_size=3, memory_budget=500)
+
+        terms = set()
+        absolute_freq = {}
+        db.create_frequency_table()
+        for i, freq_dict in enumerate(freq_dicts):
+            doc_id = loader.insert_document(f"Title {i}", "Text")
+            if external:
+                ind.stage_frequencies(freq_dict, doc_id, loader)
+            else:
+                ind.update_abs_freq(freq_dict, terms, doc_id, absolute_freq, loader)
+
+        loader.flush()
+        if external:
+            ind.frequencies_to_db(db, len(freq_dicts), top_docs)
+        else:
+            relative_freq = ind.count_relative_freq(absolute_freq, terms)
+            ind.weights_to_db(db, relative_freq, terms, len(freq_dicts), top_docs)
+
+        res = db.con.execute("SELECT term_id, doc_id, value FROM value")
+        return sorted(res.fetchall())
+
+    for top_docs in [0, 1, 2]:
+        assert load(top_docs, True) == load(top_docs, False)
+
+
+@run_with_db
+def test_append_index(db: WikiDatabase) -> None:
+    pages = [
+        (1, "Clouds", "cloud earth", {"cloud": 4, "earth": 2}),
+        (2, "Aerosol", "cloud aerosol", {"cloud": 1, "aerosol": 5}),
+        (3, "Test", "cloud cool", {"cloud": 1, "cool": 1}),
+    ]
+    updates = [
+        pages[0],
+        (2, "Aerosol", "aerosol earth", {"aerosol": 2, "earth": 1}),
+        (4, "Earth", "earth", {"earth": 3}),
+        # a page repeated in the same append
+        (4, "Earth", "earth cool", {"earth": 3, "cool": 2}),
+    ]
+
+    assert ind.build_index(iter(pages), 10, 0, db, limit=5, appendable=True) == 3
+    assert int(db.get_meta(ind.META_LIMIT)) == 5
+    doc_id = db.get_doc_id("Aerosol")
+
+    assert ind.append_index(iter(updates), 10, db, refresh_drift=1) == (1, 2)
+    assert db.count_dirty_terms() == 0
+    assert db.get_doc_id("Aerosol") == doc_id
+    assert db.get_doc_by_id(doc_id)[1] == "aerosol earth"
+    appended = db.con.execute("SELECT term_id, doc_id, value FROM value").fetchall()
+    norms = db.get_doc_norms([1, 2, 3, 4])
+
+    ind.refresh_index(db)
+    refreshed = db.con.execute("SELECT term_id, doc_id, value FROM value").fetchall()
+    refreshed_norms = db.get_doc_norms([1, 2, 3, 4])
+
+    final = [pages[0], updates[1], pages[2], updates[3]]
+    ind.build_index(iter(final), 10, 0, db, appendable=True)
+    rebuilt = db.con.execute("SELECT term_id, doc_id, value FROM value").fetchall()
+
+    # terms of the pages changed have the same weights as after a rebuild
+    for term in ["cloud", "aerosol", "earth", "cool"]:
+        term_id = db.get_term_id(term)
+        assert sorted(x for x in appended if x[0] == term_id) == sorted(
+            x for x in rebuilt if x[0] == term_id
+        )
+    assert norms == db.get_doc_norms([1, 2, 3, 4])
+    # all the terms have the same weights as after a rebuild once refreshed
+    assert sorted(refreshed) == sorted(rebuilt)
+    assert refreshed_norms == db.get_doc_norms([1, 2, 3, 4])
+
+    # the document count changed by a third, so all the weights are counted
+    ind.build_index(iter(pages), 10, 0, db, appendable=True)
+    ind.append_index(iter(updates), 10, db)
+    appended = db.con.execute("SELECT term_id, doc_id, value FROM value").fetchall()
+    assert sorted(appended) == sorted(rebuilt)
+
+
+@run_with_db
+def test_build_stages(db: WikiDatabase) -> None:
+    """Tests the stages of the build are timed"""
+
+    pages = [
+        (1, "Clouds", "cloud earth", {"cloud": 4, "earth": 2}),
+        (2, "Aerosol", "cloud aerosol", {"cloud": 1, "aerosol": 5}),
+    ]
+
+    for external in [False, True]:
+        timer = StageTimer()
+        ind.build_index(iter(pages), 10, 0, db, external=external, timer=timer)
+        assert set(timer.times.keys()) <= set(ind.INDEX_STAGES)
+        assert "documents_to_db" in timer.times
+        assert "finish" in timer.times
+        assert ("update_abs_freq" in timer.times) != external
+        # frequencies are kept only by an appendable index
+        assert not db.has_frequencies()